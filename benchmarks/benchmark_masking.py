@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Compare the NumPy masking engine with create_masked_lm_predictions: speed and distribution.
+
+Both engines mask the same synthetic sequences many times. The script fails if the number of
+predictions per sequence, the masked positions or the [MASK]/keep/random proportions of the two
+engines differ by more than a 4 sigma test.
+"""
+
+import sys
+import math
+import time
+import random
+import argparse
+from array import array
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np
+import masked_lm
+import create_pretraining_data
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--num-sequences", type=int, default=20000, help='number of sequences to mask')
+parser.add_argument("--max-seq-length", type=int, default=128, help='max_seq_length')
+parser.add_argument("--max-predictions-per-seq", type=int, default=20, help='max_predictions_per_seq')
+parser.add_argument("--masked-lm-prob", type=float, default=0.15, help='masked_lm_prob')
+parser.add_argument("--vocab-size", type=int, default=32000, help='vocabulary size')
+parser.add_argument("--seed", type=int, default=12345, help='random seed')
+args = parser.parse_args()
+
+cls_id, sep_id, mask_id = 0, 1, 2
+
+# sequences like the generated ones: [CLS] A [SEP] B [SEP], 10% of them shorter
+data_rng = random.Random(args.seed)
+sequences = []
+for _ in range(args.num_sequences):
+    length = args.max_seq_length if data_rng.random() >= 0.1 else data_rng.randint(5, args.max_seq_length)
+    a_length = data_rng.randint(1, length - 4)
+    ids = [data_rng.randint(3, args.vocab_size - 1) for _ in range(length - 3)]
+    sequences.append([cls_id] + ids[:a_length] + [sep_id] + ids[a_length:] + [sep_id])
+
+
+def python_engine():
+    rng = random.Random(args.seed)
+    vocab_info = create_pretraining_data.VocabInfo(size=args.vocab_size, cls_id=cls_id, sep_id=sep_id,
+                                                   mask_id=mask_id, typecode='H')
+    results = []
+    for ids in sequences:
+        output_ids, positions, _ = create_pretraining_data.create_masked_lm_predictions(
+            array('H', ids), args.masked_lm_prob, args.max_predictions_per_seq, vocab_info, rng)
+        results.append((list(positions), [output_ids[p] for p in positions]))
+    return results
+
+
+def numpy_engine():
+    rng = np.random.default_rng(args.seed)
+    input_ids = np.zeros((len(sequences), args.max_seq_length), dtype=np.int64)
+    input_mask = np.zeros_like(input_ids)
+    for i, ids in enumerate(sequences):
+        input_ids[i, :len(ids)] = ids
+        input_mask[i, :len(ids)] = 1
+    start = time.perf_counter()
+    output_ids, positions, _, weights = masked_lm.create_masked_lm_predictions_batch(
+        input_ids, input_mask, args.masked_lm_prob, args.max_predictions_per_seq,
+        args.vocab_size, mask_id, [cls_id, sep_id], rng)
+    elapsed = time.perf_counter() - start
+    results = []
+    for i in range(len(sequences)):
+        p = positions[i, :int(weights[i].sum())].tolist()
+        results.append((p, output_ids[i, p].tolist()))
+    return elapsed, results
+
+
+def statistics(results):
+    """Predictions per sequence, histogram of masked positions and the [MASK]/keep/random counts."""
+    counts = [len(positions) for positions, _ in results]
+    histogram = np.zeros(args.max_seq_length, dtype=np.int64)
+    replacements = np.zeros(3, dtype=np.int64)
+    for (positions, tokens), ids in zip(results, sequences):
+        for p, token in zip(positions, tokens):
+            histogram[p] += 1
+            if token == mask_id:
+                replacements[0] += 1
+            elif token == ids[p]:
+                replacements[1] += 1
+            else:
+                replacements[2] += 1
+    return counts, histogram, replacements
+
+
+start = time.perf_counter()
+python_results = python_engine()
+python_time = time.perf_counter() - start
+numpy_time, numpy_results = numpy_engine()
+
+print('%i sequences of max length %i' % (len(sequences), args.max_seq_length))
+print('python engine: %.3fs, %.0f sequences/s' % (python_time, len(sequences) / python_time))
+print('numpy engine: %.3fs, %.0f sequences/s' % (numpy_time, len(sequences) / numpy_time))
+print('speedup: %.1fx' % (python_time / numpy_time))
+
+python_counts, python_histogram, python_replacements = statistics(python_results)
+numpy_counts, numpy_histogram, numpy_replacements = statistics(numpy_results)
+failures = []
+
+if python_counts != numpy_counts:
+    failures.append('number of predictions per sequence differs')
+
+# two sample chi-square test of the masked position histograms
+observed = np.array([python_histogram, numpy_histogram], dtype=np.float64)
+observed = observed[:, observed.sum(axis=0) > 0]
+expected = observed.sum(axis=1, keepdims=True) * observed.sum(axis=0, keepdims=True) / observed.sum()
+chi2 = ((observed - expected) ** 2 / expected).sum()
+dof = observed.shape[1] - 1
+chi2_threshold = dof + 4 * math.sqrt(2 * dof)
+print('masked positions: chi2=%.1f dof=%i threshold=%.1f' % (chi2, dof, chi2_threshold))
+if chi2 > chi2_threshold:
+    failures.append('masked position distribution differs')
+
+# two proportion z tests of [MASK]/keep/random
+for name, a, b in zip(['[MASK]', 'keep', 'random'], python_replacements, numpy_replacements):
+    n1, n2 = python_replacements.sum(), numpy_replacements.sum()
+    p1, p2, p = a / n1, b / n2, (a + b) / (n1 + n2)
+    z = (p1 - p2) / math.sqrt(p * (1 - p) * (1 / n1 + 1 / n2))
+    print('%s: python %.4f numpy %.4f z=%.2f' % (name, p1, p2, z))
+    if abs(z) > 4:
+        failures.append('%s proportion differs' % name)
+
+if failures:
+    print('FAILED: %s' % ', '.join(failures))
+    sys.exit(1)
+print('distributions match')
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Benchmark the stages of the pre-training data pipeline on a synthetic corpus.
+
+Generates a synthetic Cyrillic-Mongolian corpus of `--corpus-mb` megabytes, trains a tiny SentencePiece
+model on it and runs the stages of `create_pretraining_data.py` one after another:
+
+  reading                lines/s and MB/s of `iter_lines`
+  tokenizing             lines/s of `tokenize_lines` (tokens/s as well)
+  instance_building      instances/s of `generate_training_instances` without masking
+  masking                instances/s of `create_masked_lm_predictions`
+  masking_numpy          instances/s of the NumPy masking engine
+  serialization          instances/s and MB/s of writing TFRecords
+  serialization_numpy    instances/s and MB/s of writing NumPy shards
+
+with the peak RSS during every stage. The stages are run `--repeat` times and the fastest run of every
+stage is kept, which makes the numbers less noisy; still, compare runs made on the same idle machine. The results are written as JSON with `--output`. Given the JSON
+of an earlier run with `--baseline`, the script fails if the throughput of any stage dropped by more
+than `--max-regression`.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+from array import array
+from os.path import abspath, dirname, join, getsize
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np
+import sentencepiece as spm
+from absl import logging
+
+import tfrecord_io
+import create_pretraining_data
+import tokenization_sentencepiece as tokenization
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--corpus-mb", type=float, default=10, help='size of the synthetic corpus in MB')
+parser.add_argument("--vocab-size", type=int, default=2000, help='vocabulary size of the SentencePiece model')
+parser.add_argument("--max-seq-length", type=int, default=128, help='max_seq_length')
+parser.add_argument("--max-predictions-per-seq", type=int, default=20, help='max_predictions_per_seq')
+parser.add_argument("--dupe-factor", type=int, default=1, help='dupe_factor')
+parser.add_argument("--num-workers", type=int, default=1, help='number of tokenization processes')
+parser.add_argument("--seed", type=int, default=12345, help='random seed')
+parser.add_argument("--repeat", type=int, default=3, help='number of runs of every stage, the fastest one counts')
+parser.add_argument("--work-dir", default=None, help='directory for the corpus, model and outputs, kept if given')
+parser.add_argument("--output", default=None, help='JSON file to write the results to')
+parser.add_argument("--baseline", default=None, help='JSON file of an earlier run to compare with')
+parser.add_argument("--max-regression", type=float, default=0.1,
+                    help='maximum allowed relative throughput drop against the baseline')
+args = parser.parse_args()
+
+# Mongolian Cyrillic letters
+VOWELS = 'аэиоуөүяеёю'
+CONSONANTS = 'бвгджзйклмнпрстфхцчшщ'
+SUFFIXES = ['ын', 'ийн', 'ыг', 'ийг', 'д', 'т', 'аас', 'ээс', 'тай', 'тэй', 'ууд', 'үүд', 'ч', 'гүй']
+SHORT_SEQ_PROB = 0.1
+MASKED_LM_PROB = 0.15
+
+
+def make_corpus(path, size, rng):
+    """Writes documents of sentences of Zipf distributed words, one sentence per line and a blank line
+    between documents, until the file has `size` bytes."""
+    words = []
+    for _ in range(20000):
+        word = ''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS) + (rng.choice(CONSONANTS) if rng.random() < 0.5 else '')
+                       for _ in range(rng.choice([1, 1, 2, 2, 2, 3, 3, 4])))
+        words.append(word)
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < size:
+            lines = []
+            for _ in range(rng.randint(3, 30)):
+                sentence = rng.choices(words, weights, k=rng.randint(5, 25))
+                sentence = [w + rng.choice(SUFFIXES) if rng.random() < 0.3 else w for w in sentence]
+                line = ' '.join(sentence).capitalize() + rng.choice('...!?') + '\n'
+                lines.append(line)
+            text = ''.join(lines) + '\n'
+            f.write(text)
+            written += len(text.encode('utf-8'))
+
+
+def train_sentencepiece(corpus_file, prefix, vocab_size):
+    spm.SentencePieceTrainer.Train(
+        '--input=%s --model_prefix=%s --vocab_size=%d --control_symbols=[PAD],[CLS],[SEP],[MASK] '
+        '--input_sentence_size=200000 --shuffle_input_sentence=true --minloglevel=2'
+        % (corpus_file, prefix, vocab_size))
+
+
+def _rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        # peak so far, in KB on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Stage(object):
+    """Times a stage and samples the RSS of the process while it runs."""
+
+    def __init__(self, name):
+        self.name = name
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss())
+            self._stop.wait(0.005)
+
+    def __enter__(self):
+        self.peak_rss = _rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, _rss())
+
+    def result(self, items, unit, num_bytes=None, **extra):
+        result = {'seconds': round(self.seconds, 4), 'items': items, 'unit': unit,
+                  'items_per_second': round(items / self.seconds, 2),
+                  'peak_rss_mb': round(self.peak_rss / 2 ** 20, 1)}
+        if num_bytes is not None:
+            result['mb_per_second'] = round(num_bytes / 2 ** 20 / self.seconds, 3)
+        result.update(extra)
+        print('%-20s %10.3fs %12.1f %-10s %8.1f MB peak RSS' % (self.name, self.seconds, result['items_per_second'],
+                                                               unit + '/s', result['peak_rss_mb']))
+        return result
+
+
+def copy_unmasked(instances):
+    return [create_pretraining_data.TrainingInstance(array(i.token_ids.typecode, i.token_ids), i.segment_a_length,
+                                                     array('H'), array(i.token_ids.typecode), i.is_random_next)
+            for i in instances]
+
+
+def output_size(path):
+    if os.path.isdir(path):
+        return sum(getsize(join(path, name)) for name in os.listdir(path))
+    return getsize(path)
+
+
+def run(work_dir):
+    corpus_file = join(work_dir, 'corpus.txt')
+    prefix = join(work_dir, 'tiny')
+    if not os.path.exists(corpus_file):
+        print('writing %.1f MB synthetic corpus...' % args.corpus_mb)
+        make_corpus(corpus_file, int(args.corpus_mb * 2 ** 20), random.Random(args.seed))
+    if not os.path.exists(prefix + '.model'):
+        print('training SentencePiece model with %d pieces...' % args.vocab_size)
+        train_sentencepiece(corpus_file, prefix, args.vocab_size)
+    tokenizer = tokenization.FullTokenizer(model_file=prefix + '.model', vocab_file=prefix + '.vocab',
+                                           do_lower_case=True)
+    vocab_info = create_pretraining_data.get_vocab_info(tokenizer)
+    stages = {}
+
+    with Stage('reading') as stage:
+        lines = list(create_pretraining_data.iter_lines([corpus_file]))
+    stages['reading'] = stage.result(len(lines), 'lines', getsize(corpus_file))
+
+    with Stage('tokenizing') as stage:
+        token_ids = list(create_pretraining_data.tokenize_lines(lines, tokenizer, args.num_workers))
+    num_tokens = sum(len(ids) for ids in token_ids if ids)
+    stages['tokenizing'] = stage.result(len(lines), 'lines', tokens_per_second=round(num_tokens / stage.seconds, 1))
+    del lines
+
+    documents = []
+    document = []
+    for ids in token_ids:
+        if ids is None:
+            if document:
+                documents.append(document)
+            document = []
+        elif ids:
+            document.append(ids)
+    if document:
+        documents.append(document)
+    del token_ids
+    rng = random.Random(args.seed)
+    rng.shuffle(documents)
+
+    with Stage('instance_building') as stage:
+        instances = list(create_pretraining_data.generate_training_instances(
+            documents, vocab_info, args.max_seq_length, args.dupe_factor, SHORT_SEQ_PROB, MASKED_LM_PROB,
+            args.max_predictions_per_seq, rng, mask_tokens=False))
+    stages['instance_building'] = stage.result(len(instances), 'instances')
+
+    numpy_instances = copy_unmasked(instances)
+    with Stage('masking') as stage:
+        for instance in instances:
+            (instance.token_ids, instance.masked_lm_positions,
+             instance.masked_lm_ids) = create_pretraining_data.create_masked_lm_predictions(
+                 instance.token_ids, MASKED_LM_PROB, args.max_predictions_per_seq, vocab_info, rng)
+    stages['masking'] = stage.result(len(instances), 'instances')
+
+    with Stage('masking_numpy') as stage:
+        numpy_instances = list(create_pretraining_data.mask_instances_in_batches(
+            numpy_instances, vocab_info, args.max_seq_length, MASKED_LM_PROB, args.max_predictions_per_seq,
+            np.random.default_rng(args.seed)))
+    stages['masking_numpy'] = stage.result(len(numpy_instances), 'instances')
+    del numpy_instances
+
+    for name, output_format, output_file in [('serialization', 'tfrecord', join(work_dir, 'out.tfrecord')),
+                                             ('serialization_numpy', 'numpy', join(work_dir, 'out.shard'))]:
+        with Stage(name) as stage:
+            create_pretraining_data.write_instance_to_example_files(
+                instances, tokenizer, args.max_seq_length, args.max_predictions_per_seq, [output_file],
+                output_format)
+        stages[name] = stage.result(len(instances), 'instances', output_size(output_file))
+
+    return {
+        'config': {k: v for k, v in vars(args).items() if k not in ('work_dir', 'output', 'baseline', 'repeat')},
+        'corpus': {'bytes': getsize(corpus_file), 'documents': len(documents), 'tokens': num_tokens},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'numpy': np.__version__, 'sentencepiece': getattr(spm, '__version__', None),
+                        'crc32c': tfrecord_io.CRC32C_IMPLEMENTATION, 'cpu_count': os.cpu_count()},
+        'stages': stages,
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Prints the throughput change of every stage; returns the names of the stages that regressed."""
+    if baseline['config'] != results['config']:
+        print('warning: the baseline was run with a different configuration %s' % baseline['config'])
+    regressions = []
+    print('\n%-20s %12s %12s %8s' % ('stage', 'baseline/s', 'current/s', 'change'))
+    for name, stage in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        before = baseline['stages'][name]['items_per_second']
+        after = stage['items_per_second']
+        change = after / before - 1
+        regressed = change < -max_regression
+        if regressed:
+            regressions.append(name)
+        print('%-20s %12.1f %12.1f %+7.1f%%%s' % (name, before, after, 100 * change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+logging.set_verbosity(logging.WARNING)
+work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark_pipeline.')
+if not os.path.exists(work_dir):
+    os.makedirs(work_dir)
+try:
+    results = None
+    for i in range(args.repeat):
+        print('run %i of %i' % (i + 1, args.repeat))
+        run_results = run(work_dir)
+        if results is None:
+            results = run_results
+            continue
+        for name, stage in run_results['stages'].items():
+            if stage['items_per_second'] > results['stages'][name]['items_per_second']:
+                stage['peak_rss_mb'] = max(stage['peak_rss_mb'], results['stages'][name]['peak_rss_mb'])
+                results['stages'][name] = stage
+    results['repeat'] = args.repeat
+finally:
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results written to %s' % args.output)
+
+if args.baseline:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.max_regression)
+    if regressions:
+        print('\nthroughput of %s dropped by more than %.0f%%' % (', '.join(regressions), 100 * args.max_regression))
+        sys.exit(1)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Round-trip and benchmark the built-in TFRecord writer for pre-training examples.
+
+Writes synthetic examples of the BERT pre-training schema with `tfrecord_io`, reads them back with
+the built-in reader and, if TensorFlow is installed, with `tf.data.TFRecordDataset` and
+`tf.io.parse_single_example` using the feature spec of BERT's `run_pretraining.py`. Fails if any
+value differs. With TensorFlow, the TensorFlow writer is timed as well.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import collections
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import tfrecord_io
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--num-examples", type=int, default=10000, help='number of examples to write')
+parser.add_argument("--max-seq-length", type=int, default=128, help='max_seq_length')
+parser.add_argument("--max-predictions-per-seq", type=int, default=20, help='max_predictions_per_seq')
+parser.add_argument("--seed", type=int, default=12345, help='random seed')
+args = parser.parse_args()
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+rng = random.Random(args.seed)
+examples = []
+for _ in range(args.num_examples):
+    length = rng.randint(5, args.max_seq_length)
+    num_predictions = rng.randint(1, min(length, args.max_predictions_per_seq))
+    pad = args.max_seq_length - length
+    pred_pad = args.max_predictions_per_seq - num_predictions
+    features = collections.OrderedDict()
+    features['input_ids'] = [rng.randint(0, 31999) for _ in range(length)] + [0] * pad
+    features['input_mask'] = [1] * length + [0] * pad
+    features['segment_ids'] = [0] * (length // 2) + [1] * (length - length // 2) + [0] * pad
+    features['masked_lm_positions'] = sorted(rng.sample(range(length), num_predictions)) + [0] * pred_pad
+    features['masked_lm_ids'] = [rng.randint(0, 31999) for _ in range(num_predictions)] + [0] * pred_pad
+    features['masked_lm_weights'] = [1.0] * num_predictions + [0.0] * pred_pad
+    features['next_sentence_labels'] = [rng.randint(0, 1)]
+    examples.append(features)
+
+
+def to_features(example):
+    return collections.OrderedDict(
+        (name, tfrecord_io.FloatFeature(values) if name == 'masked_lm_weights' else tfrecord_io.Int64Feature(values))
+        for name, values in example.items())
+
+
+output_dir = tempfile.mkdtemp()
+path = join(output_dir, 'builtin.tfrecord')
+start = time.perf_counter()
+with tfrecord_io.TFRecordWriter(path) as writer:
+    for example in examples:
+        writer.write(tfrecord_io.serialize_example(to_features(example)))
+builtin_time = time.perf_counter() - start
+print('%i examples, %i bytes' % (len(examples), os.path.getsize(path)))
+print('crc32c: %s' % tfrecord_io.CRC32C_IMPLEMENTATION)
+print('builtin writer: %.3fs, %.0f examples/s' % (builtin_time, len(examples) / builtin_time))
+
+failures = 0
+read_back = [tfrecord_io.parse_example(record) for record in tfrecord_io.tf_record_iterator(path)]
+for example, features in zip(examples, read_back):
+    if {name: list(f.values) for name, f in features.items()} != example:
+        failures += 1
+if len(read_back) != len(examples):
+    failures += 1
+print('builtin reader: %i mismatches' % failures)
+
+if tf is not None:
+    tf1 = tf.compat.v1 if hasattr(tf, 'compat') else tf
+    name_to_features = {
+        'input_ids': tf1.FixedLenFeature([args.max_seq_length], tf.int64),
+        'input_mask': tf1.FixedLenFeature([args.max_seq_length], tf.int64),
+        'segment_ids': tf1.FixedLenFeature([args.max_seq_length], tf.int64),
+        'masked_lm_positions': tf1.FixedLenFeature([args.max_predictions_per_seq], tf.int64),
+        'masked_lm_ids': tf1.FixedLenFeature([args.max_predictions_per_seq], tf.int64),
+        'masked_lm_weights': tf1.FixedLenFeature([args.max_predictions_per_seq], tf.float32),
+        'next_sentence_labels': tf1.FixedLenFeature([1], tf.int64),
+    }
+    tf_failures = 0
+    num_read = 0
+    for example, record in zip(examples, tf.data.TFRecordDataset(path)):
+        parsed = tf.io.parse_single_example(record, name_to_features)
+        num_read += 1
+        if {name: parsed[name].numpy().tolist() for name in example} != example:
+            tf_failures += 1
+    if num_read != len(examples):
+        tf_failures += 1
+    print('tensorflow reader: %i mismatches' % tf_failures)
+    failures += tf_failures
+
+    tf_path = join(output_dir, 'tensorflow.tfrecord')
+    start = time.perf_counter()
+    with tf.io.TFRecordWriter(tf_path) as writer:
+        for example in examples:
+            feature = {}
+            for name, values in example.items():
+                if name == 'masked_lm_weights':
+                    feature[name] = tf.train.Feature(float_list=tf.train.FloatList(value=values))
+                else:
+                    feature[name] = tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+            writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+    tf_time = time.perf_counter() - start
+    print('tensorflow writer: %.3fs, %.0f examples/s, %i bytes' % (tf_time, len(examples) / tf_time,
+                                                                    os.path.getsize(tf_path)))
+
+if failures:
+    print('FAILED')
+    sys.exit(1)
+print('round trip ok')
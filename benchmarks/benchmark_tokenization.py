@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Benchmark the piece-string tokenization path against the id-native batch API."""
+
+import sys
+import time
+import argparse
+from os.path import abspath, dirname, join
+
+SCRIPT_DIR = dirname(abspath(__file__))
+sys.path.insert(0, dirname(SCRIPT_DIR))
+
+import tokenization_sentencepiece as tokenization
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--input", type=str, required=True, help='text file, one sentence per line')
+parser.add_argument("--cased", action='store_true', help='if set, use the cased SentencePiece model')
+parser.add_argument("--batch-size", type=int, default=1000, help='number of lines per batch_encode call')
+parser.add_argument("--repeat", type=int, default=3, help='number of timed runs, the best is reported')
+args = parser.parse_args()
+
+sp_name = 'mn_cased' if args.cased else 'mn_uncased'
+tokenizer = tokenization.FullTokenizer(model_file=join(dirname(SCRIPT_DIR), 'sentencepiece/%s.model' % sp_name),
+                                       vocab_file=join(dirname(SCRIPT_DIR), 'sentencepiece/%s.vocab' % sp_name),
+                                       do_lower_case=not args.cased)
+
+with open(args.input) as f:
+    lines = [line.strip() for line in f if line.strip()]
+batches = [lines[i:i + args.batch_size] for i in range(0, len(lines), args.batch_size)]
+
+
+def piece_path():
+    return [tokenizer.convert_tokens_to_ids(tokenizer.tokenize(line)) for line in lines]
+
+
+def batch_path():
+    return [tokenizer.batch_encode(batch, flat=True) for batch in batches]
+
+
+def best_time(fn):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+piece_time, piece_ids = best_time(piece_path)
+batch_time, batch_ids = best_time(batch_path)
+
+# both paths have to produce the same ids
+flat_ids = [ids[offsets[i]:offsets[i + 1]].tolist()
+            for ids, offsets in batch_ids for i in range(len(offsets) - 1)]
+assert flat_ids == piece_ids, 'batch_encode ids differ from the piece-string path'
+
+print('%i lines' % len(lines))
+print('piece strings + convert_tokens_to_ids: %.3fs, %.0f lines/s' % (piece_time, len(lines) / piece_time))
+print('batch_encode: %.3fs, %.0f lines/s' % (batch_time, len(lines) / batch_time))
+print('speedup: %.1fx' % (piece_time / batch_time))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Load test of tokenization_server.py: latency percentiles and throughput.
+
+`--concurrency` clients send requests of `--texts-per-request` consecutive
+lines of the input, each waiting for its response before sending the next
+request. Unless `--address` points to a running server, a server is started
+on a temporary Unix socket. All responses are checked against
+`encode_features` in process, and the throughput is compared to that of
+encoding the requests one by one in process.
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from os.path import abspath, dirname, join
+
+SCRIPT_DIR = dirname(abspath(__file__))
+sys.path.insert(0, dirname(SCRIPT_DIR))
+
+import numpy as np
+
+import tokenization_sentencepiece as tokenization
+import tokenization_server
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--input", type=str, required=True, help='text file, one sentence per line')
+parser.add_argument("--cased", action='store_true', help='if set, use the cased SentencePiece model')
+parser.add_argument("--address", type=str, default=None,
+                    help='Unix socket path or http://HOST:PORT of a running server')
+parser.add_argument("--concurrency", type=int, default=32, help='number of concurrent clients')
+parser.add_argument("--requests", type=int, default=5000, help='number of requests to send')
+parser.add_argument("--texts-per-request", type=int, default=1, help='number of lines per request')
+parser.add_argument("--pairs", action='store_true', help='if set, send pairs of consecutive lines')
+parser.add_argument("--max-seq-length", type=int, default=128, help='max_seq_length of the requests, 0 for none')
+parser.add_argument("--max-batch-size", type=int, default=256, help='--max_batch_size of the started server')
+parser.add_argument("--max-latency-ms", type=float, default=2.0, help='--max_latency_ms of the started server')
+args = parser.parse_args()
+
+sp_name = 'mn_cased' if args.cased else 'mn_uncased'
+model_file = join(dirname(SCRIPT_DIR), 'sentencepiece/%s.model' % sp_name)
+
+with open(args.input) as f:
+    lines = [line.strip() for line in f if line.strip()]
+lines_per_request = args.texts_per_request * (2 if args.pairs else 1)
+requests = []
+for i in range(args.requests):
+    start = i * lines_per_request % max(len(lines) - lines_per_request, 1)
+    request_lines = lines[start:start + lines_per_request]
+    request = {'texts': request_lines[:args.texts_per_request], 'text_pairs': None,
+               'max_seq_length': args.max_seq_length or None}
+    if args.pairs:
+        request['text_pairs'] = request_lines[args.texts_per_request:]
+    requests.append(request)
+
+
+def start_server():
+    socket_path = join(tempfile.mkdtemp(), 'tokenization.sock')
+    command = [sys.executable, join(dirname(SCRIPT_DIR), 'tokenization_server.py'), '--model_file', model_file,
+               '--socket', socket_path, '--max_batch_size', str(args.max_batch_size),
+               '--max_latency_ms', str(args.max_latency_ms)]
+    if args.cased:
+        command.append('--cased')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    # the server prints a line once it is listening
+    for line in process.stdout:
+        if line.startswith(b'listening'):
+            break
+    return process, socket_path
+
+
+async def run_clients(address):
+    clients = [tokenization_server.AsyncClient(address) for _ in range(args.concurrency)]
+    for client in clients:
+        await client.connect()
+    latencies = [0.0] * len(requests)
+    responses = [None] * len(requests)
+    next_request = iter(range(len(requests)))
+
+    async def run_client(client):
+        for i in next_request:
+            start = time.perf_counter()
+            responses[i] = await client.encode(**requests[i])
+            latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(client) for client in clients])
+    elapsed = time.perf_counter() - start
+    stats = await clients[0].stats()
+    for client in clients:
+        client.close()
+    return elapsed, latencies, responses, stats
+
+
+server = None
+address = args.address
+if address is None:
+    server, address = start_server()
+try:
+    elapsed, latencies, responses, stats = asyncio.run(run_clients(address))
+finally:
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+tokenizer = tokenization.FullTokenizer(model_file, do_lower_case=not args.cased)
+start = time.perf_counter()
+expected = [tokenization_server.encode_features(tokenizer, **request) for request in requests]
+in_process_elapsed = time.perf_counter() - start
+# the server has to return exactly the features of in process encoding
+assert responses == expected, 'server responses differ from encode_features'
+
+latencies_ms = np.array(latencies) * 1000
+num_texts = len(requests) * args.texts_per_request
+print('%d requests of %d %s, %d concurrent clients' % (len(requests), args.texts_per_request,
+                                                       'pairs' if args.pairs else 'texts', args.concurrency))
+print('latency: p50 %.2fms, p90 %.2fms, p99 %.2fms, max %.2fms' % (
+    np.percentile(latencies_ms, 50), np.percentile(latencies_ms, 90), np.percentile(latencies_ms, 99),
+    latencies_ms.max()))
+print('server: %.2fs, %.0f requests/s, %.0f texts/s' % (elapsed, len(requests) / elapsed, num_texts / elapsed))
+print('in process, one request at a time: %.2fs, %.0f requests/s' % (in_process_elapsed,
+                                                                    len(requests) / in_process_elapsed))
+print('batches: %(batches)d, %(texts_per_batch).1f texts per batch' % stats)
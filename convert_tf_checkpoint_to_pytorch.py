@@ -20,71 +20,146 @@ from __future__ import print_function
 
 import os
 import re
+import sys
 import argparse
-import tensorflow as tf
+import collections
 import torch
 import numpy as np
 
-from pytorch_pretrained_bert.modeling import BertConfig, BertForPreTraining, load_tf_weights_in_bert
+from pytorch_pretrained_bert.modeling import BertConfig, BertForPreTraining
+
+import tf_checkpoint
+
+# adam_v and adam_m are variables used in AdamWeightDecayOptimizer to calculated m and v
+# which are not required for using pretrained model
+SKIPPED_VARIABLES = ["adam_v", "adam_m", "global_step"]
+
+# weights of BertForPreTraining that are shared with another one
+TIED_WEIGHTS = {"cls.predictions.decoder.weight": "bert.embeddings.word_embeddings.weight"}
+
+
+def is_model_variable(name):
+    return not any(n in SKIPPED_VARIABLES for n in name.split('/'))
+
+
+def pytorch_weight_name(name):
+    """Returns the name of the BertForPreTraining weight of a TF variable and
+    whether the variable has to be transposed."""
+    path = []
+    m_name = None
+    for m_name in name.split('/'):
+        if re.fullmatch(r'[A-Za-z]+_\d+', m_name):
+            l = re.split(r'_(\d+)', m_name)
+        else:
+            l = [m_name]
+        if l[0] == 'kernel' or l[0] == 'gamma':
+            path.append('weight')
+        elif l[0] == 'output_bias' or l[0] == 'beta':
+            path.append('bias')
+        elif l[0] == 'output_weights':
+            path.append('weight')
+        else:
+            path.append(l[0])
+        if len(l) >= 2:
+            path.append(str(int(l[1])))
+    if m_name[-11:] == '_embeddings':
+        path.append('weight')
+    return '.'.join(path), m_name == 'kernel'
+
+
+def model_weight_shapes(config):
+    """Names and shapes of the weights of BertForPreTraining, in the order of
+    its state dict. The model is built on the meta device, which allocates no
+    memory, where supported."""
+    if hasattr(torch.device('meta'), '__enter__'):
+        with torch.device('meta'):
+            model = BertForPreTraining(config)
+    else:
+        model = BertForPreTraining(config)
+    return collections.OrderedDict((name, tuple(weight.shape)) for name, weight in model.state_dict().items())
+
+
+def open_checkpoint(tf_path):
+    """A reader of the checkpoint, with TensorFlow only if it has to."""
+    if tf_checkpoint.is_supported(tf_path):
+        try:
+            return tf_checkpoint.CheckpointReader(tf_path)
+        except ValueError as e:
+            print("Reading the checkpoint with TensorFlow: {}".format(e))
+    import tensorflow as tf
+    return tf.train.load_checkpoint(tf_path)
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux but bytes on macOS
+    return max_rss / float(1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
 
 def convert_tf_checkpoint_to_pytorch(tf_checkpoint_path, bert_config_file, pytorch_dump_path):
+    """Converts the checkpoint one variable at a time: optimizer variables are
+    skipped without being read and every weight is read, transposed if needed
+    and stored as a tensor of the state dict before the next one, so that the
+    peak memory is about one copy of the model."""
     config_path = os.path.abspath(bert_config_file)
-    tf_path = os.path.abspath(tf_checkpoint_path)
+    tf_path = os.path.abspath(tf_checkpoint_path) if '://' not in tf_checkpoint_path else tf_checkpoint_path
     print("Converting TensorFlow checkpoint from {} with config at {}".format(tf_path, config_path))
-    # Load weights from TF model
-    init_vars = tf.train.list_variables(tf_path)
-    names = []
-    arrays = []
-    for name, shape in init_vars:
-        print("Loading TF weight {} with shape {}".format(name, shape))
-        array = tf.train.load_variable(tf_path, name)
-        names.append(name)
-        arrays.append(array)
-
-    # Initialise PyTorch model
     config = BertConfig.from_json_file(bert_config_file)
     print("Building PyTorch model from configuration: {}".format(str(config)))
-    model = BertForPreTraining(config)
-
-    for name, array in zip(names, arrays):
-        name = name.split('/')
-        # adam_v and adam_m are variables used in AdamWeightDecayOptimizer to calculated m and v
-        # which are not required for using pretrained model
-        if any(n in ["adam_v", "adam_m", "global_step"] for n in name):
-            print("Skipping {}".format("/".join(name)))
+    shapes = model_weight_shapes(config)
+
+    reader = open_checkpoint(tf_path)
+    variables = reader.list_variables() if hasattr(reader, 'list_variables') else \
+        sorted(reader.get_variable_to_shape_map().items())
+    state_dict = {}
+    for name, shape in variables:
+        if not is_model_variable(name):
+            print("Skipping {}".format(name))
             continue
-        pointer = model
-        for m_name in name:
-            if re.fullmatch(r'[A-Za-z]+_\d+', m_name):
-                l = re.split(r'_(\d+)', m_name)
-            else:
-                l = [m_name]
-            if l[0] == 'kernel' or l[0] == 'gamma':
-                pointer = getattr(pointer, 'weight')
-            elif l[0] == 'output_bias' or l[0] == 'beta':
-                pointer = getattr(pointer, 'bias')
-            elif l[0] == 'output_weights':
-                pointer = getattr(pointer, 'weight')
-            else:
-                pointer = getattr(pointer, l[0])
-            if len(l) >= 2:
-                num = int(l[1])
-                pointer = pointer[num]
-        if m_name[-11:] == '_embeddings':
-            pointer = getattr(pointer, 'weight')
-        elif m_name == 'kernel':
-            array = np.transpose(array)
-        try:
-            assert pointer.shape == array.shape
-        except AssertionError as e:
-            e.args += (pointer.shape, array.shape)
-            raise
-        print("Initialize PyTorch weight {}".format(name))
-        pointer.data = torch.from_numpy(array)
+        weight_name, transpose = pytorch_weight_name(name)
+        # checked before reading the variable
+        expected_shape = tuple(reversed(shape)) if transpose else tuple(shape)
+        if weight_name not in shapes:
+            raise ValueError("{} has no weight {} in BertForPreTraining".format(name, weight_name))
+        if shapes[weight_name] != expected_shape:
+            raise ValueError("{} has the shape {} but {} of the model has {}".format(
+                name, expected_shape, weight_name, shapes[weight_name]))
+        print("Loading TF weight {} with shape {}".format(name, shape))
+        array = reader.get_tensor(name)
+        if transpose:
+            array = np.ascontiguousarray(np.transpose(array))
+        print("Initialize PyTorch weight {}".format(weight_name))
+        state_dict[weight_name] = torch.from_numpy(array)
+        del array
+
+    # weights missing from the checkpoint are taken from a BertForPreTraining
+    # initialized by the model itself, which is only built if there are any
+    missing = [weight_name for weight_name in shapes
+               if weight_name not in state_dict and TIED_WEIGHTS.get(weight_name) not in state_dict]
+    initial_weights = BertForPreTraining(config).state_dict() if missing else {}
+    weights = collections.OrderedDict()
+    for weight_name in shapes:
+        if weight_name in state_dict:
+            weights[weight_name] = state_dict[weight_name]
+        elif TIED_WEIGHTS.get(weight_name) in weights:
+            weights[weight_name] = weights[TIED_WEIGHTS[weight_name]]
+        else:
+            print("Initializing PyTorch weight {} randomly, it is not in the checkpoint".format(weight_name))
+            weights[weight_name] = initial_weights[weight_name]
+    del state_dict, initial_weights
 
     # Save pytorch-model
     print("Save PyTorch model to {}".format(pytorch_dump_path))
-    torch.save(model.state_dict(), pytorch_dump_path)
+    torch.save(weights, pytorch_dump_path)
+    model_mb = sum(weight.numel() * weight.element_size() for name, weight in weights.items()
+                   if name not in TIED_WEIGHTS) / float(1 << 20)
+    peak_mb = peak_memory_mb()
+    if peak_mb is not None:
+        print("Model weights {:.0f} MB, peak RSS {:.0f} MB".format(model_mb, peak_mb))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+"""Cache of tokenized input files, stored as `document_store` next to the corpus.
+
+A cache entry is keyed on the content of the input files, the SentencePiece
+model file and `do_lower_case`. Changing any of them results in a new key, and
+the outdated entry for the same input files and tokenizer is removed when the
+new one is created.
+"""
+
+import os
+import re
+import hashlib
+
+import document_store
+
+# bump this whenever the way documents are read or stored changes
+CACHE_VERSION = 1
+CACHE_DIR_NAME = '.tokenized'
+
+
+# file hashes by path, size and modification time
+_file_hashes = {}
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-1 of the content of a file, computed once per process unless the
+    file changes."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                sha1.update(block)
+        _file_hashes[key] = sha1.hexdigest()
+    return _file_hashes[key]
+
+
+def cache_key(input_files, model_file, do_lower_case):
+    """Key of the tokenized form of the given input files."""
+    sha1 = hashlib.sha1()
+    sha1.update(('version=%d\n' % CACHE_VERSION).encode('utf-8'))
+    sha1.update(('do_lower_case=%s\n' % bool(do_lower_case)).encode('utf-8'))
+    for path in [model_file] + list(input_files):
+        sha1.update(('%s\n' % file_hash(path)).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def cache_name(input_files, model_file, do_lower_case):
+    """Human readable part of the cache entry name, shared by all its versions."""
+    name = os.path.splitext(os.path.basename(input_files[0]))[0]
+    if len(input_files) > 1:
+        name += '+%d' % (len(input_files) - 1)
+    model_name = os.path.splitext(os.path.basename(model_file))[0]
+    return '%s.%s-%s' % (name, model_name, 'lower' if do_lower_case else 'cased')
+
+
+def is_cacheable(input_files):
+    """Only local files can be hashed and memory-mapped."""
+    return bool(input_files) and all(os.path.isfile(f) for f in input_files)
+
+
+def cache_prefix(input_files, model_file, do_lower_case, cache_dir=None):
+    """Returns the `document_store` prefix of the cache entry of the input files.
+
+    The entry is placed into `cache_dir`, by default a `.tokenized` directory
+    next to the first input file. The files of outdated entries with the same
+    name are removed, but not the temporary files of entries being built; the
+    returned entry itself may not exist yet.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(input_files[0])), CACHE_DIR_NAME)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    name = cache_name(input_files, model_file, do_lower_case)
+    key = cache_key(input_files, model_file, do_lower_case)
+    prefix = os.path.join(cache_dir, '%s.%s' % (name, key[:16]))
+
+    if not document_store.DocumentStore.exists(prefix):
+        # `<name>.<key>.<suffix>`, which excludes the `.tmp<pid>` files
+        entry_file = re.compile(r'%s\.([0-9a-f]{16})\.[a-z]+$' % re.escape(name))
+        for file_name in os.listdir(cache_dir):
+            match = entry_file.match(file_name)
+            if match and match.group(1) != key[:16]:
+                os.remove(os.path.join(cache_dir, file_name))
+    return prefix
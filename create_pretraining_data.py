@@ -10,21 +10,46 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import array
 import collections
+import itertools
+import multiprocessing
+import os
 import random
-import tensorflow as tf
+import numpy as np
+from absl import app
+from absl import flags
+from absl import logging
+import corpus_cache
+import document_store
+import file_io
+import generation_manifest
+import masked_lm
+import pipeline_metrics
+import pretraining_shards
+import sequence_packing
+import tfrecord_io
 import tokenization_sentencepiece as tokenization
 
-flags = tf.flags
-
 FLAGS = flags.FLAGS
 
-flags.DEFINE_string("input_file", None,
-                    "Input raw text file (or comma-separated list of files).")
+flags.DEFINE_string(
+    "input_file", None,
+    "Input raw text file (or comma-separated list of files). Files ending in "
+    "`.gz`, `.bz2`, `.xz` or `.zst` are decompressed while reading.")
 
 flags.DEFINE_string(
     "output_file", None,
-    "Output TF example file (or comma-separated list of files).")
+    "Output TF example file (or comma-separated list of files). The files "
+    "are written without TensorFlow, which is only needed for remote paths. "
+    "With several `max_seq_length`s, `{max_seq_length}` in the names is "
+    "replaced by each of them.")
+
+flags.DEFINE_enum(
+    "output_format", "tfrecord", ["tfrecord", "numpy"],
+    "Format of the output files: `tfrecord` writes TF examples, `numpy` "
+    "writes every output file as a shard directory of fixed-width arrays "
+    "which can be memory-mapped, see `pretraining_shards.py`.")
 
 flags.DEFINE_string("model_file", None,
                     "The model file that the SentencePiece model was trained on.")
@@ -37,10 +62,16 @@ flags.DEFINE_bool(
     "Whether to lower case the input text. Should be True for uncased "
     "models and False for cased models.")
 
-flags.DEFINE_integer("max_seq_length", 128, "Maximum sequence length.")
+flags.DEFINE_multi_integer(
+    "max_seq_length", [128],
+    "Maximum sequence length. Can be given several times to create the "
+    "outputs for several lengths from the same documents; the outputs of "
+    "each length are the same as those of a run with only that length.")
 
-flags.DEFINE_integer("max_predictions_per_seq", 20,
-                     "Maximum number of masked LM predictions per sequence.")
+flags.DEFINE_multi_integer(
+    "max_predictions_per_seq", [20],
+    "Maximum number of masked LM predictions per sequence, one per "
+    "`max_seq_length`.")
 
 flags.DEFINE_integer("random_seed", 12345, "Random seed for data generation.")
 
@@ -55,28 +86,197 @@ flags.DEFINE_float(
     "Probability of creating sequences which are shorter than the "
     "maximum length.")
 
+flags.DEFINE_integer(
+    "num_workers", 1,
+    "Number of processes tokenizing the input files. The output does not "
+    "depend on it.")
+
+flags.DEFINE_integer(
+    "tokenizer_cache_size", 0,
+    "If set, the token ids of up to this many distinct lines are kept in an "
+    "LRU cache, so that repeated lines such as bylines or disclaimers are "
+    "not tokenized again. With `num_workers > 1`, every worker has its own "
+    "cache. The output does not depend on it.")
+
+flags.DEFINE_bool(
+    "streaming", False,
+    "Whether to write instances as they are created instead of collecting "
+    "all of them in memory first. Instances are then shuffled through a "
+    "bounded buffer of `shuffle_buffer_size` instead of globally.")
+
+flags.DEFINE_integer(
+    "shuffle_buffer_size", 100000,
+    "Maximum number of instances held in memory in streaming mode.")
+
+flags.DEFINE_string(
+    "document_store", None,
+    "Path prefix of an on-disk store of the tokenized input documents. It is "
+    "built from `input_file` if it does not exist yet. Instances are then "
+    "created from the memory-mapped store instead of an in-memory document "
+    "list, so memory usage does not grow with the corpus size.")
+
+flags.DEFINE_bool(
+    "tokenization_cache", True,
+    "Whether to keep the tokenized input files as a document store in a "
+    "cache keyed on the input files, the SentencePiece model and "
+    "`do_lower_case`, and reuse it on later runs instead of tokenizing again. "
+    "Ignored if `document_store` is set or the input files are not local.")
+
+flags.DEFINE_string(
+    "tokenization_cache_dir", None,
+    "Directory of the tokenization cache. Defaults to a `.tokenized` "
+    "directory next to the first input file.")
+
+flags.DEFINE_enum(
+    "masking_engine", "python", ["python", "numpy"],
+    "How masked LM predictions are created: `python` masks every instance "
+    "while it is created, `numpy` masks batches of instances at once with a "
+    "`numpy.random.Generator` seeded by `random_seed`. Both have the same "
+    "distribution, but produce different masks.")
+
+flags.DEFINE_bool(
+    "dynamic_masking", False,
+    "Whether to write unmasked instances, without the masked LM features, "
+    "which are masked on the fly by `dynamic_masking.py` with new masks every "
+    "epoch. Every document is then used only once, i.e. `dupe_factor` is "
+    "ignored.")
+
+flags.DEFINE_enum(
+    "padding_strategy", "pad", ["pad", "pack", "bucket"],
+    "How instances shorter than `max_seq_length` are written: `pad` pads "
+    "every instance to `max_seq_length`, `pack` packs several instances into "
+    "one row and `bucket` pads every instance only to the smallest of "
+    "`bucket_lengths` it fits and writes each bucket to its own output files, "
+    "named like `output.len128.tfrecord`. See `sequence_packing.py`.")
+
+flags.DEFINE_list(
+    "bucket_lengths", None,
+    "Sequence lengths of the buckets of `padding_strategy=bucket`. Defaults "
+    "to a quarter, half and all of `max_seq_length`, which is always added.")
+
+flags.DEFINE_integer(
+    "max_sequences_per_pack", 3,
+    "Maximum number of instances in one row with `padding_strategy=pack`.")
+
+flags.DEFINE_bool(
+    "manifest", True,
+    "Whether to keep a manifest of the outputs next to the first output file. "
+    "A rerun with unchanged input files, tokenizer and generation flags then "
+    "does nothing, and an interrupted run resumes from its last checkpoint. "
+    "Ignored if the input or output files are not local.")
+
+flags.DEFINE_integer(
+    "checkpoint_every", 100000,
+    "Number of rows after which the outputs are flushed and the progress is "
+    "recorded in the manifest.")
+
+flags.DEFINE_integer(
+    "num_shards", None,
+    "If set, the documents are split into this many disjoint slices, of "
+    "which only the one of `shard_index` is turned into instances, e.g. on "
+    "one of `num_shards` machines. Every document then gets its own random "
+    "generator seeded by `random_seed`, the duplicate and the document id, so "
+    "the union of the instances of all shards is the same for any number of "
+    "shards. Random next sentences are still drawn from all documents.")
+
+flags.DEFINE_integer(
+    "shard_index", 0, "Index of the document slice to use, see `num_shards`.")
+
+flags.DEFINE_bool(
+    "dry_run", False,
+    "Whether to only estimate the number of instances, the padding and the "
+    "size of the outputs, from instances created for a random sample of "
+    "`dry_run_sample` of the documents, without writing anything.")
+
+flags.DEFINE_float(
+    "dry_run_sample", 0.05,
+    "Fraction of the documents tokenized and turned into instances by "
+    "`dry_run`.")
+
+flags.DEFINE_integer(
+    "progress_interval", 60,
+    "Minimum number of seconds between two progress lines with the time per "
+    "stage, the counters and an ETA. 0 disables them.")
+
+flags.DEFINE_string(
+    "metrics_file", None,
+    "If set, the time per stage and the counters are written to this file "
+    "when the run ends, also if it fails.")
+
+flags.DEFINE_enum(
+    "metrics_format", "json", ["json", "prometheus"],
+    "Format of `metrics_file`: `json` or `prometheus`, the text format read "
+    "by the textfile collector of the node exporter.")
+
+# Flags the outputs depend on, recorded in the manifest
+GENERATION_FLAGS = [
+    "output_format", "do_lower_case", "max_seq_length",
+    "max_predictions_per_seq", "random_seed", "dupe_factor", "masked_lm_prob",
+    "short_seq_prob", "streaming", "shuffle_buffer_size", "masking_engine",
+    "dynamic_masking", "padding_strategy", "bucket_lengths",
+    "max_sequences_per_pack", "num_shards", "shard_index"]
+
+# Number of lines sent to a tokenization worker at once
+TOKENIZE_CHUNK_SIZE = 1000
+
+# Number of instances masked at once by the NumPy masking engine
+MASKING_BATCH_SIZE = 1024
+
+# Array type code of masked LM positions, enough for any max_seq_length
+POSITION_TYPECODE = "H"
+
+# Number of instances packed into rows at once with padding_strategy=pack
+PACKING_BUFFER_SIZE = 10000
+
+# Added to random_seed to seed the shuffling and packing of streaming mode
+STREAMING_SEED_OFFSET = 1
+
+# Number of rows per row length serialized by `dry_run` to measure the mean
+# size of a TF example
+DRY_RUN_SERIALIZED_ROWS = 1000
+
+# Time per stage and counters of the run, see `pipeline_metrics.py`
+METRICS = pipeline_metrics.Metrics()
+
 
 class TrainingInstance(object):
-  """A single training instance (sentence pair)."""
+  """A single training instance (sentence pair), held as arrays of token ids."""
 
-  def __init__(self, tokens, segment_ids, masked_lm_positions, masked_lm_labels,
-               is_random_next):
-    self.tokens = tokens
-    self.segment_ids = segment_ids
+  __slots__ = ["token_ids", "segment_a_length", "is_random_next",
+               "masked_lm_positions", "masked_lm_ids"]
+
+  # Mapping from ids to pieces, only used to make `__str__` readable
+  inv_vocab = None
+
+  def __init__(self, token_ids, segment_a_length, masked_lm_positions,
+               masked_lm_ids, is_random_next):
+    self.token_ids = token_ids
+    # The first `segment_a_length` tokens ([CLS] A [SEP]) have segment id 0,
+    # the remaining ones (B [SEP]) have segment id 1.
+    self.segment_a_length = segment_a_length
     self.is_random_next = is_random_next
     self.masked_lm_positions = masked_lm_positions
-    self.masked_lm_labels = masked_lm_labels
+    self.masked_lm_ids = masked_lm_ids
+
+  @property
+  def segment_ids(self):
+    return ([0] * self.segment_a_length +
+            [1] * (len(self.token_ids) - self.segment_a_length))
+
+  def _printable_tokens(self, ids):
+    if self.inv_vocab is None:
+      return [str(x) for x in ids]
+    return [tokenization.printable_text(self.inv_vocab[x]) for x in ids]
 
   def __str__(self):
     s = ""
-    s += "tokens: %s\n" % (" ".join(
-        [tokenization.printable_text(x) for x in self.tokens]))
+    s += "tokens: %s\n" % (" ".join(self._printable_tokens(self.token_ids)))
     s += "segment_ids: %s\n" % (" ".join([str(x) for x in self.segment_ids]))
     s += "is_random_next: %s\n" % self.is_random_next
     s += "masked_lm_positions: %s\n" % (" ".join(
         [str(x) for x in self.masked_lm_positions]))
     s += "masked_lm_labels: %s\n" % (" ".join(
-        [tokenization.printable_text(x) for x in self.masked_lm_labels]))
+        self._printable_tokens(self.masked_lm_ids)))
     s += "\n"
     return s
 
@@ -84,86 +284,218 @@ class TrainingInstance(object):
     return self.__str__()
 
 
-def write_instance_to_example_files(instances, tokenizer, max_seq_length,
-                                    max_predictions_per_seq, output_files):
-  """Create TF example files from `TrainingInstance`s."""
-  writers = []
-  for output_file in output_files:
-    writers.append(tf.python_io.TFRecordWriter(output_file))
+VocabInfo = collections.namedtuple(
+    "VocabInfo", ["size", "cls_id", "sep_id", "mask_id", "typecode"])
 
-  writer_index = 0
+
+def get_vocab_info(tokenizer):
+  """Returns the vocabulary size, the special token ids and the array type
+  code used for token ids."""
+  vocab_size = len(tokenizer.vocab)
+  return VocabInfo(
+      size=vocab_size,
+      cls_id=tokenizer.vocab["[CLS]"],
+      sep_id=tokenizer.vocab["[SEP]"],
+      mask_id=tokenizer.vocab["[MASK]"],
+      typecode=document_store.token_typecode(vocab_size))
+
+
+def write_instance_to_example_files(instances, tokenizer, max_seq_length,
+                                    max_predictions_per_seq, output_files,
+                                    output_format="tfrecord", masked=True,
+                                    bucket_lengths=None,
+                                    max_sequences_per_pack=None,
+                                    manifest=None, checkpoint_every=None):
+  """Create TF example files (or NumPy shards) from `TrainingInstance`s.
+
+  If `masked` is False, the instances are unmasked and the masked LM features
+  are left out. With `bucket_lengths`, every instance is padded only to the
+  smallest bucket length that fits it and written to the output files of that
+  bucket. With `max_sequences_per_pack`, the instances are
+  `sequence_packing.PackedInstance`s.
+
+  With a `generation_manifest.GenerationManifest`, the progress is recorded
+  every `checkpoint_every` rows, an interrupted run is resumed from its last
+  checkpoint and the manifest is written once all outputs are complete.
+  """
+  vocab_info = get_vocab_info(tokenizer)
+  if bucket_lengths:
+    bucket_lengths = sorted(set(bucket_lengths) | set([max_seq_length]))
+
+  resume_rows, resume_sizes = 0, {}
+  if manifest is not None:
+    resume_point = manifest.resume_point()
+    if resume_point is not None:
+      resume_rows, resume_sizes = resume_point
+      logging.info("Resuming after the first %d rows of an interrupted run",
+                   resume_rows)
+
+  def create_writer(output_file, row_length):
+    append = any(f == output_file or f.startswith(output_file + os.sep)
+                 for f in resume_sizes)
+    if output_format == "numpy":
+      metadata = {"vocab_size": vocab_info.size,
+                  "cls_id": vocab_info.cls_id,
+                  "sep_id": vocab_info.sep_id,
+                  "mask_id": vocab_info.mask_id}
+      if bucket_lengths:
+        metadata["bucket_length"] = row_length
+      return pretraining_shards.ShardWriter(
+          output_file, row_length, max_predictions_per_seq,
+          id_dtype=np.dtype(vocab_info.typecode).name, masked=masked,
+          metadata=metadata, max_sequences_per_pack=max_sequences_per_pack,
+          append=append)
+    return tfrecord_io.TFRecordWriter(output_file, append=append)
+
+  # writers, their files, the index of the next one to write to and the number
+  # of rows written, by row length. All files are created up front, so that an
+  # input without instances still has its (empty) outputs.
+  writers = {}
+  writer_files = {}
+  writer_indexes = collections.defaultdict(int)
+  row_counts = collections.Counter()
+  file_rows = collections.Counter()
+  for row_length in bucket_lengths or [max_seq_length]:
+    writer_files[row_length] = output_files
+    if bucket_lengths:
+      writer_files[row_length] = [
+          sequence_packing.bucket_output_file(f, row_length)
+          for f in output_files]
+    writers[row_length] = [create_writer(f, row_length)
+                           for f in writer_files[row_length]]
+    for f in writer_files[row_length]:
+      file_rows[f] = 0
+  padding_stats = sequence_packing.PaddingStats(max_seq_length)
 
   total_written = 0
   for (inst_index, instance) in enumerate(instances):
-    input_ids = tokenizer.convert_tokens_to_ids(instance.tokens)
-    input_mask = [1] * len(input_ids)
-    segment_ids = list(instance.segment_ids)
-    assert len(input_ids) <= max_seq_length
-
-    while len(input_ids) < max_seq_length:
-      input_ids.append(0)
-      input_mask.append(0)
-      segment_ids.append(0)
-
-    assert len(input_ids) == max_seq_length
-    assert len(input_mask) == max_seq_length
-    assert len(segment_ids) == max_seq_length
-
-    masked_lm_positions = list(instance.masked_lm_positions)
-    masked_lm_ids = tokenizer.convert_tokens_to_ids(instance.masked_lm_labels)
-    masked_lm_weights = [1.0] * len(masked_lm_ids)
-
-    while len(masked_lm_positions) < max_predictions_per_seq:
-      masked_lm_positions.append(0)
-      masked_lm_ids.append(0)
-      masked_lm_weights.append(0.0)
-
-    next_sentence_label = 1 if instance.is_random_next else 0
-
-    features = collections.OrderedDict()
-    features["input_ids"] = create_int_feature(input_ids)
-    features["input_mask"] = create_int_feature(input_mask)
-    features["segment_ids"] = create_int_feature(segment_ids)
-    features["masked_lm_positions"] = create_int_feature(masked_lm_positions)
-    features["masked_lm_ids"] = create_int_feature(masked_lm_ids)
-    features["masked_lm_weights"] = create_float_feature(masked_lm_weights)
-    features["next_sentence_labels"] = create_int_feature([next_sentence_label])
-
-    tf_example = tf.train.Example(features=tf.train.Features(feature=features))
+    row_length = max_seq_length
+    if max_sequences_per_pack:
+      padding_stats.add(len(instance.instances), len(instance), row_length)
+    else:
+      if bucket_lengths:
+        row_length = sequence_packing.bucket_length(len(instance.token_ids),
+                                                    bucket_lengths)
+      padding_stats.add(1, len(instance.token_ids), row_length)
 
-    writers[writer_index].write(tf_example.SerializeToString())
-    writer_index = (writer_index + 1) % len(writers)
+    writer_index = writer_indexes[row_length]
+    writer_indexes[row_length] = (writer_index + 1) % len(output_files)
+    row_counts[row_length] += 1
+    file_rows[writer_files[row_length][writer_index]] += 1
 
     total_written += 1
+    METRICS.count("rows")
+    if inst_index < resume_rows:
+      # written by the interrupted run
+      continue
+
+    with METRICS.stage("serialization"):
+      features = create_row_features(instance, row_length, max_seq_length,
+                                     max_predictions_per_seq,
+                                     max_sequences_per_pack, masked)
+      if output_format != "numpy":
+        record = tfrecord_io.serialize_example(features)
+    if output_format == "numpy":
+      writer = writers[row_length][writer_index]
+      writer.write(features)
+      METRICS.count("bytes_written", writer.bytes_per_instance)
+    else:
+      writers[row_length][writer_index].write(record)
+      # length, its CRC, the record and its CRC
+      METRICS.count("bytes_written", len(record) + 16)
+
+    if manifest is not None and total_written % checkpoint_every == 0:
+      for row_writers in writers.values():
+        for writer in row_writers:
+          writer.flush()
+      manifest.checkpoint(total_written, list(file_rows))
 
     if inst_index < 20:
-      tf.logging.info("*** Example ***")
-      tf.logging.info("tokens: %s" % " ".join(
-          [tokenization.printable_text(x) for x in instance.tokens]))
+      logging.info("*** Example ***")
+      logging.info("tokens: %s" % " ".join(
+          [tokenization.printable_text(x)
+           for x in tokenizer.convert_ids_to_tokens(instance.token_ids)]))
 
       for feature_name in features.keys():
-        feature = features[feature_name]
-        values = []
-        if feature.int64_list.value:
-          values = feature.int64_list.value
-        elif feature.float_list.value:
-          values = feature.float_list.value
-        tf.logging.info(
+        values = features[feature_name].values
+        logging.info(
             "%s: %s" % (feature_name, " ".join([str(x) for x in values])))
 
-  for writer in writers:
-    writer.close()
-
-  tf.logging.info("Wrote %d total instances", total_written)
+  for row_writers in writers.values():
+    for writer in row_writers:
+      writer.close()
+  if manifest is not None:
+    manifest.complete(file_rows, padding_stats.num_instances)
+
+  logging.info("Wrote %d total instances", total_written)
+  if bucket_lengths:
+    for row_length in sorted(row_counts):
+      logging.info("  bucket %d: %d instances", row_length,
+                   row_counts[row_length])
+  logging.info("Padding: %s", padding_stats)
+
+
+def create_row_features(instance, row_length, max_seq_length,
+                        max_predictions_per_seq, max_sequences_per_pack=None,
+                        masked=True):
+  """Returns the features of a row of `row_length`: a `TrainingInstance` or,
+  with `max_sequences_per_pack`, a `sequence_packing.PackedInstance`."""
+  if max_sequences_per_pack:
+    return sequence_packing.packed_features(
+        instance, max_seq_length, max_predictions_per_seq,
+        max_sequences_per_pack, masked)
+  return create_instance_features(instance, row_length,
+                                  max_predictions_per_seq, masked)
+
+
+def create_instance_features(instance, max_seq_length, max_predictions_per_seq,
+                             masked=True):
+  """Returns the features of a `TrainingInstance`, padded to `max_seq_length`
+  and `max_predictions_per_seq`."""
+  input_ids = list(instance.token_ids)
+  input_mask = [1] * len(input_ids)
+  segment_ids = instance.segment_ids
+  assert len(input_ids) <= max_seq_length
+
+  while len(input_ids) < max_seq_length:
+    input_ids.append(0)
+    input_mask.append(0)
+    segment_ids.append(0)
+
+  assert len(input_ids) == max_seq_length
+  assert len(input_mask) == max_seq_length
+  assert len(segment_ids) == max_seq_length
+
+  masked_lm_positions = list(instance.masked_lm_positions)
+  masked_lm_ids = list(instance.masked_lm_ids)
+  masked_lm_weights = [1.0] * len(masked_lm_ids)
+
+  while len(masked_lm_positions) < max_predictions_per_seq:
+    masked_lm_positions.append(0)
+    masked_lm_ids.append(0)
+    masked_lm_weights.append(0.0)
+
+  next_sentence_label = 1 if instance.is_random_next else 0
+
+  features = collections.OrderedDict()
+  features["input_ids"] = create_int_feature(input_ids)
+  features["input_mask"] = create_int_feature(input_mask)
+  features["segment_ids"] = create_int_feature(segment_ids)
+  if masked:
+    features["masked_lm_positions"] = create_int_feature(masked_lm_positions)
+    features["masked_lm_ids"] = create_int_feature(masked_lm_ids)
+    features["masked_lm_weights"] = create_float_feature(masked_lm_weights)
+  features["next_sentence_labels"] = create_int_feature([next_sentence_label])
+  return features
 
 
 def create_int_feature(values):
-  feature = tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
+  feature = tfrecord_io.Int64Feature(values=list(values))
   return feature
 
 
 def create_float_feature(values):
-  feature = tf.train.Feature(float_list=tf.train.FloatList(value=list(values)))
+  feature = tfrecord_io.FloatFeature(values=list(values))
   return feature
 
 
@@ -171,50 +503,307 @@ def create_training_instances(input_files, tokenizer, max_seq_length,
                               dupe_factor, short_seq_prob, masked_lm_prob,
                               max_predictions_per_seq, rng):
   """Create `TrainingInstance`s from raw text."""
-  all_documents = [[]]
+  all_documents = read_documents(input_files, tokenizer, rng)
+  instances = list(
+      generate_training_instances(all_documents, get_vocab_info(tokenizer),
+                                  max_seq_length, dupe_factor, short_seq_prob,
+                                  masked_lm_prob, max_predictions_per_seq, rng))
+  rng.shuffle(instances)
+  return instances
+
 
+def generate_training_instances(all_documents, vocab_info, max_seq_length,
+                                dupe_factor, short_seq_prob, masked_lm_prob,
+                                max_predictions_per_seq, rng,
+                                mask_tokens=True):
+  """Yields unshuffled `TrainingInstance`s, document by document."""
+  for _ in range(dupe_factor):
+    for document_index in range(len(all_documents)):
+      METRICS.count("documents_processed")
+      for instance in create_instances_from_document(
+          all_documents, document_index, max_seq_length, short_seq_prob,
+          masked_lm_prob, max_predictions_per_seq, vocab_info, rng,
+          mask_tokens):
+        yield instance
+
+
+def generate_sharded_training_instances(all_documents, vocab_info,
+                                        max_seq_length, dupe_factor,
+                                        short_seq_prob, masked_lm_prob,
+                                        max_predictions_per_seq, random_seed,
+                                        shard_index, num_shards,
+                                        mask_tokens=True):
+  """Yields the unshuffled `TrainingInstance`s of one slice of the documents.
+
+  The instances of a document are created with a random generator seeded by
+  `random_seed`, the duplicate and the document index only, so they do not
+  depend on the slicing.
+  """
+  start, end = shard_document_range(len(all_documents), shard_index,
+                                    num_shards)
+  for dupe_index in range(dupe_factor):
+    for document_index in range(start, end):
+      METRICS.count("documents_processed")
+      document_rng = random.Random(
+          "%d:%d:%d" % (random_seed, dupe_index, document_index))
+      for instance in create_instances_from_document(
+          all_documents, document_index, max_seq_length, short_seq_prob,
+          masked_lm_prob, max_predictions_per_seq, vocab_info, document_rng,
+          mask_tokens):
+        yield instance
+
+
+def shard_document_range(num_documents, shard_index, num_shards):
+  """Start and end index of the documents of a shard."""
+  return (num_documents * shard_index // num_shards,
+          num_documents * (shard_index + 1) // num_shards)
+
+
+def mask_instances_in_batches(instances, vocab_info, max_seq_length,
+                              masked_lm_prob, max_predictions_per_seq, np_rng,
+                              batch_size=MASKING_BATCH_SIZE):
+  """Adds masked LM predictions to unmasked instances with the NumPy engine.
+
+  Instances are padded into id matrices of `batch_size` rows and masked by
+  `masked_lm.create_masked_lm_predictions_batch`, which draws from the
+  `numpy.random.Generator` `np_rng`.
+  """
+  special_ids = [vocab_info.cls_id, vocab_info.sep_id]
+  for batch in _chunks(instances, batch_size):
+    input_ids = np.zeros((len(batch), max_seq_length), dtype=np.int64)
+    input_mask = np.zeros((len(batch), max_seq_length), dtype=np.int64)
+    for (i, instance) in enumerate(batch):
+      input_ids[i, :len(instance.token_ids)] = instance.token_ids
+      input_mask[i, :len(instance.token_ids)] = 1
+
+    (masked_input_ids, masked_lm_positions, masked_lm_ids,
+     masked_lm_weights) = masked_lm.create_masked_lm_predictions_batch(
+         input_ids, input_mask, masked_lm_prob, max_predictions_per_seq,
+         vocab_info.size, vocab_info.mask_id, special_ids, np_rng)
+
+    for (i, instance) in enumerate(batch):
+      num_predictions = int(masked_lm_weights[i].sum())
+      instance.token_ids = array.array(
+          vocab_info.typecode,
+          masked_input_ids[i, :len(instance.token_ids)].tolist())
+      instance.masked_lm_positions = array.array(
+          POSITION_TYPECODE, masked_lm_positions[i, :num_predictions].tolist())
+      instance.masked_lm_ids = array.array(
+          vocab_info.typecode, masked_lm_ids[i, :num_predictions].tolist())
+      yield instance
+
+
+def iter_documents(input_files, tokenizer, num_workers=1):
+  """Reads and tokenizes the input files, yielding one document at a time."""
   # Input file format:
   # (1) One sentence per line. These should ideally be actual sentences, not
   # entire paragraphs or arbitrary spans of text. (Because we use the
   # sentence boundaries for the "next sentence prediction" task).
   # (2) Blank lines between documents. Document boundaries are needed so
   # that the "next sentence prediction" task doesn't span between documents.
+  lines = METRICS.timed("reading", iter_lines(input_files))
+  return tokenize_documents(lines, tokenizer, num_workers)
+
+
+def tokenize_documents(lines, tokenizer, num_workers=1):
+  """Tokenizes lines, yielding the documents separated by empty lines."""
+  document = []
+  for token_ids in METRICS.timed(
+      "tokenizing", tokenize_lines(lines, tokenizer, num_workers)):
+    # Empty lines are used as document delimiters
+    if token_ids is None:
+      # Empty documents are skipped
+      if document:
+        _count_document(document)
+        yield document
+      document = []
+    elif token_ids:
+      document.append(token_ids)
+
+  if document:
+    _count_document(document)
+    yield document
+
+
+def _count_document(document):
+  METRICS.count("documents")
+  METRICS.count("sentences", len(document))
+  METRICS.count("tokens", sum(len(sentence) for sentence in document))
+
+
+def iter_lines(input_files):
+  """Yields the stripped lines of all input files."""
   for input_file in input_files:
-    with tf.gfile.GFile(input_file, "r") as reader:
-      while True:
-        line = tokenization.convert_to_unicode(reader.readline())
-        if not line:
-          break
-        line = line.strip()
-
-        # Empty lines are used as document delimiters
-        if not line:
-          all_documents.append([])
-        tokens = tokenizer.tokenize(line)
-        if tokens:
-          all_documents[-1].append(tokens)
-
-  # Remove empty documents
-  all_documents = [x for x in all_documents if x]
+    # read as bytes to count them, lines are split on b"\n" as in text mode
+    with file_io.open_file(input_file, "rb") as reader:
+      for line in reader:
+        METRICS.count("lines")
+        METRICS.count("bytes_read", len(line))
+        yield tokenization.convert_to_unicode(line).strip()
+
+
+def tokenize_lines(lines, tokenizer, num_workers=1):
+  """Tokenizes lines into token id arrays, yielding `None` for empty ones,
+  in the input order.
+
+  With `num_workers > 1`, chunks of lines are tokenized by a pool of processes
+  each holding its own `SentencePieceTokenizer`. At most a few chunks per
+  worker are in flight and results are consumed in submission order, so the
+  output is the same as that of a single process.
+  """
+  typecode = document_store.token_typecode(len(tokenizer.vocab))
+  if num_workers <= 1:
+    for chunk in _chunks(lines, TOKENIZE_CHUNK_SIZE):
+      for token_ids in _tokenize_chunk(tokenizer.tokenizer, typecode, chunk):
+        yield token_ids
+    return
+
+  cache = tokenizer.tokenizer.cache
+  pool = multiprocessing.Pool(
+      num_workers, initializer=_init_tokenize_worker,
+      initargs=(tokenizer.tokenizer.model_file,
+                tokenizer.tokenizer.do_lower_case, typecode,
+                cache.max_size if cache is not None else 0))
+  try:
+    pending = collections.deque()
+    for chunk in _chunks(lines, TOKENIZE_CHUNK_SIZE):
+      pending.append(pool.apply_async(_tokenize_worker_chunk, (chunk,)))
+      if len(pending) >= 2 * num_workers:
+        for token_ids in pending.popleft().get():
+          yield token_ids
+    while pending:
+      for token_ids in pending.popleft().get():
+        yield token_ids
+  finally:
+    pool.terminate()
+
+
+def _tokenize_chunk(tokenizer, typecode, lines):
+  batch = iter(tokenizer.batch_tokenize_ids([line for line in lines if line]))
+  return [array.array(typecode, next(batch)) if line else None
+          for line in lines]
+
+
+_worker_tokenizer = None
+_worker_typecode = None
+
+
+def _init_tokenize_worker(model_file, do_lower_case, typecode, cache_size):
+  global _worker_tokenizer, _worker_typecode
+  _worker_tokenizer = tokenization.SentencePieceTokenizer(
+      model_file, do_lower_case=do_lower_case, cache_size=cache_size)
+  _worker_typecode = typecode
+
+
+def _tokenize_worker_chunk(lines):
+  return _tokenize_chunk(_worker_tokenizer, _worker_typecode, lines)
+
+
+def _chunks(iterable, chunk_size):
+  chunk = []
+  for item in iterable:
+    chunk.append(item)
+    if len(chunk) == chunk_size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def read_documents(input_files, tokenizer, rng, num_workers=1):
+  """Reads and tokenizes the input files into a shuffled list of documents."""
+  all_documents = list(iter_documents(input_files, tokenizer, num_workers))
   rng.shuffle(all_documents)
+  return all_documents
+
+
+def load_document_store(store_prefix, input_files, tokenizer, rng,
+                        num_workers=1):
+  """Opens the on-disk document store, building it from the input files first
+  if it does not exist yet, and returns its documents shuffled by `rng`."""
+  if not document_store.DocumentStore.exists(store_prefix):
+    logging.info("*** Building document store %s ***", store_prefix)
+    writer = document_store.DocumentStoreWriter(
+        store_prefix, document_store.token_typecode(len(tokenizer.vocab)))
+    for document in iter_documents(input_files, tokenizer, num_workers):
+      with METRICS.stage("document_store"):
+        writer.add_document(document)
+    writer.close()
 
-  vocab_words = list(tokenizer.vocab.keys())
-  instances = []
-  for _ in range(dupe_factor):
-    for document_index in range(len(all_documents)):
-      instances.extend(
-          create_instances_from_document(
-              all_documents, document_index, max_seq_length, short_seq_prob,
-              masked_lm_prob, max_predictions_per_seq, vocab_words, rng))
+  store = document_store.DocumentStore(store_prefix)
+  logging.info("Loaded %d documents, %d sentences, %d tokens from %s",
+               store.num_documents, store.num_sentences, store.num_tokens,
+               store_prefix)
+  return store.shuffled(rng)
+
+
+def sample_documents(input_files, tokenizer, sample_rate, rng, num_workers=1):
+  """Reads the input files but tokenizes only a random sample of their
+  documents, each one taken with probability `sample_rate`.
+
+  Returns the tokenized documents of the sample and the number of documents
+  in the input files.
+  """
+  num_documents = 0
+  sample_lines = []
+  document_lines = []
+  lines = METRICS.timed("reading", iter_lines(input_files))
+  # the empty line at the end closes the last document
+  for line in itertools.chain(lines, [""]):
+    if line:
+      document_lines.append(line)
+      continue
+    if document_lines:
+      num_documents += 1
+      if rng.random() < sample_rate:
+        sample_lines.extend(document_lines)
+        sample_lines.append("")
+    document_lines = []
+  sample = list(tokenize_documents(sample_lines, tokenizer, num_workers))
+  return sample, num_documents
+
+
+def log_tokenizer_cache(tokenizer):
+  """Logs the statistics of the tokenizer cache of this process, if it was
+  used, and adds them to the metrics."""
+  cache = tokenizer.tokenizer.cache
+  if cache is None or not cache.hits + cache.misses:
+    return
+  logging.info("Tokenizer cache: %s", cache)
+  METRICS.count("tokenizer_cache_hits", cache.hits)
+  METRICS.count("tokenizer_cache_misses", cache.misses)
+  METRICS.count("tokenizer_cache_evictions", cache.evictions)
+
+
+def shuffle_instances(instances, buffer_size, rng):
+  """Shuffles a stream of instances holding at most `buffer_size` of them.
+
+  Every incoming instance replaces a randomly chosen one of the buffer, which
+  is yielded. This is the same approximation `tf.data.Dataset.shuffle` makes.
+  """
+  buffer = []
+  for instance in instances:
+    if len(buffer) < buffer_size:
+      buffer.append(instance)
+      continue
+    index = rng.randint(0, buffer_size - 1)
+    yield buffer[index]
+    buffer[index] = instance
 
-  rng.shuffle(instances)
-  return instances
+  rng.shuffle(buffer)
+  for instance in buffer:
+    yield instance
 
 
 def create_instances_from_document(
     all_documents, document_index, max_seq_length, short_seq_prob,
-    masked_lm_prob, max_predictions_per_seq, vocab_words, rng):
-  """Creates `TrainingInstance`s for a single document."""
+    masked_lm_prob, max_predictions_per_seq, vocab_info, rng,
+    mask_tokens=True):
+  """Creates `TrainingInstance`s for a single document.
+
+  If `mask_tokens` is False, the instances are left unmasked, i.e. without
+  masked LM predictions.
+  """
   document = all_documents[document_index]
 
   # Account for [CLS], [SEP], [SEP]
@@ -252,11 +841,11 @@ def create_instances_from_document(
         if len(current_chunk) >= 2:
           a_end = rng.randint(1, len(current_chunk) - 1)
 
-        tokens_a = []
+        tokens_a = array.array(vocab_info.typecode)
         for j in range(a_end):
           tokens_a.extend(current_chunk[j])
 
-        tokens_b = []
+        tokens_b = array.array(vocab_info.typecode)
         # Random next
         is_random_next = False
         if len(current_chunk) == 1 or rng.random() < 0.5:
@@ -292,32 +881,27 @@ def create_instances_from_document(
         assert len(tokens_a) >= 1
         assert len(tokens_b) >= 1
 
-        tokens = []
-        segment_ids = []
-        tokens.append("[CLS]")
-        segment_ids.append(0)
-        for token in tokens_a:
-          tokens.append(token)
-          segment_ids.append(0)
-
-        tokens.append("[SEP]")
-        segment_ids.append(0)
-
-        for token in tokens_b:
-          tokens.append(token)
-          segment_ids.append(1)
-        tokens.append("[SEP]")
-        segment_ids.append(1)
-
-        (tokens, masked_lm_positions,
-         masked_lm_labels) = create_masked_lm_predictions(
-             tokens, masked_lm_prob, max_predictions_per_seq, vocab_words, rng)
+        token_ids = array.array(vocab_info.typecode, [vocab_info.cls_id])
+        token_ids.extend(tokens_a)
+        token_ids.append(vocab_info.sep_id)
+        segment_a_length = len(token_ids)
+        token_ids.extend(tokens_b)
+        token_ids.append(vocab_info.sep_id)
+
+        masked_lm_positions = array.array(POSITION_TYPECODE)
+        masked_lm_ids = array.array(vocab_info.typecode)
+        if mask_tokens:
+          with METRICS.stage("masking"):
+            (token_ids, masked_lm_positions,
+             masked_lm_ids) = create_masked_lm_predictions(
+                 token_ids, masked_lm_prob, max_predictions_per_seq,
+                 vocab_info, rng)
         instance = TrainingInstance(
-            tokens=tokens,
-            segment_ids=segment_ids,
+            token_ids=token_ids,
+            segment_a_length=segment_a_length,
             is_random_next=is_random_next,
             masked_lm_positions=masked_lm_positions,
-            masked_lm_labels=masked_lm_labels)
+            masked_lm_ids=masked_lm_ids)
         instances.append(instance)
       current_chunk = []
       current_length = 0
@@ -330,22 +914,22 @@ MaskedLmInstance = collections.namedtuple("MaskedLmInstance",
                                           ["index", "label"])
 
 
-def create_masked_lm_predictions(tokens, masked_lm_prob,
-                                 max_predictions_per_seq, vocab_words, rng):
+def create_masked_lm_predictions(token_ids, masked_lm_prob,
+                                 max_predictions_per_seq, vocab_info, rng):
   """Creates the predictions for the masked LM objective."""
 
   cand_indexes = []
-  for (i, token) in enumerate(tokens):
-    if token == "[CLS]" or token == "[SEP]":
+  for (i, token_id) in enumerate(token_ids):
+    if token_id == vocab_info.cls_id or token_id == vocab_info.sep_id:
       continue
     cand_indexes.append(i)
 
   rng.shuffle(cand_indexes)
 
-  output_tokens = list(tokens)
+  output_ids = token_ids[:]
 
   num_to_predict = min(max_predictions_per_seq,
-                       max(1, int(round(len(tokens) * masked_lm_prob))))
+                       max(1, int(round(len(token_ids) * masked_lm_prob))))
 
   masked_lms = []
   covered_indexes = set()
@@ -356,31 +940,31 @@ def create_masked_lm_predictions(tokens, masked_lm_prob,
       continue
     covered_indexes.add(index)
 
-    masked_token = None
+    masked_id = None
     # 80% of the time, replace with [MASK]
     if rng.random() < 0.8:
-      masked_token = "[MASK]"
+      masked_id = vocab_info.mask_id
     else:
       # 10% of the time, keep original
       if rng.random() < 0.5:
-        masked_token = tokens[index]
+        masked_id = token_ids[index]
       # 10% of the time, replace with random word
       else:
-        masked_token = vocab_words[rng.randint(0, len(vocab_words) - 1)]
+        masked_id = rng.randint(0, vocab_info.size - 1)
 
-    output_tokens[index] = masked_token
+    output_ids[index] = masked_id
 
-    masked_lms.append(MaskedLmInstance(index=index, label=tokens[index]))
+    masked_lms.append(MaskedLmInstance(index=index, label=token_ids[index]))
 
   masked_lms = sorted(masked_lms, key=lambda x: x.index)
 
-  masked_lm_positions = []
-  masked_lm_labels = []
+  masked_lm_positions = array.array(POSITION_TYPECODE)
+  masked_lm_ids = array.array(vocab_info.typecode)
   for p in masked_lms:
     masked_lm_positions.append(p.index)
-    masked_lm_labels.append(p.label)
+    masked_lm_ids.append(p.label)
 
-  return (output_tokens, masked_lm_positions, masked_lm_labels)
+  return (output_ids, masked_lm_positions, masked_lm_ids)
 
 
 def truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng):
@@ -402,33 +986,312 @@ def truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng):
 
 
 def main(_):
-  tf.logging.set_verbosity(tf.logging.INFO)
+  logging.set_verbosity(logging.INFO)
+  METRICS.progress_interval = FLAGS.progress_interval
+  # `--profile_file` of absl.app profiles the run with cProfile
+  try:
+    create_pretraining_data()
+  finally:
+    METRICS.log_summary()
+    if FLAGS.metrics_file:
+      METRICS.write(FLAGS.metrics_file, FLAGS.metrics_format)
+      logging.info("Metrics written to %s", FLAGS.metrics_file)
+
+
+def create_pretraining_data():
+  """Creates the outputs of all `max_seq_length`s as configured by the
+  flags."""
+  if FLAGS.padding_strategy == "pack" and FLAGS.dynamic_masking:
+    raise ValueError("padding_strategy=pack does not support dynamic_masking, "
+                     "whose masks are drawn per row")
+  if FLAGS.num_shards is not None:
+    if not 0 <= FLAGS.shard_index < FLAGS.num_shards:
+      raise ValueError("shard_index must be in [0, num_shards)")
+    if FLAGS.masking_engine == "numpy" and not FLAGS.dynamic_masking:
+      raise ValueError("num_shards needs masking_engine=python, the NumPy "
+                       "engine masks batches spanning several documents")
+  if FLAGS.shuffle_buffer_size < 1:
+    raise ValueError("shuffle_buffer_size must be at least 1")
+  if FLAGS.dry_run and not 0 < FLAGS.dry_run_sample <= 1:
+    raise ValueError("dry_run_sample must be in (0, 1]")
+  if len(FLAGS.max_predictions_per_seq) != len(FLAGS.max_seq_length):
+    raise ValueError("Give one max_predictions_per_seq per max_seq_length")
+  if (len(FLAGS.max_seq_length) > 1 and
+      "{max_seq_length}" not in FLAGS.output_file):
+    raise ValueError("output_file must contain {max_seq_length} if several "
+                     "max_seq_lengths are given")
 
   tokenizer = tokenization.FullTokenizer(
       model_file=FLAGS.model_file, vocab_file=FLAGS.vocab_file,
-      do_lower_case=FLAGS.do_lower_case)
+      do_lower_case=FLAGS.do_lower_case,
+      cache_size=FLAGS.tokenizer_cache_size)
 
   input_files = []
   for input_pattern in FLAGS.input_file.split(","):
-    input_files.extend(tf.gfile.Glob(input_pattern))
-
-  tf.logging.info("*** Reading from input files ***")
+    input_files.extend(file_io.glob(input_pattern))
+
+  if FLAGS.dry_run:
+    dry_run(input_files, tokenizer)
+    return
+
+  # (max_seq_length, max_predictions_per_seq, output files, manifest) of the
+  # outputs still to create
+  lengths = []
+  for (max_seq_length, max_predictions_per_seq) in zip(
+      FLAGS.max_seq_length, FLAGS.max_predictions_per_seq):
+    output_files = FLAGS.output_file.replace(
+        "{max_seq_length}", str(max_seq_length)).split(",")
+    manifest = None
+    if FLAGS.manifest and generation_manifest.is_supported(
+        input_files + [FLAGS.model_file, FLAGS.vocab_file], output_files):
+      settings = {name: FLAGS[name].value for name in GENERATION_FLAGS}
+      settings["max_seq_length"] = max_seq_length
+      settings["max_predictions_per_seq"] = max_predictions_per_seq
+      manifest = generation_manifest.GenerationManifest(
+          output_files, input_files, FLAGS.model_file, FLAGS.vocab_file,
+          settings)
+      if manifest.is_complete():
+        logging.info("Outputs for max_seq_length=%d are up to date "
+                     "according to %s", max_seq_length, manifest.path)
+        continue
+    lengths.append((max_seq_length, max_predictions_per_seq, output_files,
+                    manifest))
+  if not lengths:
+    logging.info("Outputs are up to date, nothing to do")
+    return
+
+  logging.info("*** Reading from input files ***")
   for input_file in input_files:
-    tf.logging.info("  %s", input_file)
+    logging.info("  %s", input_file)
+
+  store_prefix = FLAGS.document_store
+  if (not store_prefix and FLAGS.tokenization_cache and
+      corpus_cache.is_cacheable(input_files)):
+    store_prefix = corpus_cache.cache_prefix(
+        input_files, FLAGS.model_file, FLAGS.do_lower_case,
+        FLAGS.tokenization_cache_dir)
+
+  vocab_info = get_vocab_info(tokenizer)
+  TrainingInstance.inv_vocab = tokenizer.inv_vocab
+
+  # the ETA of reading compares the bytes read to the size of the input files,
+  # which is unknown for remote or compressed files
+  input_size = None
+  if not any(file_io.is_remote(f) or file_io.is_compressed(f)
+             for f in input_files):
+    input_size = sum(os.path.getsize(f) for f in input_files)
+  METRICS.set_phase("reading", "bytes_read", input_size)
 
   rng = random.Random(FLAGS.random_seed)
-  instances = create_training_instances(
-      input_files, tokenizer, FLAGS.max_seq_length, FLAGS.dupe_factor,
-      FLAGS.short_seq_prob, FLAGS.masked_lm_prob, FLAGS.max_predictions_per_seq,
-      rng)
-
-  output_files = FLAGS.output_file.split(",")
-  tf.logging.info("*** Writing to output files ***")
+  if store_prefix:
+    all_documents = load_document_store(store_prefix, input_files, tokenizer,
+                                        rng, FLAGS.num_workers)
+  else:
+    all_documents = read_documents(input_files, tokenizer, rng,
+                                   FLAGS.num_workers)
+  log_tokenizer_cache(tokenizer)
+
+  # every length continues from the same random state, as a separate run
+  # would
+  rng_state = rng.getstate()
+  for (max_seq_length, max_predictions_per_seq, output_files,
+       manifest) in lengths:
+    logging.info("*** Creating instances of max_seq_length=%d ***",
+                 max_seq_length)
+    rng.setstate(rng_state)
+    create_output_files(all_documents, tokenizer, vocab_info, max_seq_length,
+                        max_predictions_per_seq, output_files, manifest, rng)
+
+
+def create_output_files(all_documents, tokenizer, vocab_info, max_seq_length,
+                        max_predictions_per_seq, output_files, manifest, rng):
+  """Creates the instances of one `max_seq_length` as configured by the flags
+  and writes them to `output_files`."""
+  dupe_factor = FLAGS.dupe_factor
+  if FLAGS.dynamic_masking:
+    # masks are created when loading, so no masked duplicates are needed
+    dupe_factor = 1
+  use_numpy_masking = (FLAGS.masking_engine == "numpy" and
+                       not FLAGS.dynamic_masking)
+  num_documents = len(all_documents)
+  if FLAGS.num_shards is not None:
+    start, end = shard_document_range(len(all_documents), FLAGS.shard_index,
+                                      FLAGS.num_shards)
+    num_documents = end - start
+    logging.info("*** Shard %d of %d: documents %d to %d of %d ***",
+                 FLAGS.shard_index, FLAGS.num_shards, start, end,
+                 len(all_documents))
+    instances = generate_sharded_training_instances(
+        all_documents, vocab_info, max_seq_length, dupe_factor,
+        FLAGS.short_seq_prob, FLAGS.masked_lm_prob, max_predictions_per_seq,
+        FLAGS.random_seed, FLAGS.shard_index, FLAGS.num_shards,
+        mask_tokens=not FLAGS.dynamic_masking)
+  else:
+    instances = generate_training_instances(
+        all_documents, vocab_info, max_seq_length, dupe_factor,
+        FLAGS.short_seq_prob, FLAGS.masked_lm_prob, max_predictions_per_seq,
+        rng, mask_tokens=not use_numpy_masking and not FLAGS.dynamic_masking)
+  METRICS.set_phase("creating instances of max_seq_length=%d" % max_seq_length,
+                    "documents_processed", num_documents * dupe_factor)
+  instances = METRICS.timed("instance_creation", instances,
+                            counter="instances_created")
+  if use_numpy_masking:
+    instances = METRICS.timed("masking", mask_instances_in_batches(
+        instances, vocab_info, max_seq_length, FLAGS.masked_lm_prob,
+        max_predictions_per_seq, np.random.default_rng(FLAGS.random_seed)))
+  if FLAGS.streaming:
+    # the instances are created while they are shuffled, so shuffling and
+    # packing draw from their own generator to create the same instances as
+    # without streaming
+    rng = random.Random(FLAGS.random_seed + STREAMING_SEED_OFFSET)
+    instances = METRICS.timed("shuffling", shuffle_instances(
+        instances, FLAGS.shuffle_buffer_size, rng))
+  else:
+    instances = list(instances)
+    with METRICS.stage("shuffling"):
+      rng.shuffle(instances)
+    METRICS.set_phase("writing max_seq_length=%d" % max_seq_length, "rows",
+                      None if FLAGS.padding_strategy == "pack"
+                      else len(instances))
+
+  bucket_lengths = None
+  max_sequences_per_pack = None
+  if FLAGS.padding_strategy == "pack":
+    max_sequences_per_pack = FLAGS.max_sequences_per_pack
+    instances = METRICS.timed("packing", sequence_packing.pack_instances(
+        instances, max_seq_length, max_predictions_per_seq,
+        max_sequences_per_pack, PACKING_BUFFER_SIZE, rng))
+  elif FLAGS.padding_strategy == "bucket":
+    bucket_lengths = get_bucket_lengths(max_seq_length)
+
+  logging.info("*** Writing to output files ***")
   for output_file in output_files:
-    tf.logging.info("  %s", output_file)
+    logging.info("  %s", output_file)
+
+  with METRICS.stage("writing"):
+    write_instance_to_example_files(
+        instances, tokenizer, max_seq_length, max_predictions_per_seq,
+        output_files, FLAGS.output_format, masked=not FLAGS.dynamic_masking,
+        bucket_lengths=bucket_lengths,
+        max_sequences_per_pack=max_sequences_per_pack, manifest=manifest,
+        checkpoint_every=FLAGS.checkpoint_every)
+
 
-  write_instance_to_example_files(instances, tokenizer, FLAGS.max_seq_length,
-                                  FLAGS.max_predictions_per_seq, output_files)
+def get_bucket_lengths(max_seq_length):
+  """The bucket lengths of `padding_strategy=bucket` given by the flags."""
+  if FLAGS.bucket_lengths:
+    return [int(x) for x in FLAGS.bucket_lengths]
+  return sequence_packing.default_bucket_lengths(max_seq_length)
+
+
+def dry_run(input_files, tokenizer):
+  """Estimates the outputs of all `max_seq_length`s from a random sample of
+  the documents, without writing anything."""
+  rng = random.Random(FLAGS.random_seed)
+  logging.info("*** Sampling %.1f%% of the documents ***",
+               100 * FLAGS.dry_run_sample)
+  sample, num_documents = sample_documents(
+      input_files, tokenizer, FLAGS.dry_run_sample, rng, FLAGS.num_workers)
+  if not sample:
+    raise ValueError("No document was sampled, increase dry_run_sample")
+  log_tokenizer_cache(tokenizer)
+  logging.info("Sampled %d of %d documents", len(sample), num_documents)
+
+  vocab_info = get_vocab_info(tokenizer)
+  rng.shuffle(sample)
+  rng_state = rng.getstate()
+  for (max_seq_length, max_predictions_per_seq) in zip(
+      FLAGS.max_seq_length, FLAGS.max_predictions_per_seq):
+    output_files = FLAGS.output_file.replace(
+        "{max_seq_length}", str(max_seq_length)).split(",")
+    rng.setstate(rng_state)
+    estimate_outputs(sample, num_documents, vocab_info, max_seq_length,
+                     max_predictions_per_seq, len(output_files), rng)
+
+
+def estimate_outputs(sample, num_documents, vocab_info, max_seq_length,
+                     max_predictions_per_seq, num_output_files, rng):
+  """Logs the number of instances, the padding and the size of the outputs of
+  one `max_seq_length` as configured by the flags, extrapolated from the
+  instances of the `sample` of the `num_documents` documents.
+
+  The size of TF examples is the mean size of up to `DRY_RUN_SERIALIZED_ROWS`
+  serialized rows per row length, that of NumPy shards is exact per row.
+  """
+  dupe_factor = 1 if FLAGS.dynamic_masking else FLAGS.dupe_factor
+  masked = not FLAGS.dynamic_masking
+  # number of documents of the outputs every sampled document stands for
+  scale = num_documents / len(sample)
+  if FLAGS.num_shards is not None:
+    start, end = shard_document_range(num_documents, FLAGS.shard_index,
+                                      FLAGS.num_shards)
+    scale *= (end - start) / num_documents
+
+  # the NumPy masking engine creates masks of the same distribution
+  rows = list(generate_training_instances(
+      sample, vocab_info, max_seq_length, dupe_factor, FLAGS.short_seq_prob,
+      FLAGS.masked_lm_prob, max_predictions_per_seq, rng, mask_tokens=masked))
+  rng.shuffle(rows)
+  num_instances = len(rows)
+
+  bucket_lengths = None
+  max_sequences_per_pack = None
+  if FLAGS.padding_strategy == "pack":
+    max_sequences_per_pack = FLAGS.max_sequences_per_pack
+    rows = list(sequence_packing.pack_instances(
+        rows, max_seq_length, max_predictions_per_seq, max_sequences_per_pack,
+        PACKING_BUFFER_SIZE, rng))
+  elif FLAGS.padding_strategy == "bucket":
+    bucket_lengths = sorted(set(get_bucket_lengths(max_seq_length)) |
+                            set([max_seq_length]))
+
+  padding_stats = sequence_packing.PaddingStats(max_seq_length)
+  rows_by_length = collections.defaultdict(list)
+  for row in rows:
+    row_length = max_seq_length
+    if max_sequences_per_pack:
+      padding_stats.add(len(row.instances), len(row), row_length)
+    else:
+      if bucket_lengths:
+        row_length = sequence_packing.bucket_length(len(row.token_ids),
+                                                    bucket_lengths)
+      padding_stats.add(1, len(row.token_ids), row_length)
+    rows_by_length[row_length].append(row)
+
+  logging.info("*** Estimated outputs of max_seq_length=%d ***",
+               max_seq_length)
+  logging.info("  instances: %d", round(num_instances * scale))
+  logging.info("  tokens: %d in the documents, %d in the instances",
+               round(sum(len(sentence) for document in sample
+                         for sentence in document) * scale),
+               round(padding_stats.num_tokens * scale))
+  logging.info("  padding fraction: %.1f%% when padding every instance to "
+               "%d, %.1f%% as written",
+               100 * padding_stats.padding_fraction_before, max_seq_length,
+               100 * padding_stats.padding_fraction_after)
+
+  total_bytes = 0
+  for row_length, length_rows in sorted(rows_by_length.items()):
+    if FLAGS.output_format == "numpy":
+      row_bytes = pretraining_shards.instance_bytes(
+          row_length, max_predictions_per_seq,
+          np.dtype(vocab_info.typecode).name, masked, max_sequences_per_pack)
+    else:
+      serialized = length_rows[:DRY_RUN_SERIALIZED_ROWS]
+      # length, its CRC, the record and its CRC
+      row_bytes = sum(
+          len(tfrecord_io.serialize_example(create_row_features(
+              row, row_length, max_seq_length, max_predictions_per_seq,
+              max_sequences_per_pack, masked))) + 16
+          for row in serialized) / len(serialized)
+    length_bytes = row_bytes * len(length_rows) * scale
+    total_bytes += length_bytes
+    logging.info("  rows of length %d: %d, %.1f MB, %.1f MB per output file",
+                 row_length, round(len(length_rows) * scale),
+                 length_bytes / 1e6, length_bytes / 1e6 / num_output_files)
+  logging.info("  size: %.1f MB, %.1f MB per output file (%d output files)",
+               total_bytes / 1e6, total_bytes / 1e6 / num_output_files,
+               num_output_files)
 
 
 if __name__ == "__main__":
@@ -436,4 +1299,4 @@ if __name__ == "__main__":
   flags.mark_flag_as_required("output_file")
   flags.mark_flag_as_required("model_file")
   flags.mark_flag_as_required("vocab_file")
-  tf.app.run()
\ No newline at end of file
+  app.run(main)
\ No newline at end of file
@@ -1,26 +1,55 @@
 #!/usr/bin/env python3
-"""Generate TFRecords for the max seq length 128 and 512 for a given model."""
+"""Generate TFRecords for the max seq length 128 and 512 for a given model.
+
+Every corpus file is a job of `create_pretraining_data.py`, which creates the outputs of all
+max seq lengths from one tokenization of the file. Up to `--jobs` of them run at the same time,
+the largest input files first. The output of every job goes to a log file in `mn_corpus/logs/`,
+failed jobs are retried, with the output of every attempt kept in the log, and a throughput
+table is printed at the end.
+
+Every job keeps a manifest next to its output, so on a rerun only the jobs whose corpus file or
+settings changed do any work, and interrupted jobs resume. The manifests of all jobs and of the
+shuffled shards are collected in `mn_corpus/manifest.json`.
+"""
 
 import os
 import sys
 import glob
+import json
+import time
 import argparse
-from os.path import abspath, dirname, join, splitext, basename, exists
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname, join, splitext, basename, exists, getsize
 
 
 parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("--max_seq_length", type=int,
-                    help='max_seq_length see BERT')
-parser.add_argument("--max_predictions_per_seq", type=int,
-                    help='max_predictions_per_seq see BERT')
+parser.add_argument("--max_seq_length", type=int, nargs='+',
+                    help='max_seq_length see BERT, several values create one output of every file per value')
+parser.add_argument("--max_predictions_per_seq", type=int, nargs='+',
+                    help='max_predictions_per_seq see BERT, one value per max_seq_length')
 parser.add_argument("--cased", action='store_true',
                     help='if set, create data using cased SentencePiece')
+parser.add_argument("--num_shuffled_shards", type=int, default=0,
+                    help='if set, shuffle the TFRecords of all corpus files together into this many shards')
+parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                    help='number of create_pretraining_data.py processes running at the same time')
+parser.add_argument("--retries", type=int, default=2,
+                    help='number of times a failed job is started again')
 args = parser.parse_args()
 
+if len(args.max_seq_length) != len(args.max_predictions_per_seq):
+    print('give one --max_predictions_per_seq per --max_seq_length')
+    sys.exit(-1)
+
 
 SCRIPT_DIR = dirname(abspath(__file__))
 PARENT_SCRIPT = join(SCRIPT_DIR, 'create_pretraining_data.py')
+SHUFFLE_SCRIPT = join(SCRIPT_DIR, 'shuffle_shards.py')
 MN_CORPUS_FOLDER = 'mn_corpus'
+LOG_FOLDER = join(MN_CORPUS_FOLDER, 'logs')
+MANIFEST_FILE = join(MN_CORPUS_FOLDER, 'manifest.json')
 sp_name = 'mn_cased' if args.cased else 'mn_uncased'
 MODEL_FILE = 'sentencepiece/%s.model' % sp_name
 VOCAB_FILE = 'sentencepiece/%s.vocab' % sp_name
@@ -32,30 +61,154 @@ for f in [MODEL_FILE, VOCAB_FILE]:
         sys.exit(-1)
 
 
-output_files = []
-for input_file in sorted(glob.glob('%s/*.txt' % join(SCRIPT_DIR, MN_CORPUS_FOLDER))):
-    input_file = abspath(input_file)
-    output_file = join(MN_CORPUS_FOLDER, 'maxseq%i-%s.tfrecord' % (args.max_seq_length, splitext(basename(input_file))[0]))
-    output_files.append(output_file)
-
-    command = """python3 %s \
---input_file=%s \
---output_file=%s \
---model_file=%s \
---vocab_file=%s \
---do_lower_case=%s \
---max_seq_length=%i \
---max_predictions_per_seq=%i \
---masked_lm_prob=0.15 \
---random_seed=12345 \
---dupe_factor=5""" % (PARENT_SCRIPT, input_file, output_file, MODEL_FILE, VOCAB_FILE,
-                      'False' if args.cased else 'True',
-                      args.max_seq_length, args.max_predictions_per_seq)
-    print(command)
-    os.system(command)
+class Job(object):
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.name = splitext(basename(input_file))[0]
+        # output file and its manifest by max seq length
+        self.output_files = {max_seq_length: join(MN_CORPUS_FOLDER, 'maxseq%i-%s.tfrecord' % (max_seq_length, self.name))
+                             for max_seq_length in args.max_seq_length}
+        self.manifests = {}
+        self.log_file = join(LOG_FOLDER, '%s.log' % self.name)
+        self.input_size = getsize(input_file)
+        self.command = [sys.executable, PARENT_SCRIPT,
+                        '--input_file=%s' % input_file,
+                        '--output_file=%s' % join(MN_CORPUS_FOLDER, 'maxseq{max_seq_length}-%s.tfrecord' % self.name),
+                        '--model_file=%s' % MODEL_FILE,
+                        '--vocab_file=%s' % VOCAB_FILE,
+                        '--do_lower_case=%s' % ('False' if args.cased else 'True'),
+                        '--masked_lm_prob=0.15',
+                        '--random_seed=12345',
+                        '--dupe_factor=5']
+        for max_seq_length, max_predictions_per_seq in zip(args.max_seq_length, args.max_predictions_per_seq):
+            self.command += ['--max_seq_length=%i' % max_seq_length,
+                             '--max_predictions_per_seq=%i' % max_predictions_per_seq]
+        self.attempts = 0
+        self.returncode = None
+        self.seconds = 0.0
+        self.instances = None
+        self.status = None
+
+
+print_lock = threading.Lock()
+
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+
+def run(job):
+    while job.attempts <= args.retries:
+        job.attempts += 1
+        log('[start] %s (attempt %i): %s' % (job.name, job.attempts, ' '.join(job.command)))
+        start = time.time()
+        # the first attempt replaces the log of an earlier run of the helper,
+        # retries are appended to keep the output of the failed attempts
+        with open(job.log_file, 'w' if job.attempts == 1 else 'a') as f:
+            f.write('=== attempt %i: %s\n' % (job.attempts, ' '.join(job.command)))
+            f.flush()
+            attempt_offset = f.tell()
+            job.returncode = subprocess.call(job.command, stdout=f, stderr=subprocess.STDOUT)
+        job.seconds = time.time() - start
+        if job.returncode == 0:
+            job.status = job_status(job.log_file, attempt_offset)
+            for max_seq_length, output_file in job.output_files.items():
+                with open(output_file + '.manifest.json') as f:
+                    job.manifests[max_seq_length] = json.load(f)
+            job.instances = sum(manifest['num_instances'] for manifest in job.manifests.values())
+            log('[%s] %s in %.0fs' % (job.status, job.name, job.seconds))
+            return job
+        job.status = 'FAILED'
+        log('[failed] %s with exit code %i, see %s' % (job.name, job.returncode, job.log_file))
+    return job
+
+
+def job_status(log_file, offset=0):
+    """'up to date', 'resumed' or 'done' according to the log of a successful
+    attempt, which starts at `offset` of the log file."""
+    with open(log_file, 'rb') as f:
+        f.seek(offset)
+        log_text = f.read().decode('utf-8', 'ignore')
+    if 'Outputs are up to date' in log_text:
+        return 'up to date'
+    if 'Resuming after' in log_text:
+        return 'resumed'
+    return 'done'
+
+
+def print_throughput(jobs, wall_seconds):
+    row = '%-40s %10s %8s %12s %10s %10s %8s'
+    print(row % ('job', 'status', 'attempts', 'instances', 'input MB', 'seconds', 'MB/s'))
+    for job in jobs:
+        mb = job.input_size / 1e6
+        print(row % (job.name, job.status, job.attempts,
+                     job.instances if job.instances is not None else '-', '%.1f' % mb,
+                     '%.1f' % job.seconds, '%.2f' % (mb / job.seconds if job.seconds else 0)))
+    mb = sum(job.input_size for job in jobs) / 1e6
+    print(row % ('total (%i files, wall time)' % len(set(job.input_file for job in jobs)), '', '',
+                 sum(job.instances or 0 for job in jobs), '%.1f' % mb, '%.1f' % wall_seconds,
+                 '%.2f' % (mb / wall_seconds if wall_seconds else 0)))
+
+
+input_files = [abspath(f) for f in sorted(glob.glob('%s/*.txt' % join(SCRIPT_DIR, MN_CORPUS_FOLDER)))]
+jobs = [Job(input_file) for input_file in input_files]
+if not exists(LOG_FOLDER):
+    os.makedirs(LOG_FOLDER)
+
+start = time.time()
+# the largest files first, so that no big job starts last when the others are done
+with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    list(executor.map(run, sorted(jobs, key=lambda job: job.input_size, reverse=True)))
+print('\n')
+print_throughput(jobs, time.time() - start)
+
+failed = [job for job in jobs if job.returncode != 0]
+if failed:
+    print('\n%i jobs failed:' % len(failed))
+    for job in failed:
+        print('  %s, see %s' % (job.name, job.log_file))
+    sys.exit(1)
+
+manifest = {'jobs': {}, 'shuffled': {}}
+if exists(MANIFEST_FILE):
+    with open(MANIFEST_FILE) as f:
+        manifest = json.load(f)
+manifest['jobs'].update((basename(job.output_files[max_seq_length]), job.manifests[max_seq_length])
+                        for job in jobs for max_seq_length in args.max_seq_length)
+
+export_lines = []
+for max_seq_length in args.max_seq_length:
+    output_files = [job.output_files[max_seq_length] for job in jobs]
+    if args.num_shuffled_shards:
+        output_prefix = join(MN_CORPUS_FOLDER, 'shuffled', 'maxseq%i' % max_seq_length)
+        shuffled_files = ['%s-%05d-of-%05d.tfrecord' % (output_prefix, i, args.num_shuffled_shards)
+                          for i in range(args.num_shuffled_shards)]
+        shuffled = {'inputs': {job.output_files[max_seq_length]: job.manifests[max_seq_length]['fingerprint']
+                               for job in jobs},
+                    'files': shuffled_files, 'seed': 12345}
+        if manifest['shuffled'].get(str(max_seq_length)) == shuffled and all(exists(f) for f in shuffled_files):
+            print('shuffled shards of max seq length %i are up to date' % max_seq_length)
+        else:
+            command = [sys.executable, SHUFFLE_SCRIPT,
+                       '--input_file=%s' % ','.join(output_files),
+                       '--output_prefix=%s' % output_prefix,
+                       '--num_shards=%i' % args.num_shuffled_shards,
+                       '--seed=12345']
+            print(' '.join(command))
+            if subprocess.call(command) != 0:
+                print('shuffling failed')
+                sys.exit(1)
+            manifest['shuffled'][str(max_seq_length)] = shuffled
+        output_files = shuffled_files
+    export_lines.append((len(output_files), output_files))
+
+with open(MANIFEST_FILE, 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
 
 print('done')
 print('\n\n\n')
-print('tf record files %i :\n' % len(output_files))
-output_files = ["gs://mongolian-bert/$MODEL_DIR/%s" % basename(f) for f in output_files]
-print('export INPUT_FILES=%s' % ','.join(output_files))
+for num_files, output_files in export_lines:
+    print('tf record files %i :\n' % num_files)
+    output_files = ["gs://mongolian-bert/$MODEL_DIR/%s" % basename(f) for f in output_files]
+    print('export INPUT_FILES=%s' % ','.join(output_files))
@@ -0,0 +1,203 @@
+"""On-disk store of tokenized documents, memory-mapped for instance generation.
+
+A store is a set of files sharing a prefix:
+
+  <prefix>.tokens     token ids of all sentences, one after another
+  <prefix>.sentences  int64 offsets into `.tokens`, one per sentence plus one
+  <prefix>.documents  int64 offsets into `.sentences`, one per document plus one
+  <prefix>.json       header with the counts and the token id type code
+
+The files are opened with `mmap`, so random access to any document does not
+require holding the corpus in Python lists and several processes reading the
+same store share its pages through the page cache.
+"""
+
+import os
+import json
+import mmap
+from array import array
+
+OFFSET_TYPECODE = 'q'
+
+
+def token_typecode(vocab_size):
+    """Smallest array type code able to hold ids of a vocabulary of the given size."""
+    return 'H' if vocab_size <= 1 << 16 else 'i'
+
+
+class DocumentStoreWriter(object):
+    """Writes documents sentence by sentence into a new store.
+
+    The files are written under temporary names and only renamed to their final
+    names by `close()`, so a store that exists on disk is always complete, even
+    if several processes build the same store at the same time.
+    """
+
+    def __init__(self, prefix, typecode='H'):
+        self.prefix = prefix
+        self.typecode = typecode
+        self.num_tokens = 0
+        self.num_sentences = 0
+        self.num_documents = 0
+        self._document_end = 0
+        self._files = {}
+        for suffix in ['tokens', 'sentences', 'documents']:
+            self._files[suffix] = open(self._tmp_path(suffix), 'wb')
+        array(OFFSET_TYPECODE, [0]).tofile(self._files['sentences'])
+        array(OFFSET_TYPECODE, [0]).tofile(self._files['documents'])
+
+    def _tmp_path(self, suffix):
+        return '%s.%s.tmp%d' % (self.prefix, suffix, os.getpid())
+
+    def add_sentence(self, token_ids):
+        """Appends a sentence, given as token ids, to the current document."""
+        if not token_ids:
+            return
+        array(self.typecode, token_ids).tofile(self._files['tokens'])
+        self.num_tokens += len(token_ids)
+        self.num_sentences += 1
+        array(OFFSET_TYPECODE, [self.num_tokens]).tofile(self._files['sentences'])
+
+    def add_document(self, document):
+        """Appends a whole document, given as a list of token id sentences."""
+        for sentence in document:
+            self.add_sentence(sentence)
+        self.end_document()
+
+    def end_document(self):
+        """Closes the current document. Empty documents are dropped."""
+        if self.num_sentences == self._document_end:
+            return
+        self._document_end = self.num_sentences
+        self.num_documents += 1
+        array(OFFSET_TYPECODE, [self.num_sentences]).tofile(self._files['documents'])
+
+    def close(self):
+        self.end_document()
+        for f in self._files.values():
+            f.close()
+        header = {
+            'typecode': self.typecode,
+            'num_tokens': self.num_tokens,
+            'num_sentences': self.num_sentences,
+            'num_documents': self.num_documents,
+        }
+        with open(self._tmp_path('json'), 'w') as f:
+            json.dump(header, f, indent=2)
+        # the header is renamed last: its presence marks a complete store
+        for suffix in ['tokens', 'sentences', 'documents', 'json']:
+            os.replace(self._tmp_path(suffix), '%s.%s' % (self.prefix, suffix))
+
+
+class DocumentStore(object):
+    """Read-only, memory-mapped view of a store written by `DocumentStoreWriter`.
+
+    Behaves like a list of documents, each of which behaves like a list of
+    sentences. Sentences are returned as token id arrays, or passed through
+    `decode` (e.g. `FullTokenizer.convert_ids_to_tokens`) if given.
+    """
+
+    def __init__(self, prefix, decode=None):
+        self.prefix = prefix
+        self.decode = decode
+        with open('%s.json' % prefix) as f:
+            header = json.load(f)
+        self.typecode = header['typecode']
+        self.num_tokens = header['num_tokens']
+        self.num_sentences = header['num_sentences']
+        self.num_documents = header['num_documents']
+
+        self._maps = []
+        self._itemsize = array(self.typecode).itemsize
+        self._tokens = self._map('tokens', 'B')
+        self._sentences = self._map('sentences', OFFSET_TYPECODE)
+        self._documents = self._map('documents', OFFSET_TYPECODE)
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.exists('%s.json' % prefix)
+
+    def _map(self, suffix, typecode):
+        with open('%s.%s' % (self.prefix, suffix), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'').cast(typecode)
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(m)
+        return memoryview(m).cast(typecode)
+
+    def __len__(self):
+        return self.num_documents
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.num_documents
+        if not 0 <= index < self.num_documents:
+            raise IndexError('document index out of range')
+        return StoredDocument(self, self._documents[index], self._documents[index + 1])
+
+    def sentence(self, index):
+        """Returns the token ids of the sentence with the given global index."""
+        start = self._sentences[index] * self._itemsize
+        end = self._sentences[index + 1] * self._itemsize
+        ids = array(self.typecode)
+        ids.frombytes(self._tokens[start:end])
+        if self.decode is not None:
+            return self.decode(ids)
+        return ids
+
+    def shuffled(self, rng):
+        """Returns a view of the documents in an order shuffled by `rng`.
+
+        `rng` is advanced exactly as by `rng.shuffle(list(store))`, so the
+        resulting order is the same as shuffling an in-memory document list.
+        """
+        order = array(OFFSET_TYPECODE, range(self.num_documents))
+        rng.shuffle(order)
+        return PermutedDocuments(self, order)
+
+    def close(self):
+        self._tokens.release()
+        self._sentences.release()
+        self._documents.release()
+        for m in self._maps:
+            m.close()
+        self._maps = []
+
+
+class StoredDocument(object):
+    """A document of a `DocumentStore`, i.e. a list-like of its sentences."""
+
+    __slots__ = ['store', 'start', 'end']
+
+    def __init__(self, store, start, end):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sentence index out of range')
+        return self.store.sentence(self.start + index)
+
+    def __iter__(self):
+        for index in range(self.start, self.end):
+            yield self.store.sentence(index)
+
+
+class PermutedDocuments(object):
+    """The documents of a `DocumentStore` in the given order."""
+
+    def __init__(self, store, order):
+        self.store = store
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        return self.store[self.order[index]]
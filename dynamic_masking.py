@@ -0,0 +1,91 @@
+"""Masking of unmasked pre-training instances while loading them.
+
+`create_pretraining_data.py --dynamic_masking` writes every sentence pair only
+once and without masked LM features. `DynamicMaskingLoader` reads such NumPy
+shards or TFRecord files and adds the masked LM features batch by batch with
+`masked_lm.create_masked_lm_predictions_batch`, the NumPy counterpart of
+`create_masked_lm_predictions`. Its random generator is seeded with the seed
+and the epoch, so every epoch gets new masks and any epoch can be reproduced.
+"""
+
+import os
+
+import numpy as np
+
+import masked_lm
+import pretraining_shards
+import tfrecord_io
+
+UNMASKED_FEATURES = ['input_ids', 'input_mask', 'segment_ids', 'next_sentence_labels']
+
+
+class DynamicMaskingLoader(object):
+    """Yields masked batches with all seven BERT pre-training features.
+
+    `paths` are NumPy shard directories or TFRecord files of unmasked
+    instances. The vocabulary parameters are read from the shard headers if
+    not given; they are required for TFRecord files.
+    """
+
+    def __init__(self, paths, masked_lm_prob=0.15, max_predictions_per_seq=20, vocab_size=None,
+                 mask_id=None, special_ids=None, seed=12345):
+        self.paths = list(paths)
+        self.masked_lm_prob = masked_lm_prob
+        self.max_predictions_per_seq = max_predictions_per_seq
+        self.seed = seed
+
+        metadata = {}
+        if self.paths and os.path.isdir(self.paths[0]):
+            metadata = pretraining_shards.Shard(self.paths[0]).metadata
+        self.vocab_size = vocab_size if vocab_size is not None else metadata.get('vocab_size')
+        self.mask_id = mask_id if mask_id is not None else metadata.get('mask_id')
+        if special_ids is None and 'cls_id' in metadata:
+            special_ids = [metadata['cls_id'], metadata['sep_id']]
+        self.special_ids = special_ids
+        if self.vocab_size is None or self.mask_id is None or self.special_ids is None:
+            raise ValueError('vocab_size, mask_id and special_ids are needed to mask %s' % self.paths)
+
+    def iter_batches(self, epoch, batch_size, shuffle=True):
+        """Yields the batches of the given epoch.
+
+        With `shuffle`, the order of the files and of the instances within a
+        NumPy shard is shuffled as well; TFRecord files are read in order.
+        """
+        rng = np.random.default_rng([self.seed, epoch])
+        paths = list(self.paths)
+        if shuffle:
+            rng.shuffle(paths)
+        for path in paths:
+            if os.path.isdir(path):
+                shard = pretraining_shards.Shard(path)
+                batches = shard.iter_batches(batch_size, shuffle=shuffle, seed=rng.integers(1 << 31))
+            else:
+                batches = _iter_tfrecord_batches(path, batch_size)
+            for batch in batches:
+                yield self.mask(batch, rng)
+
+    def mask(self, batch, rng):
+        """Adds the masked LM features to an unmasked batch."""
+        batch = {name: np.asarray(batch[name]) for name in UNMASKED_FEATURES}
+        (batch['input_ids'], batch['masked_lm_positions'], batch['masked_lm_ids'],
+         batch['masked_lm_weights']) = masked_lm.create_masked_lm_predictions_batch(
+             batch['input_ids'], batch['input_mask'], self.masked_lm_prob, self.max_predictions_per_seq,
+             self.vocab_size, self.mask_id, self.special_ids, rng)
+        return batch
+
+
+def _iter_tfrecord_batches(path, batch_size):
+    rows = []
+    for record in tfrecord_io.tf_record_iterator(path):
+        rows.append(tfrecord_io.parse_example(record))
+        if len(rows) == batch_size:
+            yield _stack(rows)
+            rows = []
+    if rows:
+        yield _stack(rows)
+
+
+def _stack(rows):
+    batch = {name: np.array([row[name].values for row in rows]) for name in UNMASKED_FEATURES}
+    batch['next_sentence_labels'] = batch['next_sentence_labels'].reshape(-1)
+    return batch
@@ -0,0 +1,155 @@
+"""File access without TensorFlow for local paths.
+
+Remote paths such as `gs://bucket/file` are still opened through TensorFlow's
+gfile, which is only imported when such a path is used.
+
+Files ending in `.gz`, `.bz2`, `.xz` or `.zst` are decompressed transparently
+when opened for reading, local or remote. A background thread decompresses
+blocks of `READ_BUFFER_SIZE` bytes up to `READ_AHEAD_BLOCKS` ahead of the
+reader, so decompression overlaps with the processing of the lines (zlib,
+bz2, lzma and zstandard release the GIL while decompressing). `.zst` files
+need the `zstandard` package.
+"""
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+import glob as _glob
+
+# Number of bytes read from a file at once
+READ_BUFFER_SIZE = 1 << 20
+
+# Number of decompressed blocks read ahead of the reader of a compressed file
+READ_AHEAD_BLOCKS = 8
+
+
+def is_remote(path):
+    return '://' in path
+
+
+def _gfile():
+    import tensorflow as tf
+    return tf.io.gfile if hasattr(tf, 'io') and hasattr(tf.io, 'gfile') else tf.gfile
+
+
+def _open_zstd(fileobj):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('reading .zst files needs the zstandard package: pip install zstandard')
+    return zstandard.ZstdDecompressor().stream_reader(fileobj, read_size=READ_BUFFER_SIZE,
+                                                      read_across_frames=True)
+
+
+# functions wrapping a binary file object into a decompressing one, by extension
+_DECOMPRESSORS = {
+    '.gz': lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='rb'),
+    '.bz2': lambda fileobj: bz2.BZ2File(fileobj, mode='rb'),
+    '.xz': lambda fileobj: lzma.LZMAFile(fileobj, mode='rb'),
+    '.zst': _open_zstd,
+}
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1] in _DECOMPRESSORS
+
+
+def _open_raw(path, mode):
+    if is_remote(path):
+        return _gfile().GFile(path, mode)
+    return open(path, mode, buffering=READ_BUFFER_SIZE if 'r' in mode else -1)
+
+
+def open_file(path, mode='r'):
+    """Opens a local file with `open` and a remote one with gfile; compressed
+    files opened for reading are decompressed in a background thread."""
+    if 'r' in mode and is_compressed(path):
+        compressed = _open_raw(path, 'rb')
+        decompressor = _DECOMPRESSORS[os.path.splitext(path)[1]](compressed)
+        reader = io.BufferedReader(_ReadAheadStream(decompressor, [decompressor, compressed]),
+                                   READ_BUFFER_SIZE)
+        if 'b' in mode:
+            return reader
+        # like gfile, split lines on '\n' only
+        return io.TextIOWrapper(reader, encoding='utf-8', errors='ignore', newline='\n')
+    if is_remote(path):
+        return _gfile().GFile(path, mode)
+    if 'b' in mode:
+        return _open_raw(path, mode)
+    # like gfile, split lines on '\n' only
+    return open(path, mode, encoding='utf-8', errors='ignore', newline='\n')
+
+
+def glob(pattern):
+    """Sorted list of the files matching a pattern."""
+    if is_remote(pattern):
+        gfile = _gfile()
+        return sorted(gfile.glob(pattern) if hasattr(gfile, 'glob') else gfile.Glob(pattern))
+    return sorted(_glob.glob(pattern))
+
+
+class _ReadAheadStream(io.RawIOBase):
+    """Raw stream of the blocks a background thread reads from `fileobj`, at
+    most `READ_AHEAD_BLOCKS` ahead. `closables` are closed with the stream."""
+
+    def __init__(self, fileobj, closables):
+        super(_ReadAheadStream, self).__init__()
+        self._fileobj = fileobj
+        self._closables = closables
+        self._blocks = queue.Queue(READ_AHEAD_BLOCKS)
+        self._block = memoryview(b'')
+        self._eof = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._read_ahead, name='read-ahead')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_ahead(self):
+        try:
+            while not self._stopped.is_set():
+                block = self._fileobj.read(READ_BUFFER_SIZE)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            # raised again in the reading thread
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._eof:
+                return 0
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self._eof = True
+                return 0
+            self._block = memoryview(block)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            self._thread.join()
+            for closable in self._closables:
+                closable.close()
+        super(_ReadAheadStream, self).close()
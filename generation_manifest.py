@@ -0,0 +1,118 @@
+"""Manifest of the outputs of a `create_pretraining_data.py` run, used to skip
+up-to-date outputs and to resume interrupted runs.
+
+Two JSON files are kept next to the first output file:
+
+  <output>.manifest.json  written once all outputs are complete. It records the
+                          hashes of the input files and of the tokenizer files,
+                          the generation flags including the seed, and the
+                          written files with their instance counts. A rerun with
+                          the same fingerprint, the hash of everything but the
+                          counts, has nothing to do.
+  <output>.progress.json  written while the outputs are written, every
+                          `checkpoint_every` rows after flushing all outputs,
+                          with the number of rows written and the size of every
+                          output file. A rerun with the same fingerprint
+                          truncates the outputs to these sizes, creates the
+                          same instances again and only writes those after the
+                          checkpoint, so its outputs are the same as those of
+                          an uninterrupted run.
+
+Only local input and output files are supported.
+"""
+
+import os
+import json
+import hashlib
+
+import corpus_cache
+import file_io
+import pretraining_shards
+
+MANIFEST_VERSION = 1
+
+
+def is_supported(input_files, output_files):
+    return corpus_cache.is_cacheable(input_files) and not any(file_io.is_remote(f) for f in output_files)
+
+
+def output_data_files(output_file):
+    """The files holding the data of an output: the file itself or the arrays of
+    a NumPy shard directory."""
+    if os.path.isdir(output_file):
+        return sorted(os.path.join(output_file, name) for name in os.listdir(output_file)
+                      if name != pretraining_shards.HEADER_FILE)
+    return [output_file] if os.path.exists(output_file) else []
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _dump(path, data):
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class GenerationManifest(object):
+    """Manifest of the outputs created from `input_files` with the tokenizer
+    files and the generation `settings`, a JSON serializable dict."""
+
+    def __init__(self, output_files, input_files, model_file, vocab_file, settings):
+        prefix = output_files[0].rstrip('/')
+        self.path = prefix + '.manifest.json'
+        self.progress_path = prefix + '.progress.json'
+        self.record = {
+            'version': MANIFEST_VERSION,
+            'inputs': {f: corpus_cache.file_hash(f) for f in input_files},
+            'tokenizer': {f: corpus_cache.file_hash(f) for f in [model_file, vocab_file]},
+            'settings': settings,
+            'outputs': list(output_files),
+        }
+        self.fingerprint = hashlib.sha1(json.dumps(self.record, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_complete(self):
+        """Whether the outputs were completed with the same fingerprint and still exist."""
+        manifest = _load(self.path)
+        if manifest is None or manifest.get('fingerprint') != self.fingerprint:
+            return False
+        return all(os.path.exists(f) for f in manifest['files'])
+
+    def resume_point(self):
+        """Returns the number of rows and the sizes of the output files at the
+        last checkpoint of an interrupted run with the same fingerprint, after
+        truncating the files to these sizes, or None."""
+        progress = _load(self.progress_path)
+        if progress is None or progress.get('fingerprint') != self.fingerprint:
+            return None
+        sizes = progress['sizes']
+        if not all(os.path.exists(f) and os.path.getsize(f) >= size for f, size in sizes.items()):
+            return None
+        for f, size in sizes.items():
+            os.truncate(f, size)
+        return progress['num_rows'], sizes
+
+    def checkpoint(self, num_rows, output_files):
+        """Records that the first `num_rows` rows are in the (flushed) output files."""
+        sizes = {}
+        for output_file in output_files:
+            for f in output_data_files(output_file):
+                sizes[f] = os.path.getsize(f)
+        _dump(self.progress_path, {'fingerprint': self.fingerprint, 'num_rows': num_rows, 'sizes': sizes})
+
+    def complete(self, file_rows, num_instances):
+        """Writes the manifest of the completed outputs, given the number of rows
+        of every written file, and removes the progress file."""
+        manifest = dict(self.record)
+        manifest['fingerprint'] = self.fingerprint
+        manifest['files'] = dict(file_rows)
+        manifest['num_rows'] = sum(file_rows.values())
+        manifest['num_instances'] = num_instances
+        _dump(self.path, manifest)
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
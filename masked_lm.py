@@ -0,0 +1,73 @@
+"""Vectorized masked LM predictions for batches of padded token id matrices.
+
+This is a NumPy counterpart of `create_pretraining_data.create_masked_lm_predictions`
+with the same distribution: per sequence, `min(max_predictions_per_seq,
+max(1, round(length * masked_lm_prob)))` distinct positions other than the
+special tokens are drawn uniformly; 80% of them are replaced by [MASK], 10% are
+kept and 10% are replaced by a random vocabulary id.
+"""
+
+import numpy as np
+
+
+def create_masked_lm_predictions_batch(input_ids, input_mask, masked_lm_prob,
+                                       max_predictions_per_seq, vocab_size,
+                                       mask_id, special_ids, rng):
+    """Masks a batch of sequences.
+
+    Args:
+      input_ids: [batch_size, seq_length] int array of token ids.
+      input_mask: [batch_size, seq_length] array, 1 for real tokens and 0 for
+        padding.
+      masked_lm_prob: fraction of the tokens of a sequence to predict.
+      max_predictions_per_seq: maximum number of predictions per sequence.
+      vocab_size: random replacements are drawn from `[0, vocab_size)`.
+      mask_id: id of the [MASK] token.
+      special_ids: ids which are never masked, i.e. those of [CLS] and [SEP].
+      rng: a `numpy.random.Generator`.
+
+    Returns:
+      A tuple `(masked_input_ids, masked_lm_positions, masked_lm_ids,
+      masked_lm_weights)`. The last three are [batch_size,
+      max_predictions_per_seq] arrays sorted by position and padded with 0.
+    """
+    input_ids = np.asarray(input_ids)
+    input_mask = np.asarray(input_mask).astype(bool)
+    batch_size, seq_length = input_ids.shape
+
+    candidates = input_mask & ~np.isin(input_ids, special_ids)
+    lengths = input_mask.sum(axis=1)
+    num_to_predict = np.minimum(
+        max_predictions_per_seq,
+        np.maximum(1, np.round(lengths * masked_lm_prob).astype(np.int64)))
+    num_to_predict = np.minimum(num_to_predict, candidates.sum(axis=1))
+
+    # a uniformly random subset of `num_to_predict` candidates: the ones with
+    # the smallest random keys
+    keys = rng.random((batch_size, seq_length))
+    keys[~candidates] = np.inf
+    ranks = np.argsort(np.argsort(keys, axis=1), axis=1)
+    selected = ranks < num_to_predict[:, None]
+
+    # 80% of the time, replace with [MASK], 10% of the time, keep original,
+    # 10% of the time, replace with random word
+    decision = rng.random((batch_size, seq_length))
+    random_ids = rng.integers(0, vocab_size, size=(batch_size, seq_length))
+    masked_input_ids = input_ids.copy()
+    masked_input_ids[selected & (decision < 0.8)] = mask_id
+    replace_random = selected & (decision >= 0.9)
+    masked_input_ids[replace_random] = random_ids[replace_random]
+
+    # sorted positions of the selected tokens, the unselected ones pushed to
+    # the end with `seq_length` and cut off
+    positions = np.where(selected, np.arange(seq_length), seq_length)
+    positions = np.sort(positions, axis=1)[:, :max_predictions_per_seq]
+    if positions.shape[1] < max_predictions_per_seq:
+        positions = np.pad(positions, ((0, 0), (0, max_predictions_per_seq - positions.shape[1])),
+                           constant_values=seq_length)
+    valid = positions < seq_length
+    masked_lm_positions = np.where(valid, positions, 0)
+    masked_lm_ids = np.where(valid, np.take_along_axis(input_ids, masked_lm_positions, axis=1), 0)
+    masked_lm_weights = valid.astype(np.float32)
+
+    return masked_input_ids, masked_lm_positions, masked_lm_ids, masked_lm_weights
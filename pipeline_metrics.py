@@ -0,0 +1,197 @@
+"""Timers, counters and progress reporting for the pre-training data pipeline.
+
+The pipeline is a chain of generators (reading, tokenizing, instance creation,
+masking, ...) pulled by the writer, so the stages run interleaved. `Metrics`
+keeps a stack of the stages that are currently running and charges the time
+between two stage switches to the innermost one, so the seconds of all stages
+add up to the time spent in the pipeline and none is counted twice.
+
+Progress is reported for a phase, e.g. the creation of instances, as the
+value of one counter against an expected total, with an ETA extrapolated
+from the progress so far. Metrics can be saved as JSON or in the Prometheus
+text format, e.g. for the textfile collector of the node exporter.
+"""
+
+import os
+import json
+import time
+import collections
+
+from absl import logging
+
+PROMETHEUS_PREFIX = 'pretraining_data'
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _format_count(value):
+    for unit, size in [('G', 1e9), ('M', 1e6), ('k', 1e3)]:
+        if value >= size:
+            return '%.1f%s' % (value / size, unit)
+    return '%d' % value
+
+
+class Metrics(object):
+    """Cumulative stage timers and counters with periodic progress lines.
+
+    `progress_interval` is the minimum number of seconds between two progress
+    lines, 0 disables them.
+    """
+
+    def __init__(self, progress_interval=60):
+        self.progress_interval = progress_interval
+        self.counters = collections.OrderedDict()
+        self.seconds = collections.OrderedDict()
+        self.start_time = time.time()
+        self._stack = []
+        # the stateless context managers of `stage` by name
+        self._stage_contexts = {}
+        self._switch_time = time.perf_counter()
+        self._last_report = time.perf_counter()
+        # name, counter, counter value at the start, total and start time of
+        # the current phase
+        self._phase = None
+
+    def _enter(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            self.seconds[self._stack[-1]] = self.seconds.get(self._stack[-1], 0.0) + now - self._switch_time
+        self._switch_time = now
+        self._stack.append(stage)
+
+    def _exit(self):
+        now = time.perf_counter()
+        stage = self._stack.pop()
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self._switch_time
+        self._switch_time = now
+        # checked here rather than in `count`, which is called more often
+        if self.progress_interval and now - self._last_report >= self.progress_interval:
+            self.report_progress()
+
+    def stage(self, name):
+        """Context manager charging the time spent in its block to stage `name`."""
+        context = self._stage_contexts.get(name)
+        if context is None:
+            context = self._stage_contexts[name] = _StageContext(self, name)
+        return context
+
+    def timed(self, name, iterable, counter=None):
+        """Yields the items of `iterable`, charging the time spent producing them
+        to stage `name` and counting them in `counter` if given."""
+        iterator = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            if counter is not None:
+                self.count(counter)
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_phase(self, name, counter=None, total=None):
+        """Starts a phase whose progress is the increase of `counter` out of
+        `total`."""
+        self._phase = (name, counter, self.counters.get(counter, 0), total, time.perf_counter())
+
+    def report_progress(self):
+        self._last_report = time.perf_counter()
+        message = ''
+        if self._phase is not None:
+            name, counter, start_value, total, start_time = self._phase
+            message = '[%s]' % name
+            if counter is not None:
+                done = self.counters.get(counter, 0) - start_value
+                elapsed = time.perf_counter() - start_time
+                message += ' %s %s' % (_format_count(done), counter)
+                if total:
+                    message += ' of %s (%.1f%%)' % (_format_count(total), 100.0 * done / total)
+                    if done:
+                        message += ', ETA %s' % _format_duration(elapsed * (total - done) / done)
+                message += ', %.1f/s' % (done / elapsed if elapsed else 0.0)
+        stages = ', '.join('%s %.1fs' % (stage, seconds) for stage, seconds in self._current_seconds().items())
+        counters = ', '.join('%s %s' % (_format_count(value), name) for name, value in self.counters.items())
+        logging.info('Progress %s | elapsed %s | %s | %s', message, _format_duration(time.time() - self.start_time),
+                     stages, counters)
+
+    def _current_seconds(self):
+        """Stage seconds including the running time of the innermost stage."""
+        seconds = collections.OrderedDict(self.seconds)
+        if self._stack:
+            seconds[self._stack[-1]] = seconds.get(self._stack[-1], 0.0) + time.perf_counter() - self._switch_time
+        return seconds
+
+    def summary(self):
+        return {
+            'elapsed_seconds': round(time.time() - self.start_time, 3),
+            'stage_seconds': collections.OrderedDict(
+                (stage, round(seconds, 3)) for stage, seconds in self._current_seconds().items()),
+            'counters': collections.OrderedDict(self.counters),
+        }
+
+    def log_summary(self):
+        summary = self.summary()
+        logging.info('*** Time per stage, %s elapsed ***', _format_duration(summary['elapsed_seconds']))
+        for stage, seconds in summary['stage_seconds'].items():
+            logging.info('  %-20s %10.1fs %5.1f%%', stage, seconds,
+                         100.0 * seconds / summary['elapsed_seconds'] if summary['elapsed_seconds'] else 0.0)
+        logging.info('*** Counters ***')
+        for name, value in summary['counters'].items():
+            logging.info('  %-20s %12d %12.1f/s', name, value,
+                         value / summary['elapsed_seconds'] if summary['elapsed_seconds'] else 0.0)
+
+    def write(self, path, metrics_format='json', labels=None):
+        """Writes the metrics as JSON or in the Prometheus text format, replacing
+        `path` atomically."""
+        summary = self.summary()
+        if labels:
+            summary['labels'] = labels
+        if metrics_format == 'prometheus':
+            text = self._prometheus_text(summary, labels or {})
+        else:
+            text = json.dumps(summary, indent=2) + '\n'
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _prometheus_text(summary, labels):
+        def series(name, value, extra_labels=None):
+            all_labels = dict(labels, **(extra_labels or {}))
+            label_text = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in sorted(all_labels.items()))
+            return '%s_%s%s %s\n' % (PROMETHEUS_PREFIX, name, '{%s}' % label_text if label_text else '', value)
+
+        lines = ['# HELP %s_elapsed_seconds Wall time of the run.\n' % PROMETHEUS_PREFIX,
+                 '# TYPE %s_elapsed_seconds gauge\n' % PROMETHEUS_PREFIX,
+                 series('elapsed_seconds', summary['elapsed_seconds']),
+                 '# HELP %s_stage_seconds_total Time spent in a pipeline stage.\n' % PROMETHEUS_PREFIX,
+                 '# TYPE %s_stage_seconds_total counter\n' % PROMETHEUS_PREFIX]
+        for stage, seconds in summary['stage_seconds'].items():
+            lines.append(series('stage_seconds_total', seconds, {'stage': stage}))
+        for name, value in summary['counters'].items():
+            lines.append('# TYPE %s_%s_total counter\n' % (PROMETHEUS_PREFIX, name))
+            lines.append(series('%s_total' % name, value))
+        return ''.join(lines)
+
+
+class _StageContext(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics._enter(self.name)
+
+    def __exit__(self, *exc):
+        self.metrics._exit()
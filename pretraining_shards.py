@@ -0,0 +1,195 @@
+"""Packed shards of pre-training instances as fixed-width, memory-mapped arrays.
+
+A shard is a directory holding one raw little-endian array file per feature and
+a small `header.json` describing them:
+
+  input_ids             [num_instances, max_seq_length]
+  segment_ids           [num_instances, max_seq_length] uint8
+  masked_lm_positions   [num_instances, max_predictions_per_seq] uint16
+  masked_lm_ids         [num_instances, max_predictions_per_seq]
+  next_sentence_labels  [num_instances] uint8
+
+Token ids are stored as uint16 for vocabularies up to 64k. `input_mask` and
+`masked_lm_weights` are not stored but derived when loading: every instance
+ends with [SEP], whose id is not 0, and position 0 holds [CLS], which is never
+masked. A PyTorch trainer can slice batches out of the memory maps without any
+parsing, e.g. `torch.from_numpy(shard[i:i + batch_size]['input_ids'])`.
+
+Shards of unmasked instances (`--dynamic_masking`) have no masked LM arrays;
+`dynamic_masking.py` masks them while loading. Shards of packed instances
+(`--padding_strategy=pack`) also hold `position_ids`, `sequence_ids` and
+`next_sentence_positions` and have `max_sequences_per_pack` next sentence
+labels per row, see `sequence_packing.py`; `next_sentence_weights` is derived.
+"""
+
+import os
+import json
+
+import numpy as np
+
+FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+
+
+def _features(max_seq_length, max_predictions_per_seq, id_dtype, masked=True,
+              max_sequences_per_pack=None):
+    features = [
+        ('input_ids', id_dtype, (max_seq_length,)),
+        ('segment_ids', 'uint8', (max_seq_length,)),
+        ('masked_lm_positions', 'uint16', (max_predictions_per_seq,)),
+        ('masked_lm_ids', id_dtype, (max_predictions_per_seq,)),
+        ('next_sentence_labels', 'uint8', ()),
+    ]
+    if max_sequences_per_pack:
+        features[-1] = ('next_sentence_labels', 'uint8', (max_sequences_per_pack,))
+        features += [
+            ('position_ids', 'uint16', (max_seq_length,)),
+            ('sequence_ids', 'uint8', (max_seq_length,)),
+            ('next_sentence_positions', 'uint16', (max_sequences_per_pack,)),
+        ]
+    if not masked:
+        features = [f for f in features if not f[0].startswith('masked_lm_')]
+    return features
+
+
+def instance_bytes(max_seq_length, max_predictions_per_seq, id_dtype='uint16', masked=True,
+                   max_sequences_per_pack=None):
+    """Number of bytes an instance takes in the arrays of a shard."""
+    return sum(np.dtype(dtype).itemsize * int(np.prod(shape))
+               for _, dtype, shape in _features(max_seq_length, max_predictions_per_seq, id_dtype, masked,
+                                                max_sequences_per_pack))
+
+
+class ShardWriter(object):
+    """Writes padded instances into a shard directory, buffering `buffer_size` rows.
+
+    `metadata` is an optional JSON serializable dict stored in the header. With
+    `max_sequences_per_pack`, the rows are packed instances. With `append`, rows
+    are added to the arrays of an unfinished shard, as left by a writer that was
+    not closed.
+    """
+
+    def __init__(self, path, max_seq_length, max_predictions_per_seq, id_dtype='uint16',
+                 masked=True, metadata=None, max_sequences_per_pack=None, append=False,
+                 buffer_size=1024):
+        self.path = path
+        self.max_seq_length = max_seq_length
+        self.max_predictions_per_seq = max_predictions_per_seq
+        self.masked = masked
+        self.metadata = metadata or {}
+        self.max_sequences_per_pack = max_sequences_per_pack
+        self.num_instances = 0
+        self._features = _features(max_seq_length, max_predictions_per_seq, id_dtype, masked,
+                                   max_sequences_per_pack)
+        self._buffers = {name: np.zeros((buffer_size,) + shape, dtype=dtype)
+                         for name, dtype, shape in self._features}
+        self._buffered = 0
+        self.bytes_per_instance = instance_bytes(max_seq_length, max_predictions_per_seq, id_dtype, masked,
+                                                 max_sequences_per_pack)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if append:
+            row_bytes = np.dtype(id_dtype).itemsize * max_seq_length
+            self.num_instances = os.path.getsize(os.path.join(path, 'input_ids')) // row_bytes
+        self._files = {name: open(os.path.join(path, name), 'ab' if append else 'wb')
+                       for name, _, _ in self._features}
+
+    def write(self, features):
+        """Appends an instance given as a mapping of feature name to padded values
+        (lists, arrays or features with a `values` attribute)."""
+        for name, _, shape in self._features:
+            values = features[name]
+            self._buffers[name][self._buffered] = np.reshape(getattr(values, 'values', values), shape)
+        self._buffered += 1
+        self.num_instances += 1
+        if self._buffered == len(self._buffers['input_ids']):
+            self.flush()
+
+    def flush(self):
+        for name, _, _ in self._features:
+            self._buffers[name][:self._buffered].astype(self._buffers[name].dtype.newbyteorder('<')) \
+                .tofile(self._files[name])
+            self._files[name].flush()
+        self._buffered = 0
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        header = {
+            'format_version': FORMAT_VERSION,
+            'num_instances': self.num_instances,
+            'max_seq_length': self.max_seq_length,
+            'max_predictions_per_seq': self.max_predictions_per_seq,
+            'masked': self.masked,
+            'max_sequences_per_pack': self.max_sequences_per_pack,
+            'metadata': self.metadata,
+            'features': {name: {'dtype': np.dtype(dtype).str, 'shape': [self.num_instances] + list(shape)}
+                         for name, dtype, shape in self._features},
+        }
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as f:
+            json.dump(header, f, indent=2)
+
+
+class Shard(object):
+    """Read-only, memory-mapped shard. Indexing with an int or a slice returns a
+    dict of arrays with all seven BERT pre-training features."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        self.max_seq_length = self.header['max_seq_length']
+        self.max_predictions_per_seq = self.header['max_predictions_per_seq']
+        self.masked = self.header.get('masked', True)
+        self.max_sequences_per_pack = self.header.get('max_sequences_per_pack')
+        self.metadata = self.header.get('metadata', {})
+        self.arrays = {}
+        for name, spec in self.header['features'].items():
+            shape = tuple(spec['shape'])
+            if shape[0] == 0:
+                self.arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                self.arrays[name] = np.memmap(os.path.join(path, name), dtype=spec['dtype'], mode='r',
+                                              shape=shape)
+
+    def __len__(self):
+        return self.header['num_instances']
+
+    def __getitem__(self, index):
+        batch = {name: array[index] for name, array in self.arrays.items()}
+        return add_derived_features(batch)
+
+    def iter_batches(self, batch_size, shuffle=False, seed=None, drop_remainder=False):
+        """Yields batches of `batch_size` instances, in order or shuffled."""
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            if drop_remainder and end - start < batch_size:
+                break
+            if shuffle:
+                # fancy indexing of memory maps needs sorted indexes to stay sequential
+                yield self[np.sort(order[start:end])]
+            else:
+                yield self[start:end]
+
+
+def add_derived_features(batch):
+    """Adds `input_mask` and, if the batch is masked, `masked_lm_weights` to a
+    batch (or a single instance), and `next_sentence_weights` if it is packed."""
+    input_ids = np.asarray(batch['input_ids'])
+    nonzero = input_ids != 0
+    # the length is the position of the last non-padding token, [SEP], plus one
+    seq_length = input_ids.shape[-1]
+    lengths = seq_length - np.argmax(nonzero[..., ::-1], axis=-1)
+    batch['input_mask'] = (np.arange(seq_length) < lengths[..., None]).astype(np.int32)
+    if 'masked_lm_positions' in batch:
+        batch['masked_lm_weights'] = (np.asarray(batch['masked_lm_positions']) != 0).astype(np.float32)
+    if 'sequence_ids' in batch:
+        num_sequences = np.asarray(batch['sequence_ids']).max(axis=-1)
+        max_sequences_per_pack = np.shape(batch['next_sentence_labels'])[-1]
+        batch['next_sentence_weights'] = (
+            np.arange(max_sequences_per_pack) < num_sequences[..., None]).astype(np.float32)
+    return batch
@@ -0,0 +1,199 @@
+"""Packing of short training instances into shared rows, and length buckets.
+
+Padded to `max_seq_length`, short instances mostly consist of padding, which
+still costs compute. Two ways to avoid it:
+
+* Packing: several instances are written into one row of `max_seq_length`
+  tokens. Besides the usual features, a packed row has
+    position_ids             [max_seq_length] position within its instance
+    sequence_ids             [max_seq_length] 1 for the first instance of the
+                             row, 2 for the second, ..., 0 for padding
+    next_sentence_positions  [max_sequences_per_pack] position of the [CLS]
+                             token of every instance
+    next_sentence_labels     [max_sequences_per_pack]
+    next_sentence_weights    [max_sequences_per_pack] 1.0 for real instances
+  and `masked_lm_positions` are positions within the row. A trainer has to
+  restrict attention to tokens of the same `sequence_ids`.
+* Bucketing: every instance is padded only to the smallest bucket length it
+  fits, and every bucket is written to its own output files.
+"""
+
+import bisect
+import collections
+import os
+from array import array
+
+import tfrecord_io
+
+
+class PackedInstance(object):
+    """Training instances sharing one row."""
+
+    __slots__ = ['instances']
+
+    def __init__(self, instances):
+        self.instances = instances
+
+    @property
+    def token_ids(self):
+        token_ids = array(self.instances[0].token_ids.typecode)
+        for instance in self.instances:
+            token_ids.extend(instance.token_ids)
+        return token_ids
+
+    def __len__(self):
+        return sum(len(instance.token_ids) for instance in self.instances)
+
+
+def pack_instances(instances, max_seq_length, max_predictions_per_seq, max_sequences_per_pack,
+                   buffer_size, rng):
+    """Packs a stream of instances into `PackedInstance`s.
+
+    The instances are packed `buffer_size` at a time with best-fit decreasing:
+    the longest instance first, each into the row with the least room left that
+    still fits its tokens and masked LM predictions. The rows of a buffer are
+    yielded in random order.
+    """
+    buffer = []
+    for instance in instances:
+        buffer.append(instance)
+        if len(buffer) == buffer_size:
+            for pack in _pack_buffer(buffer, max_seq_length, max_predictions_per_seq,
+                                     max_sequences_per_pack, rng):
+                yield pack
+            buffer = []
+    for pack in _pack_buffer(buffer, max_seq_length, max_predictions_per_seq, max_sequences_per_pack,
+                             rng):
+        yield pack
+
+
+def _pack_buffer(instances, max_seq_length, max_predictions_per_seq, max_sequences_per_pack, rng):
+    instances = sorted(instances, key=lambda instance: len(instance.token_ids), reverse=True)
+    packs = []
+    # open rows by the number of tokens still free in them
+    open_packs = [[] for _ in range(max_seq_length + 1)]
+    for instance in instances:
+        length = len(instance.token_ids)
+        num_predictions = len(instance.masked_lm_positions)
+        target = None
+        for room in range(length, max_seq_length + 1):
+            for pack in open_packs[room]:
+                if sum(len(i.masked_lm_positions) for i in pack.instances) + num_predictions \
+                        <= max_predictions_per_seq:
+                    target = pack
+                    break
+            if target is not None:
+                open_packs[room].remove(target)
+                break
+        if target is None:
+            target = PackedInstance([])
+            packs.append(target)
+            room = max_seq_length
+        target.instances.append(instance)
+        if len(target.instances) < max_sequences_per_pack and room - length > 0:
+            open_packs[room - length].append(target)
+    rng.shuffle(packs)
+    return packs
+
+
+def packed_features(pack, max_seq_length, max_predictions_per_seq, max_sequences_per_pack,
+                    masked=True):
+    """Returns the padded features of a `PackedInstance` as an ordered dict of
+    feature name to `tfrecord_io` features."""
+    input_ids = []
+    segment_ids = []
+    position_ids = []
+    sequence_ids = []
+    masked_lm_positions = []
+    masked_lm_ids = []
+    next_sentence_positions = []
+    next_sentence_labels = []
+    for (index, instance) in enumerate(pack.instances):
+        offset = len(input_ids)
+        length = len(instance.token_ids)
+        input_ids.extend(instance.token_ids)
+        segment_ids.extend(instance.segment_ids)
+        position_ids.extend(range(length))
+        sequence_ids.extend([index + 1] * length)
+        masked_lm_positions.extend(offset + p for p in instance.masked_lm_positions)
+        masked_lm_ids.extend(instance.masked_lm_ids)
+        next_sentence_positions.append(offset)
+        next_sentence_labels.append(1 if instance.is_random_next else 0)
+    assert len(input_ids) <= max_seq_length
+    assert len(masked_lm_positions) <= max_predictions_per_seq
+
+    num_tokens = len(input_ids)
+    num_predictions = len(masked_lm_positions)
+    num_sequences = len(pack.instances)
+    padding = [0] * (max_seq_length - num_tokens)
+    prediction_padding = [0] * (max_predictions_per_seq - num_predictions)
+    sequence_padding = [0] * (max_sequences_per_pack - num_sequences)
+
+    features = collections.OrderedDict()
+    features['input_ids'] = tfrecord_io.Int64Feature(input_ids + padding)
+    features['input_mask'] = tfrecord_io.Int64Feature([1] * num_tokens + padding)
+    features['segment_ids'] = tfrecord_io.Int64Feature(segment_ids + padding)
+    features['position_ids'] = tfrecord_io.Int64Feature(position_ids + padding)
+    features['sequence_ids'] = tfrecord_io.Int64Feature(sequence_ids + padding)
+    if masked:
+        features['masked_lm_positions'] = tfrecord_io.Int64Feature(masked_lm_positions + prediction_padding)
+        features['masked_lm_ids'] = tfrecord_io.Int64Feature(masked_lm_ids + prediction_padding)
+        features['masked_lm_weights'] = tfrecord_io.FloatFeature(
+            [1.0] * num_predictions + [0.0] * len(prediction_padding))
+    features['next_sentence_positions'] = tfrecord_io.Int64Feature(next_sentence_positions + sequence_padding)
+    features['next_sentence_labels'] = tfrecord_io.Int64Feature(next_sentence_labels + sequence_padding)
+    features['next_sentence_weights'] = tfrecord_io.FloatFeature(
+        [1.0] * num_sequences + [0.0] * len(sequence_padding))
+    return features
+
+
+def default_bucket_lengths(max_seq_length):
+    """A quarter, half and all of `max_seq_length`."""
+    return sorted(set([max_seq_length // 4, max_seq_length // 2, max_seq_length]) - set([0]))
+
+
+def bucket_length(length, bucket_lengths):
+    """The smallest of the sorted `bucket_lengths` not smaller than `length`."""
+    index = bisect.bisect_left(bucket_lengths, length)
+    if index == len(bucket_lengths):
+        raise ValueError('No bucket for a sequence of length %d' % length)
+    return bucket_lengths[index]
+
+
+def bucket_output_file(output_file, length):
+    """Name of the output file of a bucket, e.g. `data.len128.tfrecord` for `data.tfrecord`."""
+    root, ext = os.path.splitext(output_file.rstrip('/'))
+    return '%s.len%d%s' % (root, length, ext)
+
+
+class PaddingStats(object):
+    """Counts the padding of the written rows against padding every instance to
+    `max_seq_length`."""
+
+    def __init__(self, max_seq_length):
+        self.max_seq_length = max_seq_length
+        self.num_instances = 0
+        self.num_rows = 0
+        self.num_tokens = 0
+        self.num_row_tokens = 0
+
+    def add(self, num_instances, num_tokens, row_length):
+        self.num_instances += num_instances
+        self.num_rows += 1
+        self.num_tokens += num_tokens
+        self.num_row_tokens += row_length
+
+    @property
+    def padding_fraction_before(self):
+        padded = self.num_instances * self.max_seq_length
+        return 1.0 - self.num_tokens / padded if padded else 0.0
+
+    @property
+    def padding_fraction_after(self):
+        return 1.0 - self.num_tokens / self.num_row_tokens if self.num_row_tokens else 0.0
+
+    def __str__(self):
+        return ('%d instances in %d rows, padding fraction %.1f%% when padding every instance to %d, '
+                '%.1f%% as written' % (self.num_instances, self.num_rows,
+                                       100 * self.padding_fraction_before, self.max_seq_length,
+                                       100 * self.padding_fraction_after))
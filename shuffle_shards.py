@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Shuffle TFRecord files globally into shards of equal size with bounded memory.
+
+`create_pretraining_data.py` only shuffles the instances of one output file,
+and the helper writes one output file per corpus file, so the news, wiki and
+other sources are never mixed. This script shuffles the records of all given
+files together in two passes over local disk:
+
+1. scatter: every record is appended to one of many bucket files chosen at
+   random, so that a bucket fits into the memory budget. If there are more
+   buckets than `--max_open_files`, the inputs are read once per range of
+   `--max_open_files` buckets;
+2. gather: the buckets are loaded one at a time, shuffled in memory and their
+   records dealt round-robin to the output shards.
+
+The result is a uniformly random permutation of all records, seeded by
+`--seed`, split into `--num_shards` files whose record counts differ by at
+most one. Only one bucket is held in memory at a time.
+"""
+
+import os
+import sys
+import math
+import random
+import shutil
+import argparse
+import tempfile
+
+from absl import logging
+
+import file_io
+import tfrecord_io
+
+# number of bucket files written at a time, well below the usual limit of
+# 1024 open files per process
+DEFAULT_MAX_OPEN_FILES = 256
+
+# number of times the inputs may be read to scatter their records
+MAX_SCATTER_PASSES = 8
+
+
+def output_shard_files(output_prefix, num_shards):
+    return ['%s-%05d-of-%05d.tfrecord' % (output_prefix, i, num_shards) for i in range(num_shards)]
+
+
+def num_buckets_for(input_files, memory_budget):
+    """Number of buckets such that a bucket takes about half of `memory_budget` bytes."""
+    total_size = 0
+    for input_file in input_files:
+        if file_io.is_remote(input_file):
+            total_size += _gfile_size(input_file)
+        else:
+            total_size += os.path.getsize(input_file)
+    return max(1, int(math.ceil(2.0 * total_size / memory_budget)))
+
+
+def _gfile_size(path):
+    gfile = file_io._gfile()
+    return gfile.stat(path).length if hasattr(gfile, 'stat') else gfile.Stat(path).length
+
+
+def shuffle_shards(input_files, output_files, seed=12345, memory_budget=1 << 30, temp_dir=None,
+                   max_open_files=DEFAULT_MAX_OPEN_FILES):
+    """Shuffles the records of `input_files` into `output_files`; returns the
+    number of records.
+
+    At most `max_open_files` bucket files are written at a time. If more
+    buckets are needed, the inputs are scattered in several passes, each
+    writing the next `max_open_files` buckets, up to `MAX_SCATTER_PASSES`.
+    The output does not depend on the number of passes.
+    """
+    if memory_budget <= 0:
+        raise ValueError('the memory budget has to be positive')
+    num_buckets = num_buckets_for(input_files, memory_budget)
+    num_passes = int(math.ceil(float(num_buckets) / max_open_files))
+    if num_passes > MAX_SCATTER_PASSES:
+        raise ValueError('%d buckets are needed for a memory budget of %.1f MB, more than %d passes of %d open '
+                         'bucket files; increase the memory budget or the number of open files'
+                         % (num_buckets, memory_budget / float(1 << 20), MAX_SCATTER_PASSES, max_open_files))
+    bucket_dir = tempfile.mkdtemp(prefix='shuffle_shards.', dir=temp_dir)
+    try:
+        bucket_files = [os.path.join(bucket_dir, 'bucket-%05d.tfrecord' % i) for i in range(num_buckets)]
+        for first_bucket in range(0, num_buckets, max_open_files):
+            # every pass draws the buckets of all records again from the same
+            # seed and writes those in its range
+            rng = random.Random(seed)
+            pass_buckets = range(first_bucket, min(first_bucket + max_open_files, num_buckets))
+            num_records = 0
+            writers = {i: tfrecord_io.TFRecordWriter(bucket_files[i]) for i in pass_buckets}
+            try:
+                for input_file in input_files:
+                    for record in tfrecord_io.tf_record_iterator(input_file):
+                        writer = writers.get(rng.randrange(num_buckets))
+                        if writer is not None:
+                            writer.write(record)
+                        num_records += 1
+                    logging.info('scattered %s into buckets %d-%d, %d records so far',
+                                 input_file, pass_buckets[0], pass_buckets[-1], num_records)
+            finally:
+                for writer in writers.values():
+                    writer.close()
+
+        for output_dir in set(os.path.dirname(f) for f in output_files):
+            if output_dir and not file_io.is_remote(output_dir) and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+        writers = [tfrecord_io.TFRecordWriter(f) for f in output_files]
+        try:
+            shard_index = 0
+            for bucket_file in bucket_files:
+                records = list(tfrecord_io.tf_record_iterator(bucket_file, check_crc=False))
+                os.remove(bucket_file)
+                rng.shuffle(records)
+                for record in records:
+                    writers[shard_index].write(record)
+                    shard_index = (shard_index + 1) % len(writers)
+        finally:
+            for writer in writers:
+                writer.close()
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+    return num_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input_file", required=True,
+                        help='comma separated TFRecord files or glob patterns')
+    parser.add_argument("--output_prefix", required=True,
+                        help='output shards are named PREFIX-00000-of-NNNNN.tfrecord')
+    parser.add_argument("--num_shards", type=int, required=True, help='number of output shards')
+    parser.add_argument("--seed", type=int, default=12345, help='random seed')
+    parser.add_argument("--memory_budget_mb", type=int, default=1024,
+                        help='approximate memory for the records of one bucket in MB')
+    parser.add_argument("--max_open_files", type=int, default=DEFAULT_MAX_OPEN_FILES,
+                        help='number of bucket files written at a time')
+    parser.add_argument("--temp_dir", default=None,
+                        help='local directory for the bucket files, defaults to the system temp directory')
+    args = parser.parse_args()
+    logging.set_verbosity(logging.INFO)
+
+    input_files = []
+    for input_pattern in args.input_file.split(','):
+        input_files.extend(file_io.glob(input_pattern))
+    if not input_files:
+        print("no input files match '%s'" % args.input_file)
+        sys.exit(-1)
+
+    output_files = output_shard_files(args.output_prefix, args.num_shards)
+    num_records = shuffle_shards(input_files, output_files, args.seed, args.memory_budget_mb << 20,
+                                 args.temp_dir, args.max_open_files)
+    print('shuffled %d records of %d files into %d shards' % (num_records, len(input_files), len(output_files)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import sys
+from os.path import abspath, dirname
+
+# the modules under test live at the root of the repository
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
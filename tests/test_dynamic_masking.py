@@ -0,0 +1,108 @@
+import collections
+
+import numpy as np
+import pytest
+
+import dynamic_masking
+import pretraining_shards
+import tfrecord_io
+
+CLS_ID, SEP_ID, MASK_ID = 4, 5, 6
+METADATA = {'vocab_size': 1000, 'cls_id': CLS_ID, 'sep_id': SEP_ID, 'mask_id': MASK_ID}
+FEATURES = ['input_ids', 'input_mask', 'segment_ids', 'masked_lm_positions', 'masked_lm_ids',
+            'masked_lm_weights', 'next_sentence_labels']
+
+
+def _instances(num_instances, max_seq_length=16):
+    instances = []
+    for i in range(num_instances):
+        length = 4 + i % (max_seq_length - 4)
+        input_ids = [CLS_ID] + [100 + i] * (length - 2) + [SEP_ID] + [0] * (max_seq_length - length)
+        instances.append({
+            'input_ids': input_ids,
+            'input_mask': [1] * length + [0] * (max_seq_length - length),
+            'segment_ids': [0] * max_seq_length,
+            'next_sentence_labels': i % 2,
+        })
+    return instances
+
+
+def _write_shard(path, instances):
+    writer = pretraining_shards.ShardWriter(path, 16, 4, masked=False, metadata=METADATA)
+    for instance in instances:
+        writer.write(instance)
+    writer.close()
+
+
+def _write_tfrecord(path, instances):
+    with tfrecord_io.TFRecordWriter(path) as writer:
+        for instance in instances:
+            features = collections.OrderedDict()
+            for name in dynamic_masking.UNMASKED_FEATURES:
+                values = instance[name]
+                features[name] = tfrecord_io.Int64Feature(values if isinstance(values, list) else [values])
+            writer.write(tfrecord_io.serialize_example(features))
+
+
+def _check_batch(batch, instances):
+    assert sorted(batch) == sorted(FEATURES)
+    for input_ids, positions, ids, weights in zip(batch['input_ids'], batch['masked_lm_positions'],
+                                                  batch['masked_lm_ids'], batch['masked_lm_weights']):
+        original = next(instance['input_ids'] for instance in instances
+                        if instance['input_ids'][1] == ids[0])
+        selected = positions[weights > 0]
+        assert len(selected) >= 1
+        assert not np.isin(np.array(original)[selected], [CLS_ID, SEP_ID, 0]).any()
+        unselected = np.ones(len(input_ids), dtype=bool)
+        unselected[selected] = False
+        np.testing.assert_array_equal(input_ids[unselected], np.array(original)[unselected])
+
+
+def test_shards(tmp_path):
+    instances = _instances(20)
+    paths = [str(tmp_path / 'shard0'), str(tmp_path / 'shard1')]
+    _write_shard(paths[0], instances[:12])
+    _write_shard(paths[1], instances[12:])
+    loader = dynamic_masking.DynamicMaskingLoader(paths, max_predictions_per_seq=4)
+    assert loader.vocab_size == 1000 and loader.mask_id == MASK_ID
+    assert loader.special_ids == [CLS_ID, SEP_ID]
+    batches = list(loader.iter_batches(0, 5))
+    assert sum(len(batch['input_ids']) for batch in batches) == 20
+    for batch in batches:
+        assert batch['masked_lm_positions'].shape[1] == 4
+        _check_batch(batch, instances)
+
+
+def test_epochs(tmp_path):
+    path = str(tmp_path / 'shard')
+    _write_shard(path, _instances(20))
+    loader = dynamic_masking.DynamicMaskingLoader([path], max_predictions_per_seq=4, seed=7)
+
+    def epoch_positions(epoch):
+        return np.concatenate([batch['masked_lm_positions'] for batch in loader.iter_batches(epoch, 8)])
+
+    # every epoch gets new masks, and any epoch can be reproduced
+    np.testing.assert_array_equal(epoch_positions(1), epoch_positions(1))
+    assert not np.array_equal(epoch_positions(1), epoch_positions(2))
+
+
+def test_tfrecord(tmp_path):
+    instances = _instances(7)
+    path = str(tmp_path / 'data.tfrecord')
+    _write_tfrecord(path, instances)
+    loader = dynamic_masking.DynamicMaskingLoader([path], max_predictions_per_seq=4, vocab_size=1000,
+                                                  mask_id=MASK_ID, special_ids=[CLS_ID, SEP_ID])
+    batches = list(loader.iter_batches(0, 3))
+    assert [len(batch['input_ids']) for batch in batches] == [3, 3, 1]
+    # TFRecord files are read in order
+    assert np.concatenate([batch['next_sentence_labels'] for batch in batches]).tolist() == \
+        [instance['next_sentence_labels'] for instance in instances]
+    for batch in batches:
+        _check_batch(batch, instances)
+
+
+def test_tfrecord_needs_vocabulary(tmp_path):
+    path = str(tmp_path / 'data.tfrecord')
+    _write_tfrecord(path, _instances(1))
+    with pytest.raises(ValueError, match='vocab_size'):
+        dynamic_masking.DynamicMaskingLoader([path])
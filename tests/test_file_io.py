@@ -0,0 +1,137 @@
+import bz2
+import gzip
+import lzma
+import threading
+import time
+import zlib
+
+import pytest
+
+import file_io
+
+COMPRESSORS = {
+    '.gz': gzip.compress,
+    '.bz2': bz2.compress,
+    '.xz': lzma.compress,
+}
+try:
+    import zstandard
+    COMPRESSORS['.zst'] = lambda data: zstandard.ZstdCompressor().compress(data)
+except ImportError:
+    pass
+
+TEXT = ''.join('line %d, сайн байна уу\r still line %d\n' % (i, i) for i in range(2000)) + 'last line'
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # many blocks, and a read-ahead queue that fills up
+    monkeypatch.setattr(file_io, 'READ_BUFFER_SIZE', 1000)
+    monkeypatch.setattr(file_io, 'READ_AHEAD_BLOCKS', 2)
+
+
+def _read_ahead_threads():
+    return [t for t in threading.enumerate() if t.name == 'read-ahead']
+
+
+def _wait_for_read_ahead_threads():
+    deadline = time.time() + 5
+    while _read_ahead_threads() and time.time() < deadline:
+        time.sleep(0.01)
+    return _read_ahead_threads()
+
+
+@pytest.mark.parametrize('extension', sorted(COMPRESSORS))
+def test_read_compressed_text(tmp_path, small_blocks, extension):
+    path = tmp_path / ('corpus.txt' + extension)
+    path.write_bytes(COMPRESSORS[extension](TEXT.encode('utf-8')))
+    assert file_io.is_compressed(str(path))
+    with file_io.open_file(str(path)) as f:
+        lines = list(f)
+    # lines are split on '\n' only
+    assert lines == [line + '\n' for line in TEXT.split('\n')[:-1]] + ['last line']
+    assert not _wait_for_read_ahead_threads()
+
+
+@pytest.mark.parametrize('extension', sorted(COMPRESSORS))
+def test_read_compressed_bytes(tmp_path, small_blocks, extension):
+    data = bytes(range(256)) * 100
+    path = tmp_path / ('data.bin' + extension)
+    path.write_bytes(COMPRESSORS[extension](data))
+    with file_io.open_file(str(path), 'rb') as f:
+        assert f.read(10) == data[:10]
+        assert f.read() == data[10:]
+        assert f.read() == b''
+
+
+def test_read_plain_text(tmp_path):
+    path = tmp_path / 'corpus.txt'
+    path.write_bytes(TEXT.encode('utf-8'))
+    assert not file_io.is_compressed(str(path))
+    with file_io.open_file(str(path)) as f:
+        assert f.read() == TEXT
+
+
+def test_write_is_not_compressed(tmp_path):
+    path = str(tmp_path / 'out.gz')
+    with file_io.open_file(path, 'wb') as f:
+        f.write(b'raw')
+    with open(path, 'rb') as f:
+        assert f.read() == b'raw'
+
+
+def test_corrupted_file(tmp_path, small_blocks):
+    data = gzip.compress(TEXT.encode('utf-8'))
+    path = tmp_path / 'corpus.txt.gz'
+    # the header is intact, the deflate stream is not
+    path.write_bytes(data[:20] + bytes(len(data) - 20))
+    # the error of the read-ahead thread is raised in the reader
+    with file_io.open_file(str(path)) as f:
+        with pytest.raises(zlib.error):
+            f.read()
+    assert not _wait_for_read_ahead_threads()
+
+
+def test_truncated_file(tmp_path, small_blocks):
+    data = gzip.compress(TEXT.encode('utf-8'))
+    path = tmp_path / 'corpus.txt.gz'
+    path.write_bytes(data[:len(data) // 2])
+    with file_io.open_file(str(path)) as f:
+        with pytest.raises(EOFError):
+            f.read()
+
+
+def test_close_before_the_end(tmp_path, small_blocks):
+    path = tmp_path / 'corpus.txt.gz'
+    path.write_bytes(gzip.compress(TEXT.encode('utf-8')))
+    f = file_io.open_file(str(path))
+    assert f.readline() == 'line 0, сайн байна уу\r still line 0\n'
+    # the thread is blocked on the full queue until the file is closed
+    assert _read_ahead_threads()
+    f.close()
+    assert not _wait_for_read_ahead_threads()
+    with pytest.raises(ValueError):
+        f.readline()
+
+
+def test_missing_zstandard(tmp_path, monkeypatch):
+    import builtins
+    real_import = builtins.__import__
+
+    def failing_import(name, *args, **kwargs):
+        if name == 'zstandard':
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', failing_import)
+    path = tmp_path / 'corpus.txt.zst'
+    path.write_bytes(b'')
+    with pytest.raises(ImportError, match='pip install zstandard'):
+        file_io.open_file(str(path))
+
+
+def test_glob(tmp_path):
+    for name in ['b.txt', 'a.txt', 'c.gz']:
+        (tmp_path / name).write_bytes(b'')
+    assert file_io.glob(str(tmp_path / '*.txt')) == [str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')]
+    assert file_io.is_remote('gs://bucket/file') and not file_io.is_remote(str(tmp_path))
@@ -0,0 +1,87 @@
+import numpy as np
+
+import masked_lm
+
+CLS_ID, SEP_ID, MASK_ID = 4, 5, 6
+VOCAB_SIZE = 1000
+
+
+def _batch(lengths, seq_length=32, seed=0):
+    rng = np.random.default_rng(seed)
+    input_ids = np.zeros((len(lengths), seq_length), dtype=np.int64)
+    input_mask = np.zeros((len(lengths), seq_length), dtype=np.int64)
+    for i, length in enumerate(lengths):
+        input_ids[i, :length] = rng.integers(100, VOCAB_SIZE, size=length)
+        input_ids[i, 0] = CLS_ID
+        input_ids[i, length // 2] = SEP_ID
+        input_ids[i, length - 1] = SEP_ID
+        input_mask[i, :length] = 1
+    return input_ids, input_mask
+
+
+def _mask(input_ids, input_mask, masked_lm_prob=0.15, max_predictions_per_seq=5, seed=1):
+    return masked_lm.create_masked_lm_predictions_batch(
+        input_ids, input_mask, masked_lm_prob, max_predictions_per_seq, VOCAB_SIZE, MASK_ID,
+        [CLS_ID, SEP_ID], np.random.default_rng(seed))
+
+
+def test_predictions():
+    lengths = [4, 10, 20, 32]
+    input_ids, input_mask = _batch(lengths)
+    masked_input_ids, positions, ids, weights = _mask(input_ids, input_mask)
+    assert positions.shape == ids.shape == weights.shape == (4, 5)
+    for i, length in enumerate(lengths):
+        num_predictions = min(5, max(1, int(round(length * 0.15))))
+        assert weights[i].tolist() == [1.0] * num_predictions + [0.0] * (5 - num_predictions)
+        selected = positions[i, :num_predictions]
+        # distinct, sorted real tokens other than [CLS] and [SEP], padded with 0
+        assert (np.diff(selected) > 0).all()
+        assert (selected < length).all()
+        assert not np.isin(input_ids[i, selected], [CLS_ID, SEP_ID]).any()
+        assert (positions[i, num_predictions:] == 0).all() and (ids[i, num_predictions:] == 0).all()
+        # the labels are the original ids and only selected tokens change
+        np.testing.assert_array_equal(ids[i, :num_predictions], input_ids[i, selected])
+        unselected = np.ones(input_ids.shape[1], dtype=bool)
+        unselected[selected] = False
+        np.testing.assert_array_equal(masked_input_ids[i, unselected], input_ids[i, unselected])
+    # the input is not modified
+    np.testing.assert_array_equal(input_ids, _batch(lengths)[0])
+
+
+def test_fewer_candidates_than_predictions():
+    # [CLS] a [SEP] has a single candidate
+    input_ids = np.array([[CLS_ID, 200, SEP_ID, 0]])
+    input_mask = np.array([[1, 1, 1, 0]])
+    _, positions, ids, weights = _mask(input_ids, input_mask, masked_lm_prob=1.0)
+    assert positions.tolist() == [[1, 0, 0, 0, 0]]
+    assert ids.tolist() == [[200, 0, 0, 0, 0]]
+    assert weights.tolist() == [[1.0, 0.0, 0.0, 0.0, 0.0]]
+
+
+def test_more_predictions_than_positions():
+    input_ids, input_mask = _batch([6], seq_length=6)
+    _, positions, _, weights = _mask(input_ids, input_mask, masked_lm_prob=1.0, max_predictions_per_seq=10)
+    assert positions.shape == (1, 10)
+    assert weights.sum() == 3
+
+
+def test_replacement_distribution():
+    input_ids, input_mask = _batch([32] * 4000)
+    masked_input_ids, positions, ids, weights = _mask(input_ids, input_mask)
+    rows = np.arange(len(input_ids))[:, None]
+    valid = weights.astype(bool)
+    replaced = masked_input_ids[rows, positions][valid]
+    original = ids[valid]
+    num_predictions = valid.sum()
+    assert abs((replaced == MASK_ID).sum() / num_predictions - 0.8) < 0.02
+    # a random id may also happen to be the original one
+    assert abs((replaced == original).sum() / num_predictions - 0.1) < 0.02
+    assert abs(((replaced != MASK_ID) & (replaced != original)).sum() / num_predictions - 0.1) < 0.02
+
+
+def test_seeded():
+    input_ids, input_mask = _batch([10, 20, 30])
+    first = _mask(input_ids, input_mask, seed=3)
+    second = _mask(input_ids, input_mask, seed=3)
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
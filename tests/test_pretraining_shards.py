@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+
+import pretraining_shards
+
+
+def _instance(i, max_seq_length=8, max_predictions_per_seq=3):
+    # [CLS] tokens [SEP] of i + 1 tokens, padded with 0
+    length = min(i + 3, max_seq_length)
+    input_ids = [4] + [100 + i] * (length - 2) + [5] + [0] * (max_seq_length - length)
+    segment_ids = [0] * (length // 2) + [1] * (length - length // 2) + [0] * (max_seq_length - length)
+    num_predictions = min(i % 3 + 1, max_predictions_per_seq, length - 2)
+    masked_lm_positions = list(range(1, num_predictions + 1)) + [0] * (max_predictions_per_seq - num_predictions)
+    masked_lm_ids = [100 + i] * num_predictions + [0] * (max_predictions_per_seq - num_predictions)
+    return {
+        'input_ids': input_ids,
+        'segment_ids': segment_ids,
+        'masked_lm_positions': masked_lm_positions,
+        'masked_lm_ids': masked_lm_ids,
+        'next_sentence_labels': i % 2,
+    }
+
+
+def _write(path, instances, **kwargs):
+    writer = pretraining_shards.ShardWriter(path, 8, 3, buffer_size=2, **kwargs)
+    for instance in instances:
+        writer.write(instance)
+    writer.close()
+    return writer
+
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / 'shard')
+    instances = [_instance(i) for i in range(5)]
+    _write(path, instances, metadata={'vocab_size': 32000})
+    shard = pretraining_shards.Shard(path)
+    assert len(shard) == 5
+    assert shard.metadata == {'vocab_size': 32000}
+    assert shard.arrays['input_ids'].dtype == np.dtype('<u2')
+    batch = shard[0:5]
+    for name in ['input_ids', 'segment_ids', 'masked_lm_positions', 'masked_lm_ids', 'next_sentence_labels']:
+        np.testing.assert_array_equal(batch[name], [instance[name] for instance in instances])
+    # the array files hold nothing but the rows
+    assert os.path.getsize(os.path.join(path, 'input_ids')) == 5 * 8 * 2
+
+
+def test_derived_features(tmp_path):
+    path = str(tmp_path / 'shard')
+    instances = [_instance(i) for i in range(7)]
+    _write(path, instances)
+    batch = pretraining_shards.Shard(path)[:]
+    expected_mask = [[1 if id_ != 0 else 0 for id_ in instance['input_ids']] for instance in instances]
+    np.testing.assert_array_equal(batch['input_mask'], expected_mask)
+    assert batch['input_mask'].dtype == np.int32
+    expected_weights = [[1.0 if p else 0.0 for p in instance['masked_lm_positions']] for instance in instances]
+    np.testing.assert_array_equal(batch['masked_lm_weights'], expected_weights)
+    assert batch['masked_lm_weights'].dtype == np.float32
+    # also for a single instance
+    single = pretraining_shards.Shard(path)[2]
+    np.testing.assert_array_equal(single['input_mask'], expected_mask[2])
+
+
+def test_derived_input_mask_with_inner_zero_id():
+    # a token id of 0 inside the sequence, e.g. <unk>, is not padding
+    batch = pretraining_shards.add_derived_features({'input_ids': np.array([[4, 0, 7, 5, 0, 0]])})
+    np.testing.assert_array_equal(batch['input_mask'], [[1, 1, 1, 1, 0, 0]])
+
+
+def test_unmasked_shard(tmp_path):
+    path = str(tmp_path / 'shard')
+    instances = [_instance(i) for i in range(3)]
+    _write(path, instances, masked=False)
+    shard = pretraining_shards.Shard(path)
+    assert not shard.masked
+    batch = shard[:]
+    assert 'masked_lm_positions' not in batch and 'masked_lm_weights' not in batch
+    assert not os.path.exists(os.path.join(path, 'masked_lm_ids'))
+
+
+def test_empty_shard(tmp_path):
+    path = str(tmp_path / 'shard')
+    _write(path, [])
+    shard = pretraining_shards.Shard(path)
+    assert len(shard) == 0
+    assert shard[:]['input_ids'].shape == (0, 8)
+    assert list(shard.iter_batches(4)) == []
+
+
+def test_append_after_interruption(tmp_path):
+    path = str(tmp_path / 'shard')
+    instances = [_instance(i) for i in range(7)]
+    # a writer that flushed 3 rows but was never closed, so there is no header
+    writer = pretraining_shards.ShardWriter(path, 8, 3, buffer_size=2)
+    for instance in instances[:3]:
+        writer.write(instance)
+    writer.flush()
+    for f in writer._files.values():
+        f.close()
+    assert not os.path.exists(os.path.join(path, pretraining_shards.HEADER_FILE))
+
+    writer = _write(path, instances[3:], append=True)
+    assert writer.num_instances == 7
+    shard = pretraining_shards.Shard(path)
+    assert len(shard) == 7
+    np.testing.assert_array_equal(shard[:]['input_ids'], [instance['input_ids'] for instance in instances])
+    with open(os.path.join(path, pretraining_shards.HEADER_FILE)) as f:
+        assert json.load(f)['features']['input_ids']['shape'] == [7, 8]
+
+
+def test_iter_batches(tmp_path):
+    path = str(tmp_path / 'shard')
+    _write(path, [_instance(i) for i in range(7)])
+    shard = pretraining_shards.Shard(path)
+    batches = list(shard.iter_batches(3))
+    assert [len(batch['input_ids']) for batch in batches] == [3, 3, 1]
+    assert len(list(shard.iter_batches(3, drop_remainder=True))) == 2
+    shuffled = np.concatenate([batch['input_ids'][:, 1] for batch in shard.iter_batches(3, shuffle=True, seed=1)])
+    assert sorted(shuffled.tolist()) == [100 + i for i in range(7)]
+    again = np.concatenate([batch['input_ids'][:, 1] for batch in shard.iter_batches(3, shuffle=True, seed=1)])
+    np.testing.assert_array_equal(shuffled, again)
+
+
+def test_packed_shard(tmp_path):
+    path = str(tmp_path / 'shard')
+    writer = pretraining_shards.ShardWriter(path, 8, 3, max_sequences_per_pack=3)
+    instance = _instance(0)
+    instance.update({
+        'input_ids': [4, 7, 5, 4, 8, 5, 0, 0],
+        'next_sentence_labels': [1, 0, 0],
+        'position_ids': [0, 1, 2, 0, 1, 2, 0, 0],
+        'sequence_ids': [1, 1, 1, 2, 2, 2, 0, 0],
+        'next_sentence_positions': [0, 3, 0],
+    })
+    writer.write(instance)
+    writer.close()
+    batch = pretraining_shards.Shard(path)[:]
+    np.testing.assert_array_equal(batch['next_sentence_weights'], [[1.0, 1.0, 0.0]])
+    np.testing.assert_array_equal(batch['input_mask'], [[1, 1, 1, 1, 1, 1, 0, 0]])
+
+
+def test_instance_bytes():
+    # uint16 ids, uint8 segments, uint16 positions, ids and a uint8 label
+    assert pretraining_shards.instance_bytes(128, 20) == 128 * 2 + 128 + 20 * 2 + 20 * 2 + 1
+    assert pretraining_shards.instance_bytes(128, 20, masked=False) == 128 * 2 + 128 + 1
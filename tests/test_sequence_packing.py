@@ -0,0 +1,107 @@
+import random
+from array import array
+
+import pytest
+
+import sequence_packing
+from create_pretraining_data import TrainingInstance
+
+CLS_ID, SEP_ID = 4, 5
+
+
+def _instance(length, num_predictions=1, token_id=100, is_random_next=False):
+    # [CLS] A [SEP] B [SEP] of `length` tokens, B being a single token
+    token_ids = array('H', [CLS_ID] + [token_id] * (length - 4) + [SEP_ID, token_id, SEP_ID])
+    positions = array('H', range(1, num_predictions + 1))
+    return TrainingInstance(token_ids, length - 2, positions, array('H', [token_id] * num_predictions),
+                            is_random_next)
+
+
+def _pack(instances, max_seq_length=10, max_predictions_per_seq=5, max_sequences_per_pack=3,
+          buffer_size=100, seed=0):
+    return list(sequence_packing.pack_instances(instances, max_seq_length, max_predictions_per_seq,
+                                                max_sequences_per_pack, buffer_size, random.Random(seed)))
+
+
+def _lengths(packs):
+    return sorted(sorted((len(i.token_ids) for i in pack.instances), reverse=True) for pack in packs)
+
+
+def test_best_fit():
+    # longest first, each into the fullest row it fits
+    packs = _pack([_instance(n) for n in [4, 8, 5, 7, 4, 6]], max_seq_length=12)
+    assert _lengths(packs) == [[6, 4], [7, 5], [8, 4]]
+
+
+def test_every_instance_once():
+    rng = random.Random(1)
+    instances = [_instance(rng.randint(4, 10), rng.randint(1, 3), token_id=100 + i) for i in range(200)]
+    packs = _pack(instances, buffer_size=32)
+    packed = [instance for pack in packs for instance in pack.instances]
+    assert sorted(id(i) for i in packed) == sorted(id(i) for i in instances)
+    for pack in packs:
+        assert len(pack) <= 10
+        assert sum(len(i.masked_lm_positions) for i in pack.instances) <= 5
+        assert len(pack.instances) <= 3
+
+
+def test_max_predictions_per_seq():
+    # the tokens would fit into one row but the predictions do not
+    packs = _pack([_instance(4, 3), _instance(4, 3)])
+    assert len(packs) == 2
+
+
+def test_max_sequences_per_pack():
+    packs = _pack([_instance(4) for _ in range(6)], max_seq_length=20, max_sequences_per_pack=2)
+    assert [len(pack.instances) for pack in packs] == [2, 2, 2]
+
+
+def test_seeded_order():
+    instances = [_instance(n, token_id=100 + n) for n in range(4, 11)]
+    first = [[i.token_ids[1] for i in pack.instances] for pack in _pack(instances, seed=3)]
+    second = [[i.token_ids[1] for i in pack.instances] for pack in _pack(instances, seed=3)]
+    assert first == second
+
+
+def test_packed_features():
+    pack = sequence_packing.PackedInstance([_instance(5, 2, token_id=7, is_random_next=True),
+                                            _instance(4, 1, token_id=8)])
+    features = sequence_packing.packed_features(pack, 10, 4, 3)
+    values = {name: feature.values for name, feature in features.items()}
+    assert values['input_ids'] == [4, 7, 5, 7, 5, 4, 5, 8, 5, 0]
+    assert values['input_mask'] == [1] * 9 + [0]
+    assert values['segment_ids'] == [0, 0, 0, 1, 1, 0, 0, 1, 1, 0]
+    assert values['position_ids'] == [0, 1, 2, 3, 4, 0, 1, 2, 3, 0]
+    assert values['sequence_ids'] == [1, 1, 1, 1, 1, 2, 2, 2, 2, 0]
+    # positions of the second instance are shifted by the first one
+    assert values['masked_lm_positions'] == [1, 2, 6, 0]
+    assert values['masked_lm_ids'] == [7, 7, 8, 0]
+    assert values['masked_lm_weights'] == [1.0, 1.0, 1.0, 0.0]
+    assert values['next_sentence_positions'] == [0, 5, 0]
+    assert values['next_sentence_labels'] == [1, 0, 0]
+    assert values['next_sentence_weights'] == [1.0, 1.0, 0.0]
+
+
+def test_packed_features_unmasked():
+    pack = sequence_packing.PackedInstance([_instance(5)])
+    features = sequence_packing.packed_features(pack, 10, 4, 3, masked=False)
+    assert not any(name.startswith('masked_lm_') for name in features)
+
+
+def test_buckets():
+    assert sequence_packing.default_bucket_lengths(128) == [32, 64, 128]
+    assert sequence_packing.default_bucket_lengths(2) == [1, 2]
+    assert sequence_packing.bucket_length(33, [32, 64, 128]) == 64
+    assert sequence_packing.bucket_length(32, [32, 64, 128]) == 32
+    with pytest.raises(ValueError):
+        sequence_packing.bucket_length(129, [32, 64, 128])
+    assert sequence_packing.bucket_output_file('out/data.tfrecord', 64) == 'out/data.len64.tfrecord'
+    assert sequence_packing.bucket_output_file('out/shard/', 64) == 'out/shard.len64'
+
+
+def test_padding_stats():
+    stats = sequence_packing.PaddingStats(10)
+    stats.add(2, 8, 10)
+    stats.add(1, 5, 10)
+    assert stats.padding_fraction_before == pytest.approx(1 - 13 / 30.0)
+    assert stats.padding_fraction_after == pytest.approx(1 - 13 / 20.0)
@@ -0,0 +1,108 @@
+import collections
+
+import pytest
+
+import tfrecord_io
+
+
+def _example(i):
+    features = collections.OrderedDict()
+    features['input_ids'] = tfrecord_io.Int64Feature([4, 100 + i, 70000, 5, 0])
+    features['big'] = tfrecord_io.Int64Feature([-1, 1 << 40])
+    features['weights'] = tfrecord_io.FloatFeature([1.0, 0.5])
+    features['empty'] = tfrecord_io.Int64Feature([])
+    features['text'] = tfrecord_io.BytesFeature([b'abc', b''])
+    return features
+
+
+def test_crc32c():
+    # the check value of CRC-32C
+    assert tfrecord_io.crc32c(b'123456789') == 0xe3069283
+    assert tfrecord_io._crc32c_python(b'123456789') == 0xe3069283
+    data = bytes(range(256)) * 3
+    assert tfrecord_io.crc32c(data) == tfrecord_io._crc32c_python(data)
+
+
+def test_masked_crc32c():
+    crc = tfrecord_io.crc32c(b'data')
+    rotated = ((crc >> 15) | (crc << 17)) & 0xffffffff
+    assert tfrecord_io.masked_crc32c(b'data') == (rotated + 0xa282ead8) & 0xffffffff
+
+
+def test_write_and_read_records(tmp_path):
+    path = str(tmp_path / 'records.tfrecord')
+    records = [b'', b'a', b'x' * 100000]
+    with tfrecord_io.TFRecordWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    assert list(tfrecord_io.tf_record_iterator(path)) == records
+    # length, its CRC, the data and its CRC per record
+    assert (tmp_path / 'records.tfrecord').stat().st_size == sum(16 + len(r) for r in records)
+
+
+def test_append(tmp_path):
+    path = str(tmp_path / 'records.tfrecord')
+    with tfrecord_io.TFRecordWriter(path) as writer:
+        writer.write(b'first')
+    with tfrecord_io.TFRecordWriter(path, append=True) as writer:
+        writer.write(b'second')
+    assert list(tfrecord_io.tf_record_iterator(path)) == [b'first', b'second']
+
+
+@pytest.mark.parametrize('offset', [3, 12 + 2, 12 + 5 + 1])
+def test_corrupted_record(tmp_path, offset):
+    path = tmp_path / 'records.tfrecord'
+    with tfrecord_io.TFRecordWriter(str(path)) as writer:
+        writer.write(b'hello')
+    data = bytearray(path.read_bytes())
+    data[offset] ^= 0xff
+    path.write_bytes(bytes(data))
+    with pytest.raises(IOError, match='corrupted'):
+        list(tfrecord_io.tf_record_iterator(str(path)))
+
+
+def test_corrupted_record_without_crc_check(tmp_path):
+    path = tmp_path / 'records.tfrecord'
+    with tfrecord_io.TFRecordWriter(str(path)) as writer:
+        writer.write(b'hello')
+    data = bytearray(path.read_bytes())
+    data[12] ^= 0xff
+    path.write_bytes(bytes(data))
+    assert list(tfrecord_io.tf_record_iterator(str(path), check_crc=False)) == [bytes(data[12:17])]
+
+
+@pytest.mark.parametrize('size', [5, 12 + 3, 12 + 5 + 2])
+def test_truncated_record(tmp_path, size):
+    path = tmp_path / 'records.tfrecord'
+    with tfrecord_io.TFRecordWriter(str(path)) as writer:
+        writer.write(b'hello')
+    path.write_bytes(path.read_bytes()[:size])
+    with pytest.raises(IOError, match='truncated'):
+        list(tfrecord_io.tf_record_iterator(str(path)))
+
+
+def test_parse_example():
+    features = _example(1)
+    parsed = tfrecord_io.parse_example(tfrecord_io.serialize_example(features))
+    assert list(parsed) == list(features)
+    assert parsed['input_ids'] == features['input_ids']
+    assert parsed['big'] == features['big']
+    assert parsed['weights'] == features['weights']
+    assert parsed['empty'] == tfrecord_io.Int64Feature([])
+    assert parsed['text'] == features['text']
+
+
+def test_read_with_tensorflow(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+    path = str(tmp_path / 'records.tfrecord')
+    with tfrecord_io.TFRecordWriter(path) as writer:
+        for i in range(3):
+            writer.write(tfrecord_io.serialize_example(_example(i)))
+    records = [record.numpy() for record in tf.data.TFRecordDataset(path)]
+    assert len(records) == 3
+    for i, record in enumerate(records):
+        feature = tf.train.Example.FromString(record).features.feature
+        assert list(feature['input_ids'].int64_list.value) == _example(i)['input_ids'].values
+        assert list(feature['big'].int64_list.value) == [-1, 1 << 40]
+        assert list(feature['weights'].float_list.value) == [1.0, 0.5]
+        assert list(feature['text'].bytes_list.value) == [b'abc', b'']
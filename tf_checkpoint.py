@@ -0,0 +1,195 @@
+"""Reading TensorFlow checkpoints without TensorFlow.
+
+A checkpoint `PREFIX` in the V2 format written by `tf.train.Saver` is an
+index, `PREFIX.index`, and the raw little-endian tensor bytes in
+`PREFIX.data-0000N-of-0000M`. The index is a LevelDB style table mapping
+every variable name to a `BundleEntryProto` with its dtype, shape, data file
+and byte range, so a single tensor can be read without loading the others.
+`CheckpointReader` parses the index at construction and reads the tensors
+on request, without importing TensorFlow, which alone takes about 500 MB.
+
+Uncompressed indexes, which is what TensorFlow writes, and unpartitioned
+variables of numeric dtypes are supported; a checkpoint with anything else
+raises a ValueError when it is opened. The checksums of the tensors are not
+verified.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+_TABLE_MAGIC = 0xdb4775248b80fb57
+_FOOTER_SIZE = 48
+# compression type byte and CRC after every block
+_BLOCK_TRAILER_SIZE = 5
+
+# tensorflow.DataType enum values of the supported dtypes
+_DTYPES = {
+    1: np.float32,
+    2: np.float64,
+    3: np.int32,
+    4: np.uint8,
+    5: np.int16,
+    6: np.int8,
+    9: np.int64,
+    10: np.bool_,
+    17: np.uint16,
+    19: np.float16,
+    22: np.uint32,
+    23: np.uint64,
+}
+
+
+def _varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _proto_fields(data):
+    """Yields the field numbers and values of a serialized protocol buffer,
+    varints as ints and length-delimited fields as bytes."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 1:
+            value = struct.unpack_from('<Q', data, pos)[0]
+            pos += 8
+        elif wire_type == 2:
+            size, pos = _varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        elif wire_type == 5:
+            value = struct.unpack_from('<I', data, pos)[0]
+            pos += 4
+        else:
+            raise ValueError('unsupported protocol buffer wire type %d' % wire_type)
+        yield field, value
+
+
+def _block_entries(data, offset, size):
+    """Yields the keys and values of the table block at `offset`."""
+    if data[offset + size] != 0:
+        raise ValueError('compressed checkpoint indexes are not supported')
+    block = data[offset:offset + size]
+    num_restarts = struct.unpack_from('<I', block, len(block) - 4)[0]
+    end = len(block) - 4 * (num_restarts + 1)
+    pos = 0
+    key = b''
+    while pos < end:
+        shared, pos = _varint(block, pos)
+        non_shared, pos = _varint(block, pos)
+        value_size, pos = _varint(block, pos)
+        key = key[:shared] + block[pos:pos + non_shared]
+        pos += non_shared
+        yield key, block[pos:pos + value_size]
+        pos += value_size
+
+
+def _read_table(path):
+    """Returns the keys and values of a table file as a list of pairs."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _FOOTER_SIZE or struct.unpack_from('<Q', data, len(data) - 8)[0] != _TABLE_MAGIC:
+        raise ValueError('%s is not a checkpoint index' % path)
+    # the footer holds the block handles of the meta index and of the index
+    pos = len(data) - _FOOTER_SIZE
+    _, pos = _varint(data, pos)
+    _, pos = _varint(data, pos)
+    index_offset, pos = _varint(data, pos)
+    index_size, pos = _varint(data, pos)
+    entries = []
+    for _, handle in _block_entries(data, index_offset, index_size):
+        block_offset, handle_pos = _varint(handle, 0)
+        block_size, _ = _varint(handle, handle_pos)
+        entries.extend(_block_entries(data, block_offset, block_size))
+    return entries
+
+
+class _Entry(object):
+    """The fields of a `BundleEntryProto` needed to read a tensor."""
+
+    def __init__(self, serialized):
+        self.dtype = 0
+        self.shape = []
+        self.shard_id = 0
+        self.offset = 0
+        self.size = 0
+        self.sliced = False
+        for field, value in _proto_fields(serialized):
+            if field == 1:
+                self.dtype = value
+            elif field == 2:
+                for shape_field, dim in _proto_fields(value):
+                    if shape_field == 2:
+                        self.shape.append(dict(_proto_fields(dim)).get(1, 0))
+            elif field == 3:
+                self.shard_id = value
+            elif field == 4:
+                self.offset = value
+            elif field == 5:
+                self.size = value
+            elif field == 7:
+                self.sliced = True
+
+
+class CheckpointReader(object):
+    """Reads the variables of a local V2 checkpoint, one at a time."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._entries = {}
+        num_shards = 1
+        for key, value in _read_table(prefix + '.index'):
+            if key == b'':
+                # the BundleHeaderProto
+                header = dict(_proto_fields(value))
+                num_shards = header.get(1, 1)
+                if header.get(2, 0) != 0:
+                    raise ValueError('big-endian checkpoints are not supported')
+            elif key.startswith(b'\x00'):
+                # a slice of a partitioned variable, whose own entry is sliced
+                continue
+            else:
+                name = key.decode('utf-8')
+                entry = _Entry(value)
+                # fail here rather than halfway through reading the variables
+                if entry.sliced:
+                    raise ValueError('partitioned variable %s is not supported' % name)
+                if entry.dtype not in _DTYPES:
+                    raise ValueError('variable %s has the unsupported dtype %d' % (name, entry.dtype))
+                self._entries[name] = entry
+        self._data_files = ['%s.data-%05d-of-%05d' % (prefix, i, num_shards) for i in range(num_shards)]
+
+    def list_variables(self):
+        """Sorted list of the names and shapes of the variables, like
+        `tf.train.list_variables`."""
+        return [(name, list(entry.shape)) for name, entry in sorted(self._entries.items())]
+
+    def get_tensor(self, name):
+        """Reads a variable into a new NumPy array."""
+        entry = self._entries[name]
+        dtype = np.dtype(_DTYPES[entry.dtype]).newbyteorder('<')
+        array = np.empty(entry.shape, dtype=dtype)
+        if array.nbytes != entry.size:
+            raise ValueError('variable %s has %d bytes, not %d' % (name, entry.size, array.nbytes))
+        with open(self._data_files[entry.shard_id], 'rb') as f:
+            f.seek(entry.offset)
+            if f.readinto(memoryview(array.reshape(-1)).cast('B')) != entry.size:
+                raise ValueError('%s is truncated' % self._data_files[entry.shard_id])
+        return array.astype(dtype.newbyteorder('='), copy=False)
+
+
+def is_supported(prefix):
+    """Whether `prefix` is a local checkpoint `CheckpointReader` can open."""
+    return '://' not in prefix and os.path.exists(prefix + '.index')
@@ -0,0 +1,252 @@
+"""TFRecord files of `tf.train.Example`s without TensorFlow.
+
+Records are framed as TensorFlow does: a little-endian uint64 length, the
+masked CRC32C of the length, the data and the masked CRC32C of the data.
+Examples are serialized directly into the protobuf wire format of
+`tf.train.Example`, so the files can be read by `tf.data.TFRecordDataset` and
+`tf.parse_single_example` as used by the BERT pre-training input pipeline.
+
+CRC32C is computed by `google_crc32c` or `crc32c` if one of them is installed,
+and by a slower pure Python implementation otherwise.
+"""
+
+import struct
+import collections
+
+import file_io
+
+Int64Feature = collections.namedtuple('Int64Feature', ['values'])
+FloatFeature = collections.namedtuple('FloatFeature', ['values'])
+BytesFeature = collections.namedtuple('BytesFeature', ['values'])
+
+
+def _make_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82f63b78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def _crc32c_python(data):
+    table = _CRC32C_TABLE
+    crc = 0xffffffff
+    for b in data:
+        crc = table[(crc ^ b) & 0xff] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+
+
+try:
+    import google_crc32c
+
+    CRC32C_IMPLEMENTATION = 'google_crc32c'
+
+    def crc32c(data):
+        return google_crc32c.value(bytes(data))
+except ImportError:
+    try:
+        import crc32c as _crc32c
+
+        CRC32C_IMPLEMENTATION = 'crc32c'
+
+        def crc32c(data):
+            return _crc32c.crc32c(data)
+    except ImportError:
+        CRC32C_IMPLEMENTATION = 'pure Python'
+        crc32c = _crc32c_python
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xa282ead8) & 0xffffffff
+
+
+class TFRecordWriter(object):
+    """Writes records into a TFRecord file, a drop-in for `tf.python_io.TFRecordWriter`.
+
+    With `append`, records are added to the end of an existing file.
+    """
+
+    def __init__(self, path, append=False):
+        self._file = file_io.open_file(path, 'ab' if append else 'wb')
+
+    def write(self, record):
+        length = struct.pack('<Q', len(record))
+        self._file.write(length)
+        self._file.write(struct.pack('<I', masked_crc32c(length)))
+        self._file.write(record)
+        self._file.write(struct.pack('<I', masked_crc32c(record)))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def tf_record_iterator(path, check_crc=True):
+    """Yields the records of a TFRecord file."""
+    with file_io.open_file(path, 'rb') as f:
+        while True:
+            header = f.read(12)
+            if not header:
+                break
+            if len(header) != 12:
+                raise IOError('truncated record header in %s' % path)
+            length, length_crc = struct.unpack('<QI', header)
+            if check_crc and masked_crc32c(header[:8]) != length_crc:
+                raise IOError('corrupted record length in %s' % path)
+            record = f.read(length)
+            footer = f.read(4)
+            if len(record) != length or len(footer) != 4:
+                raise IOError('truncated record in %s' % path)
+            if check_crc and masked_crc32c(record) != struct.unpack('<I', footer)[0]:
+                raise IOError('corrupted record in %s' % path)
+            yield record
+
+
+# protobuf wire format
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _encode_varint(value):
+    value &= 0xffffffffffffffff
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# varints of small values are looked up, token ids being the bulk of the data
+_SMALL_VARINTS = [_encode_varint(i) for i in range(1 << 16)]
+
+
+def _varint(value):
+    if 0 <= value < 65536:
+        return _SMALL_VARINTS[value]
+    return _encode_varint(value)
+
+
+def _length_delimited(field_number, payload):
+    return _varint((field_number << 3) | _LENGTH_DELIMITED) + _varint(len(payload)) + payload
+
+
+def _encode_feature(feature):
+    # Feature: oneof bytes_list = 1, float_list = 2, int64_list = 3, each a
+    # message with a (packed) repeated field 1
+    small_varints = _SMALL_VARINTS
+    if isinstance(feature, Int64Feature):
+        packed = b''.join([small_varints[v] if 0 <= v < 65536 else _encode_varint(v)
+                           for v in feature.values])
+        values = _length_delimited(1, packed) if packed else b''
+        return _length_delimited(3, values)
+    if isinstance(feature, FloatFeature):
+        packed = struct.pack('<%df' % len(feature.values), *feature.values)
+        values = _length_delimited(1, packed) if packed else b''
+        return _length_delimited(2, values)
+    if isinstance(feature, BytesFeature):
+        return _length_delimited(1, b''.join([_length_delimited(1, v) for v in feature.values]))
+    raise ValueError('Unsupported feature type: %s' % type(feature))
+
+
+def serialize_example(features):
+    """Serializes an ordered dict of feature name to `Int64Feature`,
+    `FloatFeature` or `BytesFeature` as a `tf.train.Example`."""
+    entries = []
+    for name, feature in features.items():
+        # map<string, Feature> entry: key = 1, value = 2
+        entry = _length_delimited(1, name.encode('utf-8')) + _length_delimited(2, _encode_feature(feature))
+        entries.append(_length_delimited(1, entry))
+    # Example: features = 1, Features: feature = 1
+    return _length_delimited(1, b''.join(entries))
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(data):
+    """Yields (field number, wire type, value) of a serialized message."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field_number, wire_type = key >> 3, key & 7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == _FIXED64:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == _FIXED32:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError('Unsupported wire type %d' % wire_type)
+        yield field_number, wire_type, value
+
+
+def _decode_values(data, kind):
+    values = []
+    for _, wire_type, value in _iter_fields(data):
+        if kind == 'bytes':
+            values.append(bytes(value))
+        elif kind == 'float':
+            if wire_type == _LENGTH_DELIMITED:
+                values.extend(struct.unpack('<%df' % (len(value) // 4), value))
+            else:
+                values.append(struct.unpack('<f', value)[0])
+        elif wire_type == _LENGTH_DELIMITED:
+            pos = 0
+            while pos < len(value):
+                v, pos = _read_varint(value, pos)
+                values.append(v - (1 << 64) if v >= 1 << 63 else v)
+        else:
+            values.append(value - (1 << 64) if value >= 1 << 63 else value)
+    return values
+
+
+def parse_example(record):
+    """Parses a serialized `tf.train.Example` into a dict of feature name to
+    `Int64Feature`, `FloatFeature` or `BytesFeature`."""
+    features = collections.OrderedDict()
+    for _, _, features_message in _iter_fields(memoryview(record)):
+        for _, _, entry in _iter_fields(features_message):
+            name, feature = None, BytesFeature([])
+            for field_number, _, value in _iter_fields(entry):
+                if field_number == 1:
+                    name = bytes(value).decode('utf-8')
+                elif field_number == 2:
+                    for kind_number, _, values in _iter_fields(value):
+                        if kind_number == 1:
+                            feature = BytesFeature(_decode_values(values, 'bytes'))
+                        elif kind_number == 2:
+                            feature = FloatFeature(_decode_values(values, 'float'))
+                        elif kind_number == 3:
+                            feature = Int64Feature(_decode_values(values, 'int64'))
+            features[name] = feature
+    return features
@@ -10,12 +10,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import array
 import collections
+import itertools
 import re
+import sys
+import threading
 import unicodedata
+import numpy as np
 import sentencepiece as sp
 import six
-import tensorflow as tf
+import file_io
 
 
 def validate_case_matches_checkpoint(do_lower_case, init_checkpoint):
@@ -115,7 +120,7 @@ def load_vocab(vocab_file):
     """Loads a vocabulary file into a dictionary."""
     vocab = collections.OrderedDict()
     index = 0
-    with tf.gfile.GFile(vocab_file, "r") as reader:
+    with file_io.open_file(vocab_file, "r") as reader:
         while True:
             token = convert_to_unicode(reader.readline())
             if not token:
@@ -145,16 +150,153 @@ def convert_tokens_to_ids(vocab, tokens):
 
 def convert_ids_to_tokens(inv_vocab, ids):
     """Token of unknown word is assumed as <unk> according to sentencepiece"""
+    if isinstance(inv_vocab, np.ndarray):
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(inv_vocab))
+        return np.where(known, inv_vocab[np.where(known, ids, 0)], "<unk>").tolist()
     return convert_by_vocab(inv_vocab, ids, unk_info="<unk>")
 
 
+TRUNCATION_STRATEGIES = ("longest_first", "only_first", "only_second", "do_not_truncate")
+
+
+def truncate_lengths(lengths_a, lengths_b, max_length, truncation="longest_first"):
+    """Truncates the lengths of pairs of sequences to at most `max_length` ids
+    per pair, returning the new lengths as two arrays.
+
+    "longest_first" removes the last id of the longer sequence, of the second
+    one if both are equally long, one at a time, like `_truncate_seq_pair` of
+    BERT. "only_first" and "only_second" truncate one sequence only and
+    "do_not_truncate" none; a pair that does not fit then raises a ValueError.
+    `lengths_b` is None for single sequences.
+    """
+    if truncation not in TRUNCATION_STRATEGIES:
+        raise ValueError("truncation has to be one of %s, not %r" % (", ".join(TRUNCATION_STRATEGIES), truncation))
+    lengths_a = np.asarray(lengths_a, dtype=np.int64)
+    lengths_b = np.zeros_like(lengths_a) if lengths_b is None else np.asarray(lengths_b, dtype=np.int64)
+    excess = np.maximum(lengths_a + lengths_b - max_length, 0)
+    if truncation == "longest_first":
+        difference = lengths_a - lengths_b
+        # removing ids from the longer sequence alternates once both are
+        # equally long, the first one keeps the odd id
+        new_lengths_a = np.where(difference >= excess, lengths_a - excess,
+                                 np.where(-difference >= excess, lengths_a, (max_length + 1) // 2))
+        new_lengths_b = np.where(difference >= excess, lengths_b,
+                                 np.where(-difference >= excess, lengths_b - excess, max_length // 2))
+        excess_rows = excess > 0
+        lengths_a = np.where(excess_rows, new_lengths_a, lengths_a)
+        lengths_b = np.where(excess_rows, new_lengths_b, lengths_b)
+    elif truncation == "only_first":
+        lengths_a = lengths_a - excess
+    elif truncation == "only_second":
+        lengths_b = lengths_b - excess
+    if (lengths_a < 0).any() or (lengths_b < 0).any() or (
+            truncation == "do_not_truncate" and excess.any()):
+        raise ValueError("sequences longer than %d ids cannot be truncated with %r" % (max_length, truncation))
+    return lengths_a, lengths_b
+
+
+def load_pieces(sp_model):
+    """Returns the pieces of a loaded SentencePiece model as a NumPy array
+    indexed by id."""
+    return np.array(sp_model.IdToPiece(list(range(sp_model.GetPieceSize()))), dtype=object)
+
+
+class TokenizationCache(object):
+    """Bounded LRU cache of the token ids of normalized texts.
+
+    Holds up to `max_size` entries as compact arrays of `typecode`; the least
+    recently used entry is evicted when a new one does not fit. All methods are
+    thread-safe.
+    """
+
+    def __init__(self, max_size, typecode="H"):
+        self.max_size = max_size
+        self.typecode = typecode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text):
+        """Returns the ids of `text` as a list, or None if it is not cached."""
+        with self._lock:
+            ids = self._entries.get(text)
+            if ids is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+        return ids.tolist()
+
+    def get_many(self, texts):
+        """Returns a dict of the ids of the distinct `texts`, None for those
+        that are not cached. Repeats within `texts` count as hits."""
+        ids_by_text = {}
+        entries = self._entries
+        with self._lock:
+            for text in texts:
+                if text in ids_by_text:
+                    continue
+                ids = entries.get(text)
+                if ids is not None:
+                    entries.move_to_end(text)
+                    ids = ids.tolist()
+                ids_by_text[text] = ids
+            num_missing = sum(1 for ids in ids_by_text.values() if ids is None)
+            self.misses += num_missing
+            self.hits += len(texts) - num_missing
+        return ids_by_text
+
+    def put(self, text, ids):
+        self.put_many([(text, ids)])
+
+    def put_many(self, items):
+        """Adds `(text, ids)` pairs."""
+        items = [(text, array.array(self.typecode, ids)) for text, ids in items]
+        entries = self._entries
+        with self._lock:
+            for text, ids in items:
+                entries[text] = ids
+                entries.move_to_end(text)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return collections.OrderedDict([
+                ("size", len(self._entries)), ("max_size", self.max_size),
+                ("hits", self.hits), ("misses", self.misses),
+                ("evictions", self.evictions),
+                ("hit_rate", self.hits / lookups if lookups else 0.0)])
+
+    def __str__(self):
+        stats = self.stats()
+        stats["hit_rate"] *= 100
+        return ("%(hits)d hits, %(misses)d misses (hit rate %(hit_rate).1f%%), %(evictions)d evictions, "
+                "%(size)d of %(max_size)d entries" % stats)
+
+
 class FullTokenizer(object):
-    """Runs end-to-end tokenziation."""
+    """Runs end-to-end tokenziation.
+
+    The vocabulary is taken from the SentencePiece model: `vocab` maps pieces
+    to ids and `inv_vocab` is a NumPy array of the pieces indexed by id.
+    `vocab_file` is not read, the `.vocab` file written with the model lists
+    the same pieces in the same order.
+    """
 
-    def __init__(self, model_file, vocab_file, do_lower_case=True):
-        self.tokenizer = SentencePieceTokenizer(model_file, do_lower_case=do_lower_case)
-        self.vocab = load_vocab(vocab_file)
-        self.inv_vocab = {v: k for k, v in self.vocab.items()}
+    def __init__(self, model_file, vocab_file=None, do_lower_case=True, cache_size=0):
+        self.tokenizer = SentencePieceTokenizer(model_file, do_lower_case=do_lower_case,
+                                                cache_size=cache_size)
+        self.inv_vocab = load_pieces(self.tokenizer.tokenizer)
+        self.vocab = dict(zip(self.inv_vocab.tolist(), range(len(self.inv_vocab))))
 
     def tokenize(self, text):
         split_tokens = self.tokenizer.tokenize(text)
@@ -166,14 +308,167 @@ class FullTokenizer(object):
 
     def convert_ids_to_tokens(self, ids):
         """Token of unknown word is assumed as <unk> according to sentencepiece"""
-        return convert_by_vocab(self.inv_vocab, ids, unk_info="<unk>")
+        return convert_ids_to_tokens(self.inv_vocab, ids)
+
+    def encode_ids(self, text):
+        """Tokenizes a piece of text directly into a list of ids."""
+        return self.tokenizer.tokenize_ids(text)
+
+    def batch_encode(self, texts, flat=False, dtype=np.int32, num_threads=None):
+        """Tokenizes a list of texts directly into ids.
+
+        Returns a list of NumPy arrays, one per text, or, if `flat` is set, a
+        tuple `(ids, offsets)` of a single array with the ids of all texts and
+        the offsets where each text starts, with `len(texts) + 1` entries so
+        that text `i` is `ids[offsets[i]:offsets[i + 1]]`.
+        """
+        batch = self.tokenizer.batch_tokenize_ids(texts, num_threads=num_threads)
+        if not flat:
+            return [np.array(ids, dtype=dtype) for ids in batch]
+        offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in batch], out=offsets[1:])
+        ids = np.fromiter(itertools.chain.from_iterable(batch), dtype=dtype,
+                          count=offsets[-1])
+        return ids, offsets
+
+    def batch_decode(self, ids, offsets=None):
+        """Detokenizes a batch of ids into texts.
+
+        Takes either a list of id sequences or the `(ids, offsets)` pair
+        returned by `batch_encode(..., flat=True)`.
+        """
+        if offsets is not None:
+            ids = [ids[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return self.tokenizer.batch_detokenize_ids(ids)
+
+    def encode(self, texts, max_seq_length=None, truncation="longest_first", pad_to_multiple_of=None,
+               return_tensors="np", num_threads=None):
+        """Encodes a batch of texts into `[CLS] text [SEP]` model inputs, see
+        `encode_pair`."""
+        return self.encode_pair(texts, None, max_seq_length, truncation, pad_to_multiple_of, return_tensors,
+                                num_threads)
+
+    def encode_pair(self, texts_a, texts_b, max_seq_length=None, truncation="longest_first",
+                    pad_to_multiple_of=None, return_tensors="np", num_threads=None):
+        """Encodes a batch of text pairs into `[CLS] A [SEP] B [SEP]` model inputs.
+
+        Returns a dict of `input_ids`, `attention_mask` and `token_type_ids`,
+        int64 arrays of shape `[len(texts_a), length]`, or PyTorch tensors if
+        `return_tensors` is "pt". The pairs are padded with 0 to the longest one
+        of the batch, rounded up to a multiple of `pad_to_multiple_of` if given
+        but not beyond `max_seq_length`. Longer pairs are truncated to
+        `max_seq_length` as described in `truncate_lengths`. `texts_b` is None
+        for single texts.
+        """
+        texts_a = list(texts_a)
+        texts = texts_a
+        if texts_b is not None:
+            texts_b = list(texts_b)
+            if len(texts_b) != len(texts_a):
+                raise ValueError("texts_b has %d texts, texts_a %d" % (len(texts_b), len(texts_a)))
+            texts = texts_a + texts_b
+        ids = self.tokenizer.batch_tokenize_ids(texts, num_threads=num_threads)
+        num_texts = len(texts_a)
+        return self.encode_pair_ids(ids[:num_texts], ids[num_texts:] if texts_b is not None else None,
+                                    max_seq_length, truncation, pad_to_multiple_of, return_tensors)
+
+    def encode_batches(self, texts, text_pairs=None, batch_size=32, sort_by_length=False, sort_window=64,
+                       max_seq_length=None, truncation="longest_first", pad_to_multiple_of=None,
+                       return_tensors="np", num_threads=None):
+        """Encodes a stream of texts, or of pairs with `text_pairs`, in batches
+        of `batch_size`, the other arguments being those of `encode_pair`.
+
+        Yields `(indices, batch)` tuples, `indices` being the positions of the
+        texts of the batch in the stream. The texts are tokenized `sort_window`
+        batches at a time; with `sort_by_length`, these are sorted by length
+        before being split into batches, so that texts of similar lengths are
+        padded together. `indices` then tell the original order.
+        """
+        texts = iter(texts)
+        text_pairs = iter(text_pairs) if text_pairs is not None else None
+        start = 0
+        while True:
+            window_texts = list(itertools.islice(texts, batch_size * sort_window))
+            if not window_texts:
+                return
+            ids_a = self.tokenizer.batch_tokenize_ids(window_texts, num_threads=num_threads)
+            ids_b = None
+            if text_pairs is not None:
+                ids_b = self.tokenizer.batch_tokenize_ids(list(itertools.islice(text_pairs, len(window_texts))),
+                                                          num_threads=num_threads)
+                if len(ids_b) != len(ids_a):
+                    raise ValueError("text_pairs has fewer texts than texts")
+            order = np.arange(len(ids_a))
+            if sort_by_length:
+                lengths = np.array([len(ids) for ids in ids_a])
+                if ids_b is not None:
+                    lengths += np.array([len(ids) for ids in ids_b])
+                order = np.argsort(lengths, kind="stable")
+            for batch_start in range(0, len(order), batch_size):
+                batch_order = order[batch_start:batch_start + batch_size]
+                batch = self.encode_pair_ids([ids_a[i] for i in batch_order],
+                                             [ids_b[i] for i in batch_order] if ids_b is not None else None,
+                                             max_seq_length, truncation, pad_to_multiple_of, return_tensors)
+                yield start + batch_order, batch
+            start += len(ids_a)
+
+    def encode_pair_ids(self, ids_a, ids_b, max_seq_length=None, truncation="longest_first",
+                        pad_to_multiple_of=None, return_tensors="np"):
+        """Encodes already tokenized pairs, lists of ids per text, like
+        `encode_pair`. `ids_b` is None for single texts."""
+        num_special = 2 if ids_b is None else 3
+        lengths_a = [len(ids) for ids in ids_a]
+        lengths_b = [len(ids) for ids in ids_b] if ids_b is not None else None
+        if max_seq_length is not None:
+            lengths_a, lengths_b = truncate_lengths(lengths_a, lengths_b, max_seq_length - num_special, truncation)
+        else:
+            lengths_a = np.array(lengths_a, dtype=np.int64)
+            lengths_b = np.array(lengths_b if ids_b is not None else np.zeros_like(lengths_a), dtype=np.int64)
+        lengths = lengths_a + lengths_b + num_special
+        # an empty batch gets the length of empty texts
+        length = int(lengths.max()) if len(lengths) else num_special
+        if pad_to_multiple_of:
+            length = -(-length // pad_to_multiple_of) * pad_to_multiple_of
+            if max_seq_length is not None:
+                length = min(length, max_seq_length)
+
+        rows = np.arange(len(ids_a))
+        input_ids = np.zeros((len(ids_a), length), dtype=np.int64)
+        input_ids[:, 0] = self.vocab["[CLS]"]
+        for i, ids in enumerate(ids_a):
+            input_ids[i, 1:1 + lengths_a[i]] = ids[:lengths_a[i]]
+        input_ids[rows, lengths_a + 1] = self.vocab["[SEP]"]
+        if ids_b is not None:
+            for i, ids in enumerate(ids_b):
+                input_ids[i, lengths_a[i] + 2:lengths_a[i] + 2 + lengths_b[i]] = ids[:lengths_b[i]]
+            input_ids[rows, lengths - 1] = self.vocab["[SEP]"]
+        positions = np.arange(length)
+        attention_mask = positions < lengths[:, None]
+        token_type_ids = attention_mask & (positions >= (lengths_a + 2)[:, None])
+        batch = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask.astype(np.int64),
+            "token_type_ids": token_type_ids.astype(np.int64),
+        }
+        if return_tensors == "pt":
+            import torch
+            batch = {name: torch.from_numpy(array) for name, array in batch.items()}
+        elif return_tensors != "np":
+            raise ValueError("return_tensors has to be 'np' or 'pt', not %r" % return_tensors)
+        return batch
 
 
 class SentencePieceTokenizer(object):
-    """Runs SentencePiece tokenization (from raw text to tokens list)"""
+    """Runs SentencePiece tokenization (from raw text to tokens list)
+
+    With a `cache_size`, the ids of up to that many distinct normalized texts
+    are kept in a `TokenizationCache`, `self.cache`, and repeated texts are not
+    encoded again.
+    """
 
-    def __init__(self, model_file=None, do_lower_case=True):
+    def __init__(self, model_file=None, do_lower_case=True, cache_size=0):
         """Constructs a SentencePieceTokenizer."""
+        self.model_file = model_file
         self.tokenizer = sp.SentencePieceProcessor()
         if self.tokenizer.Load(model_file):
             print("Loaded a trained SentencePiece model.")
@@ -181,11 +476,56 @@ class SentencePieceTokenizer(object):
             print("You have to give a path of trained SentencePiece model.")
             sys.exit(1)
         self.do_lower_case = do_lower_case
+        self.cache = None
+        if cache_size:
+            typecode = "H" if self.tokenizer.GetPieceSize() <= 1 << 16 else "i"
+            self.cache = TokenizationCache(cache_size, typecode)
 
-    def tokenize(self, text):
-        """Tokenizes a piece of text."""
+    def _normalize(self, text):
         text = convert_to_unicode(text)
         if self.do_lower_case:
             text = text.lower()
+        return text
+
+    def tokenize(self, text):
+        """Tokenizes a piece of text."""
+        text = self._normalize(text)
+        if self.cache is not None:
+            ids = self._cached_ids(text)
+            # unknown pieces are returned as their text, which the ids lack
+            if self.tokenizer.unk_id() not in ids:
+                return [self.tokenizer.IdToPiece(i) for i in ids]
         output_tokens = self.tokenizer.EncodeAsPieces(text)
-        return output_tokens
\ No newline at end of file
+        return output_tokens
+
+    def tokenize_ids(self, text):
+        """Tokenizes a piece of text into ids."""
+        text = self._normalize(text)
+        if self.cache is not None:
+            return self._cached_ids(text)
+        return self.tokenizer.EncodeAsIds(text)
+
+    def _cached_ids(self, text):
+        ids = self.cache.get(text)
+        if ids is None:
+            ids = self.tokenizer.EncodeAsIds(text)
+            self.cache.put(text, ids)
+        return ids
+
+    def batch_tokenize_ids(self, texts, num_threads=None):
+        """Tokenizes a list of texts into lists of ids in one SentencePiece call."""
+        texts = [self._normalize(text) for text in texts]
+        if self.cache is None:
+            return self.tokenizer.Encode(texts, out_type=int, num_threads=num_threads)
+
+        ids_by_text = self.cache.get_many(texts)
+        missing = [text for text, ids in ids_by_text.items() if ids is None]
+        if missing:
+            encoded = self.tokenizer.Encode(missing, out_type=int, num_threads=num_threads)
+            ids_by_text.update(zip(missing, encoded))
+            self.cache.put_many(zip(missing, encoded))
+        return [ids_by_text[text] for text in texts]
+
+    def batch_detokenize_ids(self, ids):
+        """Detokenizes a list of id sequences into texts."""
+        return self.tokenizer.Decode([[int(i) for i in sequence] for sequence in ids])
\ No newline at end of file
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""Tokenization server shared by the preprocessing clients of a host.
+
+Instead of every client loading its own SentencePiece model, one server loads
+a `FullTokenizer` and serves it over a Unix domain socket (`--socket`) and/or
+HTTP on localhost (`--port`). Requests that arrive within `--max_latency_ms`
+of each other are coalesced into a single `batch_tokenize_ids` call of up to
+`--max_batch_size` texts. The call runs in a worker thread, so the event loop
+keeps accepting requests meanwhile, and while it runs the next batch fills up.
+
+A request is a JSON object
+
+  {"texts": ["...", ...], "text_pairs": ["...", ...], "max_seq_length": 128}
+
+where `text_pairs` and `max_seq_length` are optional. The response holds the
+lists `input_ids`, `input_mask` and `segment_ids` with one entry per text,
+`[CLS] A [SEP]` or `[CLS] A [SEP] B [SEP]`, framed, truncated and padded by
+`FullTokenizer.encode_pair_ids`. With a `max_seq_length`, the longer of the
+two texts is truncated first and the entries are padded with 0 to
+`max_seq_length`. The response is the same as that of `encode_features`
+in process; errors are returned as `{"error": "..."}`.
+
+Over the Unix socket, requests and responses are single lines of JSON. A
+connection may send several requests without waiting for the responses,
+which come back in the order of the requests. Over HTTP, the request is
+POSTed to `/encode`. `{"stats": true}` on the socket and `GET /stats` return
+the batching statistics, e.g.
+
+  curl -d '{"texts": ["Сайн байна уу"]}' http://127.0.0.1:8765/encode
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import concurrent.futures
+
+import tokenization_sentencepiece as tokenization
+
+# longest request line or body accepted, in bytes
+MAX_REQUEST_BYTES = 64 << 20
+
+_HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+                 500: 'Internal Server Error'}
+
+
+def _features(tokenizer, ids_a, ids_b, max_seq_length):
+    """Features of the ids of texts, and of their pairs if `ids_b` is not
+    None, framed, truncated and padded by `FullTokenizer.encode_pair_ids`."""
+    batch = tokenizer.encode_pair_ids(ids_a, ids_b, max_seq_length=max_seq_length,
+                                      pad_to_multiple_of=max_seq_length)
+    features = {'input_ids': batch['input_ids'].tolist(),
+                'input_mask': batch['attention_mask'].tolist(),
+                'segment_ids': batch['token_type_ids'].tolist()}
+    if not max_seq_length:
+        # without a max_seq_length the texts are not padded
+        for i, length in enumerate(batch['attention_mask'].sum(axis=1).tolist()):
+            for name in features:
+                del features[name][i][length:]
+    return features
+
+
+def encode_features(tokenizer, texts, text_pairs=None, max_seq_length=None):
+    """Features of `texts`, and `text_pairs` if given, as returned by a request
+    to the server."""
+    texts, text_pairs, max_seq_length = parse_request(
+        {'texts': texts, 'text_pairs': text_pairs, 'max_seq_length': max_seq_length})
+    ids = tokenizer.tokenizer.batch_tokenize_ids(texts + (text_pairs or []))
+    return _features(tokenizer, ids[:len(texts)], ids[len(texts):] if text_pairs is not None else None,
+                     max_seq_length)
+
+
+def parse_request(request):
+    """Validates a decoded request, returning `texts`, `text_pairs` and
+    `max_seq_length`. Raises a ValueError for an invalid request."""
+    if not isinstance(request, dict):
+        raise ValueError('the request has to be a JSON object')
+    texts = request.get('texts')
+    text_pairs = request.get('text_pairs')
+    max_seq_length = request.get('max_seq_length')
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        raise ValueError('"texts" has to be a list of strings')
+    if text_pairs is not None:
+        if not isinstance(text_pairs, list) or not all(isinstance(text, str) for text in text_pairs):
+            raise ValueError('"text_pairs" has to be a list of strings')
+        if len(text_pairs) != len(texts):
+            raise ValueError('"text_pairs" has %d texts, "texts" %d' % (len(text_pairs), len(texts)))
+    if max_seq_length is not None:
+        min_length = 3 if text_pairs is not None else 2
+        if not isinstance(max_seq_length, int) or isinstance(max_seq_length, bool) or max_seq_length < min_length:
+            raise ValueError('"max_seq_length" has to be an integer of at least %d' % min_length)
+    return texts, text_pairs, max_seq_length
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent `encode` calls into batches tokenized in a worker
+    thread.
+
+    A batch is started `max_latency` seconds after its first request, or as
+    soon as `max_batch_size` texts are waiting, but only one batch runs at a
+    time: requests arriving while the worker is busy wait for the next batch.
+    """
+
+    def __init__(self, tokenizer, max_batch_size=256, max_latency=0.002):
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        # requests as (texts, text_pairs, max_seq_length) with their futures
+        self._pending = []
+        self._pending_texts = 0
+        self._timer = None
+        self._busy = False
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+
+    async def encode(self, texts, text_pairs=None, max_seq_length=None):
+        """Features of a request, the same as those of `encode_features`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((texts, text_pairs, max_seq_length), future))
+        self._pending_texts += len(texts) * (2 if text_pairs is not None else 1)
+        if self._pending_texts >= self.max_batch_size:
+            self._start_batch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_latency, self._start_batch)
+        return await future
+
+    def _start_batch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._busy or not self._pending:
+            return
+        num_texts = 0
+        size = 0
+        while size < len(self._pending) and num_texts < self.max_batch_size:
+            (texts, text_pairs, _), _ = self._pending[size]
+            num_texts += len(texts) * (2 if text_pairs is not None else 1)
+            size += 1
+        batch, self._pending = self._pending[:size], self._pending[size:]
+        self._pending_texts -= num_texts
+        self._busy = True
+        task = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._encode_batch, [request for request, _ in batch])
+        task.add_done_callback(lambda task: self._finish_batch(batch, task))
+
+    def _encode_batch(self, requests):
+        start = time.perf_counter()
+        texts = []
+        for texts_a, texts_b, _ in requests:
+            texts.extend(texts_a)
+            texts.extend(texts_b or [])
+        ids = self.tokenizer.tokenizer.batch_tokenize_ids(texts)
+        results = []
+        offset = 0
+        for texts_a, texts_b, max_seq_length in requests:
+            ids_a = ids[offset:offset + len(texts_a)]
+            offset += len(texts_a)
+            ids_b = None
+            if texts_b is not None:
+                ids_b = ids[offset:offset + len(texts_b)]
+                offset += len(texts_b)
+            results.append(_features(self.tokenizer, ids_a, ids_b, max_seq_length))
+        self.requests += len(requests)
+        self.texts += len(texts)
+        self.batches += 1
+        self.batch_seconds += time.perf_counter() - start
+        return results
+
+    def _finish_batch(self, batch, task):
+        self._busy = False
+        error = task.exception()
+        for i, (_, future) in enumerate(batch):
+            # the future of a client that went away is cancelled
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(task.result()[i])
+        # requests that arrived meanwhile have waited long enough
+        if self._pending:
+            self._start_batch()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'texts': self.texts,
+            'batches': self.batches,
+            'texts_per_batch': self.texts / self.batches if self.batches else 0.0,
+            'batch_seconds': round(self.batch_seconds, 3),
+        }
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class TokenizationServer(object):
+    """Serves a `MicroBatcher` over a Unix socket and/or HTTP."""
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def respond(self, body):
+        """Response to a request body, as an HTTP status and JSON bytes."""
+        try:
+            request = json.loads(body)
+            if isinstance(request, dict) and request.get('stats'):
+                return 200, json.dumps(self.batcher.stats()).encode('utf-8')
+            texts, text_pairs, max_seq_length = parse_request(request)
+        except ValueError as e:
+            return 400, json.dumps({'error': str(e)}).encode('utf-8')
+        try:
+            features = await self.batcher.encode(texts, text_pairs, max_seq_length)
+        except Exception as e:
+            return 500, json.dumps({'error': '%s: %s' % (type(e).__name__, e)}).encode('utf-8')
+        return 200, json.dumps(features, separators=(',', ':')).encode('utf-8')
+
+    async def handle_socket_client(self, reader, writer):
+        # responses are sent in the order of the requests by a separate task,
+        # so that the requests of a connection are batched together
+        responses = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send_lines(responses, writer))
+        try:
+            while not sender.done():
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    responses.put_nowait(asyncio.ensure_future(
+                        self._error_response('request longer than %d bytes' % MAX_REQUEST_BYTES)))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    responses.put_nowait(asyncio.ensure_future(self.respond(line)))
+        except ConnectionError:
+            pass
+        finally:
+            responses.put_nowait(None)
+            await sender
+            writer.close()
+
+    async def _error_response(self, message):
+        return 400, json.dumps({'error': message}).encode('utf-8')
+
+    @staticmethod
+    async def _send_lines(responses, writer):
+        while True:
+            response = await responses.get()
+            if response is None:
+                return
+            try:
+                _, body = await response
+                writer.write(body + b'\n')
+                await writer.drain()
+            except ConnectionError:
+                # drop the responses of a client that went away
+                while response is not None:
+                    response.cancel()
+                    response = await responses.get()
+                return
+
+    async def handle_http_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    content_length = int(headers.get('content-length', 0))
+                except ValueError:
+                    self._write_http(writer, 400, b'{"error": "malformed request"}', False)
+                    break
+                if content_length > MAX_REQUEST_BYTES:
+                    self._write_http(writer, 413, b'{"error": "request too large"}', False)
+                    break
+                body = await reader.readexactly(content_length)
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              if version == 'HTTP/1.1' else headers.get('connection', '').lower() == 'keep-alive')
+                if method == 'POST' and path == '/encode':
+                    status, response = await self.respond(body)
+                elif method == 'GET' and path == '/stats':
+                    status, response = 200, json.dumps(self.batcher.stats()).encode('utf-8')
+                else:
+                    status, response = 404, b'{"error": "POST /encode or GET /stats"}'
+                self._write_http(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _write_http(writer, status, body, keep_alive):
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                      'Connection: %s\r\n\r\n' % (status, _HTTP_REASONS[status], len(body),
+                                                  'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+        writer.write(body)
+
+    async def serve(self, socket_path=None, host='127.0.0.1', port=None):
+        """Serves until cancelled."""
+        servers = []
+        if socket_path:
+            if os.path.exists(socket_path):
+                # left over from a server that was killed
+                os.unlink(socket_path)
+            servers.append(await asyncio.start_unix_server(self.handle_socket_client, socket_path,
+                                                           limit=MAX_REQUEST_BYTES))
+            print('listening on %s' % socket_path, flush=True)
+        if port is not None:
+            server = await asyncio.start_server(self.handle_http_client, host, port, limit=MAX_REQUEST_BYTES)
+            servers.append(server)
+            print('listening on http://%s:%d' % server.sockets[0].getsockname()[:2], flush=True)
+        try:
+            await asyncio.gather(*[server.serve_forever() for server in servers])
+        finally:
+            for server in servers:
+                server.close()
+            if socket_path and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+class AsyncClient(object):
+    """Client of a server at `address`, a Unix socket path or
+    `http://HOST:PORT`. A client sends one request at a time, concurrent
+    requests need a client each."""
+
+    def __init__(self, address):
+        self.address = address
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.address.startswith('http://'):
+            host, _, port = self.address[len('http://'):].rstrip('/').partition(':')
+            self._reader, self._writer = await asyncio.open_connection(host, int(port or 80),
+                                                                       limit=MAX_REQUEST_BYTES)
+        else:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.address,
+                                                                            limit=MAX_REQUEST_BYTES)
+
+    async def request(self, request):
+        """Sends a request object and returns the decoded response."""
+        body = json.dumps(request).encode('utf-8')
+        async with self._lock:
+            if self._writer is None:
+                await self.connect()
+            if self.address.startswith('http://'):
+                self._writer.write(b'POST /encode HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                                   b'Content-Length: %d\r\n\r\n' % len(body) + body)
+                await self._writer.drain()
+                await self._reader.readline()
+                content_length = 0
+                while True:
+                    line = await self._reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        content_length = int(value)
+                response = await self._reader.readexactly(content_length)
+            else:
+                self._writer.write(body + b'\n')
+                await self._writer.drain()
+                response = await self._reader.readline()
+        return json.loads(response)
+
+    async def encode(self, texts, text_pairs=None, max_seq_length=None):
+        request = {'texts': texts}
+        if text_pairs is not None:
+            request['text_pairs'] = text_pairs
+        if max_seq_length is not None:
+            request['max_seq_length'] = max_seq_length
+        response = await self.request(request)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    async def stats(self):
+        return await self.request({'stats': True})
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def _serve(server, args):
+    task = asyncio.ensure_future(server.serve(args.socket, args.host, args.port))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model_file", required=True, help='SentencePiece model file')
+    parser.add_argument("--cased", action='store_true', help='if set, do not lower case the texts')
+    parser.add_argument("--socket", default=None, help='path of the Unix domain socket to listen on')
+    parser.add_argument("--host", default='127.0.0.1', help='address to listen on for HTTP')
+    parser.add_argument("--port", type=int, default=None, help='port to listen on for HTTP, 0 picks a free one')
+    parser.add_argument("--max_batch_size", type=int, default=256, help='maximum number of texts per batch')
+    parser.add_argument("--max_latency_ms", type=float, default=2.0,
+                        help='time a request waits for others to batch with, in milliseconds')
+    parser.add_argument("--cache_size", type=int, default=0,
+                        help='number of distinct texts whose ids are cached, 0 disables the cache')
+    args = parser.parse_args()
+    if args.socket is None and args.port is None:
+        parser.error('give --socket and/or --port')
+
+    tokenizer = tokenization.FullTokenizer(args.model_file, do_lower_case=not args.cased,
+                                           cache_size=args.cache_size)
+    batcher = MicroBatcher(tokenizer, args.max_batch_size, args.max_latency_ms / 1000.0)
+    try:
+        asyncio.run(_serve(TokenizationServer(batcher), args))
+    finally:
+        batcher.close()
+        stats = batcher.stats()
+        print('served %(requests)d requests, %(texts)d texts in %(batches)d batches, '
+              '%(texts_per_batch).1f texts per batch' % stats, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()